@@ -0,0 +1,39 @@
+# 問題パックの作成（APIキー不要。Gemini APIは fake_genai で代替する）
+# 問題パックの作成処理と、アプリのオフライン出題の確認用
+#
+# 使い方（PP_ver2 ディレクトリで実行）:
+#   python bench/build_pack.py --out /tmp/question_pack.ppq --per-genre 100
+#   PP_QUESTION_PACK=/tmp/question_pack.ppq streamlit run pp.py   # GOOGLE_API_KEY なしで起動するとオフラインで出題する
+#
+# 引数は python -m pp_app.packs build と同じ（--source は指定できない）。
+# 生成した問題は --db のデータベース（省略時は一時ファイル）の問題バンクに保存する
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP_DIR = BENCH_DIR.parent
+
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(APP_DIR))
+import fake_genai  # noqa: E402
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    fake_genai.install()
+    os.environ["GOOGLE_API_KEY"] = "local"
+    os.environ.setdefault("PP_GEMINI_RPM", "1000000")
+    os.environ.setdefault("PP_GEMINI_TPM", "1000000000")
+    from streamlit import config as streamlit_config, logger as streamlit_logger
+    streamlit_config.set_option("global.showWarningOnDirectExecution", False)
+    streamlit_logger.set_log_level("error")
+
+    with tempfile.TemporaryDirectory(prefix="pp-pack-") as workdir:
+        if "--db" not in argv:
+            argv += ["--db", str(Path(workdir) / "learning_log.db")]
+        from pp_app import packs
+        return packs.main(["build", "--source", "gemini", *argv])
+
+if __name__ == "__main__":
+    sys.exit(main())
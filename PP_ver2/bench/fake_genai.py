@@ -0,0 +1,166 @@
+# ベンチマーク用のGemini APIの代替（install() で google.generativeai の代わりに読み込ませる）
+# 応答は pp.py のプロンプトと解析処理が想定する形式そのままのテキスト・JSONを返す
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+
+from google.api_core import exceptions as google_exceptions
+
+# 応答の設定（環境変数またはベンチマークの引数で変更する）
+LATENCY = float(os.getenv('PP_FAKE_LATENCY', '0'))  # 1回の応答にかかる秒数（ストリーミングの場合は最初の受信まで）
+JITTER = float(os.getenv('PP_FAKE_JITTER', '0'))  # 応答時間のばらつき（0〜この秒数を加える）
+ERROR_RATE = float(os.getenv('PP_FAKE_ERROR_RATE', '0'))  # 503エラーを返す割合（0〜1）
+MALFORMED_RATE = float(os.getenv('PP_FAKE_MALFORMED_RATE', '0'))  # 1問ずつの生成で「正解：」の行を欠いた応答を返す割合（0〜1）
+STREAM_CHUNK_SIZE = 20  # ストリーミングで1回に返す文字数
+MODEL_NAME = "models/gemini-2.0-flash"
+
+# 1問ずつ生成するときの応答（build_quiz_prompt() の出力形式）
+MULTIPLE_CHOICE_TEMPLATE = """質問：{genre}について述べた文として正しいものはどれですか。（{n}）
+選択肢1：{genre}には政治の中心が移り、新しい制度が整えられた。
+選択肢2：{genre}には外国との交流がすべて途絶えた。
+選択肢3：{genre}には身分制度が完全に廃止された。
+選択肢4：{genre}には貨幣が一切使われなかった。
+正解：1
+ジャンル：{genre}"""
+
+WRITTEN_TEMPLATE = """---
+質問：{genre}における政治体制の変化が社会に与えた影響を説明しなさい。（{n}）
+
+模範解答：
+・歴史的事実の説明：
+{genre}には政治の中心が移り、新しい統治の仕組みが整えられた。
+
+・社会的背景：
+それまでの支配層の力が弱まり、地方の有力者が台頭していた。
+
+・影響と意義：
+統治の安定によって経済や文化が発展し、次の時代の基盤となった。
+
+・具体例：
+法令の整備や土地制度の改革が行われた。
+---
+
+ジャンル：{genre}"""
+
+# まとめて生成する問題の題材（問題パックの作成で、ほぼ同じ問題として除かれないよう問題ごとに組み合わせを変える）
+_SUBJECTS = ["政治", "外交", "経済", "文化", "宗教", "土地制度", "身分制度", "軍事", "交通", "産業", "教育", "法律"]
+_ACTORS = ["朝廷", "幕府", "大名", "商人", "農民", "寺社", "武士", "外国の使節", "町人", "地方の豪族"]
+_ASPECTS = ["変化の理由", "主な出来事", "後の時代への影響", "人々の暮らし", "対立の原因", "制度の特徴"]
+_TOPICS = list(itertools.product(_SUBJECTS, _ACTORS, _ASPECTS))
+random.Random(0).shuffle(_TOPICS)
+
+_counter = itertools.count()
+_lock = threading.Lock()
+calls = {"generate_content": 0, "errors": 0, "list_models": 0}
+
+def _next_number():
+    with _lock:
+        return next(_counter)
+
+def _wait():
+    delay = LATENCY + (random.uniform(0, JITTER) if JITTER else 0)
+    if delay > 0:
+        time.sleep(delay)
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+class _Response:
+    def __init__(self, text, stream=False):
+        self.text = text
+        self._stream = stream
+
+    def __iter__(self):
+        for i in range(0, len(self.text), STREAM_CHUNK_SIZE):
+            yield _Chunk(self.text[i:i + STREAM_CHUNK_SIZE])
+
+# まとめて生成（build_batch_prompt() の「- 「ジャンル」：N問」の行から問題数を読み取る）
+def _batch_response(prompt):
+    items = []
+    for genre, count in re.findall(r"「(.+?)」：(\d+)問", prompt):
+        for _ in range(int(count)):
+            n = _next_number()
+            subject, actor, aspect = _TOPICS[n % len(_TOPICS)]
+            if "4択" in prompt:
+                items.append({
+                    "genre": genre,
+                    "question": f"{genre}の{subject}と{actor}：{aspect}として正しいものは？（{n}）",
+                    "options": [f"{genre}の説明{i}" for i in range(1, 5)],
+                    "correct": 1 + n % 4,
+                })
+            else:
+                items.append({
+                    "genre": genre,
+                    "question": f"{genre}の{subject}と{actor}：{aspect}を説明しなさい。（{n}）",
+                    "model_answer": {
+                        "歴史的事実の説明": f"{genre}には新しい統治の仕組みが整えられた。",
+                        "社会的背景": "それまでの支配層の力が弱まっていた。",
+                        "影響と意義": "経済や文化が発展し、次の時代の基盤となった。",
+                        "具体例": "法令の整備や土地制度の改革が行われた。",
+                    },
+                })
+    return json.dumps(items, ensure_ascii=False)
+
+# 記述式の再採点（build_review_prompt() に埋め込まれた回答の id ごとに得点を返す）
+def _review_response(prompt):
+    ids = re.findall(r'"id": (\d+), "question"', prompt)
+    return json.dumps([{"id": int(i), "score": random.randint(40, 90)} for i in ids])
+
+# 形式の修正（build_repair_prompt() に埋め込まれた元の応答に欠けている行を補う）
+def _repair_response(prompt):
+    text = prompt.split("テキスト：\n", 1)[1].strip()
+    if "選択肢1" in prompt and "正解" not in text:
+        text += "\n正解：1"
+    return text
+
+def _respond(prompt):
+    if "形式が崩れて" in prompt:
+        return _repair_response(prompt)
+    if "採点" in prompt:
+        return _review_response(prompt)
+    if "JSON" in prompt:
+        return _batch_response(prompt)
+    match = re.search(r"「(.+?)」", prompt)
+    genre = match.group(1) if match else "江戸時代"
+    template = MULTIPLE_CHOICE_TEMPLATE if "4択" in prompt else WRITTEN_TEMPLATE
+    text = template.format(genre=genre, n=_next_number())
+    if MALFORMED_RATE and random.random() < MALFORMED_RATE:
+        text = "\n".join(line for line in text.splitlines() if not line.startswith("正解"))
+    return text
+
+def configure(**kwargs):
+    pass
+
+def list_models(**kwargs):
+    with _lock:
+        calls["list_models"] += 1
+    return [types.SimpleNamespace(name=MODEL_NAME, supported_generation_methods=["generateContent"])]
+
+class GenerativeModel:
+    def __init__(self, model_name=MODEL_NAME, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        with _lock:
+            calls["generate_content"] += 1
+        _wait()
+        if ERROR_RATE and random.random() < ERROR_RATE:
+            with _lock:
+                calls["errors"] += 1
+            raise google_exceptions.ServiceUnavailable("fake outage")
+        return _Response(_respond(contents), stream=stream)
+
+# import google.generativeai がこのモジュールを返すようにする（pp.py を読み込む前に呼ぶ）
+def install():
+    import google
+    module = sys.modules[__name__]
+    sys.modules["google.generativeai"] = module
+    google.generativeai = module
+    return module
@@ -0,0 +1,748 @@
+# PPのベンチマーク（APIキー不要。Gemini APIは fake_genai で代替する）
+#
+# 使い方（PP_ver2 ディレクトリで実行）:
+#   python bench/run_benchmarks.py --output bench-results.json
+#   python bench/run_benchmarks.py --quick --compare bench-results.json
+#
+# pp.py と pp_app を一時ディレクトリにコピーして実行するため、手元の learning_log.db は変更しない
+import argparse
+import functools
+import importlib
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP_DIR = BENCH_DIR.parent
+
+sys.path.insert(0, str(BENCH_DIR))
+import fake_genai  # noqa: E402
+
+# --- 計測 ---
+
+# 最近順位法によるパーセンタイル
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+# 1回ごとの所要時間（秒）のリストを集計する（elapsed は全体の所要時間。スループットの計算に使う）
+def summarize(samples, elapsed=None, **extra):
+    values = sorted(samples)
+    result = {
+        "n": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+    if elapsed:
+        result["throughput_per_s"] = round(len(values) / elapsed, 2)
+    result.update(extra)
+    return result
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+# --- アプリの読み込み ---
+
+# Streamlitのサーバーなしではst.cache_resourceが値を保持しないため、読み込み中だけプロセス内の単純なキャッシュに差し替える
+# （実行時と同じく、データベースや実行キューを呼び出しごとに作り直さないようにする）
+def process_cache_resource(func=None, **kwargs):
+    if func is None:
+        return process_cache_resource
+    values = {}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        with lock:
+            if args not in values:
+                values[args] = func(*args)
+            return values[args]
+    wrapper.clear = values.clear
+    return wrapper
+
+APP_MODULES = (
+    "config", "metrics", "db", "scheduler", "answers", "parsing", "generation", "scoring", "transfer", "maintenance",
+    "novelty", "packs", "exam",
+)
+
+# アプリのファイル（pp.py と pp_app パッケージ）を一時ディレクトリにコピーする
+def copy_app(workdir):
+    shutil.copy(APP_DIR / "pp.py", workdir / "pp.py")
+    shutil.copytree(APP_DIR / "pp_app", workdir / "pp_app", ignore=shutil.ignore_patterns("__pycache__"))
+
+# 読み込み済みの pp_app を破棄する（画面の再実行の計測で読み込んだものを、差し替えたキャッシュで読み込み直すため）
+def unload_app():
+    for name in list(sys.modules):
+        if name == "pp_app" or name.startswith("pp_app."):
+            del sys.modules[name]
+
+# 一時ディレクトリの pp_app の各層を、Streamlitのサーバーなしでモジュールとして読み込む
+# （画面の描画は何もしないが、関数・キャッシュ・データベースは通常どおり動く）
+def load_app(workdir):
+    import streamlit as st
+    unload_app()
+    original = st.cache_resource
+    st.cache_resource = process_cache_resource
+    try:
+        modules = {name: importlib.import_module(f"pp_app.{name}") for name in APP_MODULES}
+    finally:
+        st.cache_resource = original
+    return types.SimpleNamespace(**modules)
+
+def new_app_test(workdir, timeout):
+    from streamlit.testing.v1 import AppTest
+    return AppTest.from_file(str(workdir / "pp.py"), default_timeout=timeout)
+
+# --- ベンチマーク ---
+
+# 起動時間（コンテナの起動直後と同じく、毎回新しいPythonプロセスで計測する）
+# 各ページのモジュールの読み込み時間と、最初の1回の描画時間を計る。学習ログのページでは
+# Gemini APIのSDKを読み込まないことも確認する（SDKの読み込み時間は startup.import.sdk で別に計る）
+STARTUP_IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+timings = {}
+start = time.perf_counter()
+import streamlit
+timings["startup.import.streamlit"] = time.perf_counter() - start
+start = time.perf_counter()
+import pp_app.pages.learning_log
+timings["startup.import.learning_log"] = time.perf_counter() - start
+sdk_loaded = any(name in sys.modules for name in ("google.generativeai", "google.api_core"))
+start = time.perf_counter()
+import pp_app.pages.quiz, pp_app.pages.written
+timings["startup.import.quiz_pages"] = time.perf_counter() - start
+start = time.perf_counter()
+import google.generativeai
+timings["startup.import.sdk"] = time.perf_counter() - start
+print(json.dumps({"timings": timings, "sdk_loaded_by_learning_log": sdk_loaded}))
+"""
+
+STARTUP_RENDER_SCRIPT = """
+import json, logging, os, sys, time, warnings
+sys.path.insert(0, sys.argv[1])
+sys.path.insert(0, sys.argv[2])
+mode = sys.argv[3]
+warnings.filterwarnings("ignore")
+if mode != "学習ログ":
+    import fake_genai
+    fake_genai.install()
+from streamlit import logger
+logger.set_log_level(logging.ERROR)
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(os.path.join(sys.argv[1], "pp.py"), default_timeout=120)
+at.session_state["mode"] = mode
+start = time.perf_counter()
+at.run()
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "elapsed": elapsed,
+    "sdk_loaded": "google.generativeai" in sys.modules,
+    "exceptions": [str(e.value) for e in at.exception],
+}))
+"""
+
+STARTUP_MODES = {"learning_log": "学習ログ", "quiz": "4択クイズ"}
+
+# 起動時間の目安（p50、ミリ秒）。--budget 名前=ミリ秒 で変更できる
+STARTUP_BUDGETS_MS = {
+    "startup.import.learning_log": 100,
+    "startup.import.quiz_pages": 200,
+    "startup.first_render.learning_log": 1000,
+    "startup.first_render.quiz": 1500,
+}
+
+def run_python(script, *args):
+    output = subprocess.run(
+        [sys.executable, "-c", script, *map(str, args)],
+        capture_output=True, text=True, check=True, env=dict(os.environ),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def bench_startup(workdir, repeats, results):
+    samples = {}
+    sdk_loaded = False
+    for _ in range(repeats):
+        report = run_python(STARTUP_IMPORT_SCRIPT, workdir)
+        for name, seconds in report["timings"].items():
+            samples.setdefault(name, []).append(seconds)
+        sdk_loaded = sdk_loaded or report["sdk_loaded_by_learning_log"]
+    for name, values in samples.items():
+        results[name] = summarize(values)
+
+    for name, mode in STARTUP_MODES.items():
+        renders = [run_python(STARTUP_RENDER_SCRIPT, workdir, BENCH_DIR, mode) for _ in range(repeats)]
+        results[f"startup.first_render.{name}"] = summarize([render["elapsed"] for render in renders])
+        exceptions = [message for render in renders for message in render["exceptions"]]
+        if exceptions:
+            results[f"startup.first_render.{name}.exceptions"] = exceptions
+        if name == "learning_log":
+            sdk_loaded = sdk_loaded or any(render["sdk_loaded"] for render in renders)
+    results["startup.learning_log_loads_sdk"] = sdk_loaded
+
+# 起動時間の目安を超えた項目の説明を返す（学習ログのページでSDKを読み込んだ場合も失敗とする）
+def check_budgets(results, budgets):
+    exceeded = []
+    for name, budget_ms in budgets.items():
+        result = results.get(name)
+        if isinstance(result, dict) and result["p50_ms"] > budget_ms:
+            exceeded.append(f"{name} {result['p50_ms']:.3f} ms（目安 {budget_ms:.0f} ms）")
+    if results.get("startup.learning_log_loads_sdk"):
+        exceeded.append("学習ログのページで Gemini APIのSDK（google.generativeai・google.api_core）が読み込まれています")
+    return exceeded
+
+# 画面の再実行（ボタン操作やウィジェットの変更のたびに走るスクリプト全体の実行）
+def bench_rerun(workdir, iterations, results):
+    at = new_app_test(workdir, timeout=60)
+    results["rerun.first_render"] = summarize([timed(at.run)])
+
+    # 4択問題を1問表示した状態の再実行
+    generate = []
+    for _ in range(max(1, iterations // 5)):
+        generate.append(timed(lambda: at.button(key="quiz_generate").click().run()))
+    results["rerun.generate_click"] = summarize(generate)
+    results["rerun.quiz_page"] = summarize([timed(at.run) for _ in range(iterations)])
+
+    # 回答後の再実行（回答の記録を含む）
+    at.button(key="quiz_generate").click().run()
+    answer_button = [button for button in at.button if button.label == "回答する"]
+    if answer_button:
+        results["rerun.answer_click"] = summarize([timed(answer_button[0].click().run)])
+
+    # 記述式クイズのページ（問題の生成は st.rerun() を使うため、ここでは再実行のみ計測する）
+    at.sidebar.radio[0].set_value("記述式クイズ").run()
+    results["rerun.written_page"] = summarize([timed(at.run) for _ in range(iterations)])
+    if at.exception:
+        results["rerun.exceptions"] = [str(e.value) for e in at.exception]
+
+# 問題文の生成と解析（実行キュー・レート制限・サーキットブレーカーを含む）
+def bench_generate_parse(app, iterations, concurrency_levels, results):
+    for quiz_type in ("multiple_choice", "written_answer"):
+        for concurrency in concurrency_levels:
+            failures = []
+            repairs = []
+
+            # 形式が崩れた応答は next_question() と同じく形式の修正を依頼して解析し直す
+            def generate_and_parse(i):
+                genre = app.config.GENRES[i % len(app.config.GENRES)]
+                start = time.perf_counter()
+                try:
+                    text = app.generation.request_quiz_text(quiz_type, genre)
+                    try:
+                        app.parsing.read_quiz(quiz_type, text)
+                    except app.parsing.QuizFormatError as e:
+                        repairs.append(i)
+                        app.generation.request_quiz_repair(quiz_type, text, e)
+                except Exception as e:
+                    failures.append(type(e).__name__)
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                samples = list(pool.map(generate_and_parse, range(iterations)))
+            elapsed = time.perf_counter() - start
+            results[f"generate_parse.{quiz_type}.c{concurrency}"] = summarize(
+                samples, elapsed, errors=len(failures), repairs=len(repairs)
+            )
+
+    # 解析のみ（APIの待ち時間を除いた処理時間）
+    texts = {
+        "multiple_choice": fake_genai.MULTIPLE_CHOICE_TEMPLATE.format(genre="江戸時代", n=0),
+        "written_answer": fake_genai.WRITTEN_TEMPLATE.format(genre="江戸時代", n=0),
+    }
+    for quiz_type, text in texts.items():
+        samples = [timed(lambda: app.parsing.parse_quiz(quiz_type, text)) for _ in range(iterations * 10)]
+        results[f"parse_only.{quiz_type}"] = summarize(samples, sum(samples))
+
+def make_answer(app, user_id, i):
+    genre = app.config.GENRES[i % len(app.config.GENRES)]
+    return (
+        f"ベンチマーク問題 {user_id} {i}",
+        "選択肢1",
+        "選択肢2",
+        i % 3 != 0,
+        genre,
+        None,
+        None,
+        "multiple_choice",
+        user_id,
+    )
+
+# 回答の記録（同時に書き込む学習者数ごと。1回答1トランザクション と ライトビハインド）
+def bench_record(app, answers_per_writer, writer_counts, results):
+    app.db.init_db()
+    router = app.db.get_database_router()
+    stats_caches = app.db.get_genre_stats_caches()
+    schedulers = app.scheduler.get_review_schedulers()
+
+    for writers in writer_counts:
+        # 1回答ごとにコミット（PP_WRITE_BEHIND=0 の場合と同じ経路）
+        def write_sync(writer):
+            user_id = f"bench-sync-{writers}-{writer}"
+            database = router.for_user(user_id)
+            samples = []
+            for i in range(answers_per_writer):
+                answer = make_answer(app, user_id, i)
+                start = time.perf_counter()
+                with database.transaction() as conn:
+                    versions, schedule = app.db.record_answers(conn, [answer])
+                app.answers.apply_recorded_answers([answer], versions, schedule, stats_caches, schedulers)
+                samples.append(time.perf_counter() - start)
+            return samples
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            samples = [sample for writer_samples in pool.map(write_sync, range(writers)) for sample in writer_samples]
+        results[f"record.sync.w{writers}"] = summarize(samples, time.perf_counter() - start)
+
+        # ライトビハインド（キューに入れてまとめてコミット。計測は投入から全件のコミット完了まで）
+        writer = app.answers.AnswerWriter(router, stats_caches, schedulers)
+
+        def submit_all(writer_index):
+            user_id = f"bench-queue-{writers}-{writer_index}"
+            samples = []
+            for i in range(answers_per_writer):
+                answer = make_answer(app, user_id, i)
+                samples.append(timed(lambda: writer.submit(answer)))
+            return samples
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            samples = [sample for writer_samples in pool.map(submit_all, range(writers)) for sample in writer_samples]
+        writer.flush()
+        elapsed = time.perf_counter() - start
+        stats = writer.stats()
+        results[f"record.write_behind.w{writers}"] = summarize(
+            samples, elapsed, commits=stats["commits"], failures=stats["failures"]
+        )
+
+# 学習ログに rows 件になるまで既定の学習者の回答を追加する（1秒間隔の時刻を割り当てる）
+def seed_learning_log(app, rows):
+    app.db.init_db()
+    database = app.db.get_user_database()
+    user_id = app.db.current_user_id()
+    with database.connection() as conn:
+        existing = conn.execute("SELECT COUNT(*) FROM learning_log WHERE user_id = ?", (user_id,)).fetchone()[0]
+    base = datetime.now(timezone.utc) - timedelta(seconds=rows)
+    batch = []
+    for i in range(existing, rows):
+        genre = app.config.GENRES[i % len(app.config.GENRES)]
+        batch.append((
+            (base + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+            f"ログ用の問題 {i}", "回答", "正解", i % 3 != 0, genre, user_id,
+        ))
+        if len(batch) >= 10000 or i == rows - 1:
+            with database.transaction() as conn:
+                conn.executemany('''
+                    INSERT INTO learning_log (timestamp, question, user_answer, correct_answer, is_correct, genre, user_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', batch)
+            batch = []
+
+# 既定の学習者の学習ログがちょうど rows 件だけある新しいデータベースを、計測の間だけアプリのデータベースにする
+# （seed_learning_log は行を足すだけなので、件数ごとに別のデータベースにして、前の件数の行や保守の状態を引き継がないようにする）
+@contextmanager
+def fresh_learning_log(app, workdir, name, rows):
+    router = app.db.DatabaseRouter(workdir / f"{name}_{rows}.db", metrics=app.metrics.get_metrics())
+    original = app.db.get_database_router
+    app.db.get_database_router = lambda: router
+    try:
+        seed_learning_log(app, rows)
+        yield router
+    finally:
+        app.db.get_database_router = original
+
+# 学習ログのページ取得（キーセット方式）と学習ログ画面の描画
+def bench_learning_log(app, workdir, row_counts, iterations, results):
+    for rows in row_counts:
+        seed_learning_log(app, rows)
+        page_size = 20
+
+        first_page = [timed(lambda: app.db.fetch_learning_log_page(page_size)) for _ in range(iterations)]
+        results[f"learning_log.first_page.{rows}"] = summarize(first_page)
+
+        # 中ほどのページ（前のページの最後の行をカーソルにする）
+        with app.db.get_user_database().connection() as conn:
+            cursor = conn.execute('''
+                SELECT timestamp, id FROM learning_log WHERE user_id = ?
+                ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?
+            ''', (app.db.current_user_id(), rows // 2)).fetchone()
+        middle_page = [timed(lambda: app.db.fetch_learning_log_page(page_size, cursor=cursor)) for _ in range(iterations)]
+        results[f"learning_log.middle_page.{rows}"] = summarize(middle_page)
+
+        filtered = [
+            timed(lambda: app.db.fetch_learning_log_page(page_size, genre=app.config.GENRES[0], is_correct=False))
+            for _ in range(iterations)
+        ]
+        results[f"learning_log.filtered_page.{rows}"] = summarize(filtered)
+
+        # 画面全体の描画（学習ログのページを表示した状態での再実行）
+        at = new_app_test(workdir, timeout=120)
+        at.run()
+        at.sidebar.radio[0].set_value("学習ログ").run()
+        results[f"learning_log.render.{rows}"] = summarize([timed(at.run) for _ in range(max(3, iterations // 10))])
+
+# 学習履歴のエクスポートとインポート（件数ごとの処理時間と、tracemallocで計ったメモリ使用量のピーク）
+# 行は少しずつ読み書きするため、件数を増やしても peak_kb はほぼ変わらないはず
+def bench_transfer(app, workdir, row_counts, results):
+    import tracemalloc
+    user_id = app.db.current_user_id()
+    formats = ["csv", "jsonl"]
+    try:
+        importlib.import_module("pyarrow.parquet")
+        formats.append("parquet")
+    except ImportError:
+        pass
+
+    def measure(name, run):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            count = run()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results[name] = summarize([elapsed], rows_per_s=round(count / elapsed) if elapsed else 0, peak_kb=round(peak / 1024))
+
+    for rows in row_counts:
+        with fresh_learning_log(app, workdir, "transfer", rows) as router:
+            for fmt in formats:
+                path = workdir / f"transfer_{rows}{app.transfer.EXPORT_FORMATS[fmt]}"
+
+                def export():
+                    with open(path, "wb") as out:
+                        return app.transfer.export_learning_log(router, out, fmt, user_id=user_id)
+
+                def import_():
+                    target = app.db.DatabaseRouter(workdir / f"transfer_{fmt}_{rows}.db")
+                    app.db.ensure_schema(target.shared)
+                    with open(path, "rb") as f:
+                        return app.transfer.import_learning_log(target, app.transfer.read_learning_log(f, fmt))["imported"]
+
+                measure(f"transfer.export.{fmt}.{rows}", export)
+                measure(f"transfer.import.{fmt}.{rows}", import_)
+
+# ジャンル統計の照合（初回は学習ログ全体を集計し、2回目以降は前回以降に追加された行だけを集計する）
+# 件数ごとに新しいデータベースを使うため、初回は照合済みの位置（stats_high_water）が0の状態から rows 件を集計する
+def bench_maintenance(app, workdir, row_counts, iterations, results):
+    user_id = app.db.current_user_id()
+    for rows in row_counts:
+        with fresh_learning_log(app, workdir, "maintenance", rows):
+            database = app.db.get_user_database()
+            results[f"maintenance.reconcile_first.{rows}"] = summarize([timed(lambda: app.maintenance.reconcile_genre_stats(database))])
+            samples = []
+            for i in range(iterations):
+                with database.transaction() as conn:
+                    app.db.record_answers(conn, [make_answer(app, user_id, rows + i)])
+                samples.append(timed(lambda: app.maintenance.reconcile_genre_stats(database)))
+            results[f"maintenance.reconcile_incremental.{rows}"] = summarize(samples)
+
+# 学習ログのキーワード検索（全文検索の索引を使う語と、索引を使えない2文字の語）
+# seed_learning_log の問題文はすべて「ログ用の問題」を含むため、common はすべての行に一致する最も遅い場合になる
+def bench_search(app, workdir, row_counts, iterations, results):
+    page_size = 20
+    for rows in row_counts:
+        with fresh_learning_log(app, workdir, "search", rows):
+            queries = {
+                "rare": f"ログ用の問題 {rows // 2}",
+                "common": "ログ用の問題",
+                "short": "正解",
+            }
+            for name, query in queries.items():
+                samples = [timed(lambda: app.db.search_learning_log(query, page_size)) for _ in range(iterations)]
+                results[f"search.{name}.{rows}"] = summarize(samples)
+            filtered = [
+                timed(lambda: app.db.search_learning_log(queries["common"], page_size, page=10, genre=app.config.GENRES[0], is_correct=False))
+                for _ in range(iterations)
+            ]
+            results[f"search.filtered_page.{rows}"] = summarize(filtered)
+
+# 直近に出題した問題とほぼ同じ問題の検出（履歴が NOVELTY_WINDOW 件ある状態での照合と追加）
+# 問題文はすべて同じ言い回しを含むため、多くの履歴が照合の候補になる遅い場合になる
+def bench_novelty(app, iterations, results):
+    app.db.init_db()
+    database = app.db.get_user_database()
+    index = app.novelty.NoveltyIndex(database, "bench-novelty")
+    rng = random.Random(0)
+
+    def make_question(i):
+        topic = "".join(rng.choice(app.config.GENRES[i % len(app.config.GENRES)]) for _ in range(8))
+        return f"{topic}（{i}）について、最も適切なものはどれですか？"
+
+    history = [make_question(i) for i in range(index.window)]
+    for question in history:
+        index.add(question)
+    questions = [make_question(index.window + i) for i in range(iterations)]
+    # 署名の計算だけ（保持している結果は使わない）
+    signature = app.novelty.question_signature.__wrapped__
+    results["novelty.signature"] = summarize([timed(lambda: signature(question)) for question in questions])
+    results["novelty.check_new"] = summarize([timed(lambda: index.find_duplicate(question)) for question in questions])
+    # 生成し直して言い回しだけが少し変わった問題
+    rephrased = [history[-1 - i % len(history)].replace("ですか？", "か。") for i in range(iterations)]
+    results["novelty.check_duplicate"] = summarize([timed(lambda: index.find_duplicate(question)) for question in rephrased])
+    results["novelty.add"] = summarize([timed(lambda: index.add(question)) for question in questions])
+
+# 問題パックの作成・読み込みと、ジャンルを指定した出題（問題形式・ジャンルごとに per_genre 問）
+def bench_pack(app, workdir, per_genre, iterations, results):
+    rng = random.Random(0)
+    genres = app.config.GENRES
+    quizzes = []
+    for quiz_type in app.packs.PACK_QUIZ_TYPES:
+        for genre in genres:
+            for i in range(per_genre):
+                # ほぼ同じ問題として除かれないよう、問題文の前半はランダムなひらがなにする
+                topic = "".join(chr(0x3041 + rng.randrange(80)) for _ in range(32))
+                question = f"{genre}の{topic}（{i}）について正しいものは？"
+                quiz = {"type": quiz_type, "genre": genre, "question": question}
+                if quiz_type == "multiple_choice":
+                    quiz["options"] = [f"{genre}の説明{j}" for j in range(1, 5)]
+                    quiz["correct"] = 1 + i % 4
+                else:
+                    quiz["answer"] = f"模範解答：\n{genre}には新しい統治の仕組みが整えられた。"
+                quizzes.append(quiz)
+    path = workdir / "question_pack.ppq"
+    results["pack.write"] = summarize([timed(lambda: app.packs.write_pack(path, quizzes))], questions=len(quizzes))
+    packs = []
+    results["pack.open"] = summarize([timed(lambda: packs.append(app.packs.QuestionPack(path))) for _ in range(iterations)])
+    pack = packs[0]
+    results["pack.sample_genre"] = summarize([
+        timed(lambda: pack.sample("multiple_choice", genres[i % len(genres)])) for i in range(iterations)
+    ])
+    results["pack.sample_any"] = summarize([timed(lambda: pack.sample("written_answer")) for _ in range(iterations)])
+    for pack in packs:
+        pack.close()
+
+# 模擬試験の問題をすべて用意するまでの時間（最初の問題が届くまでの時間と、1回のリクエストの応答時間も計る）
+# 代替APIの応答時間（--latency）を指定すると、並行して生成する効果が分かる
+def bench_exam(app, sizes, repeats, results):
+    app.db.init_db()
+    database = app.db.get_database()
+    executor = app.exam.get_exam_executor()
+    workers = app.exam.get_exam_workers()
+    model = app.generation.get_model_registry().model()
+    genres = app.config.GENRES
+    batch = {genre: 1 for genre in genres[:app.config.EXAM_BATCH_SIZE]}
+    results["exam.single_request"] = summarize([
+        timed(lambda: app.generation.request_quiz_batch("multiple_choice", batch, model=model, database=database, executor=executor))
+        for _ in range(repeats)
+    ])
+    for size in sizes:
+        first_samples = []
+        assemble_samples = []
+        for _ in range(repeats):
+            exam = app.exam.MockExam(size)
+            start = time.perf_counter()
+            exam.generate([genres[i % len(genres)] for i in range(size)], model, database, executor, workers)
+            first = None
+            while exam.generating:
+                if first is None and exam.questions():
+                    first = time.perf_counter() - start
+                time.sleep(0.001)
+            assemble_samples.append(time.perf_counter() - start)
+            first_samples.append(first if first is not None else assemble_samples[-1])
+        results[f"exam.first_question.{size}"] = summarize(first_samples)
+        results[f"exam.assemble.{size}"] = summarize(assemble_samples, questions=len(exam.questions()))
+
+# --- 結果の比較 ---
+
+# 前回の結果と p95 を比べ、threshold（割合）を超えて遅くなった項目を返す
+def compare_results(baseline, current, threshold, min_delta_ms):
+    regressions = []
+    rows = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not isinstance(result, dict) or not isinstance(before, dict) or "p95_ms" not in before:
+            continue
+        delta = result["p95_ms"] - before["p95_ms"]
+        ratio = delta / before["p95_ms"] if before["p95_ms"] else 0.0
+        rows.append((name, before["p95_ms"], result["p95_ms"], ratio))
+        if ratio > threshold and delta > min_delta_ms:
+            regressions.append(name)
+    return rows, regressions
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results, file=sys.stderr):
+    print(f"{'benchmark':45} {'n':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'ops/s':>10}", file=file)
+    for name, result in results.items():
+        if not isinstance(result, dict):
+            continue
+        print(
+            f"{name:45} {result['n']:>7} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+            f"{result['p99_ms']:>10.3f} {result.get('throughput_per_s', ''):>10}",
+            file=file,
+        )
+
+def parse_int_list(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="PPのベンチマーク（Gemini APIは代替実装を使う）")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    parser.add_argument("--compare", help="比較する前回の結果のJSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95がこの割合を超えて遅くなったら失敗とする")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="この時間（ミリ秒）以下の差は無視する")
+    parser.add_argument("--quick", action="store_true", help="件数を減らして短時間で実行する")
+    parser.add_argument("--only", default="startup,rerun,generate,record,log,transfer,maintenance,search,novelty,pack,exam", help="実行するベンチマーク（カンマ区切り）")
+    parser.add_argument("--budget", action="append", default=[], metavar="NAME=MS", help="起動時間の目安を変更する（p50、ミリ秒）")
+    parser.add_argument("--iterations", type=int, help="各計測の繰り返し回数")
+    parser.add_argument("--rows", help="学習ログの件数（カンマ区切り、既定: 10000,100000）")
+    parser.add_argument("--writers", help="同時に回答を記録する学習者数（カンマ区切り、既定: 1,4,8）")
+    parser.add_argument("--concurrency", help="問題生成の同時実行数（カンマ区切り、既定: 1,4）")
+    parser.add_argument("--latency", type=float, default=0.0, help="代替APIの応答時間（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="代替APIの応答時間のばらつき（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="代替APIが503エラーを返す割合（0〜1）")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="代替APIが形式の崩れた問題文を返す割合（0〜1）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    args = parser.parse_args()
+
+    iterations = args.iterations or (20 if args.quick else 100)
+    row_counts = parse_int_list(args.rows or ("1000,10000" if args.quick else "10000,100000"))
+    writer_counts = parse_int_list(args.writers or ("1,4" if args.quick else "1,4,8"))
+    concurrency_levels = parse_int_list(args.concurrency or "1,4")
+    selected = set(args.only.split(","))
+    budgets = dict(STARTUP_BUDGETS_MS)
+    for budget in args.budget:
+        name, _, value = budget.partition("=")
+        budgets[name] = float(value)
+    random.seed(args.seed)
+
+    fake_genai.LATENCY = args.latency
+    fake_genai.JITTER = args.jitter
+    fake_genai.ERROR_RATE = args.error_rate
+    fake_genai.MALFORMED_RATE = args.malformed_rate
+    fake_genai.install()
+
+    # ベンチマーク中にレート制限や先読みで結果がぶれないようにする（環境変数で上書き可能）
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("PP_GEMINI_RPM", "1000000")
+    os.environ.setdefault("PP_GEMINI_TPM", "1000000000")
+    os.environ.setdefault("PP_GENERATION_CONCURRENCY", str(max(concurrency_levels)))
+    os.environ.setdefault("PP_PREFETCH_DEPTH", "0")
+    os.environ.setdefault("PP_QUESTION_BANK_RATIO", "0")
+    os.environ.setdefault("PP_STREAMING", "0")
+    # サーバーなしで読み込むときの警告を表示しない
+    from streamlit import config as streamlit_config, logger as streamlit_logger
+    streamlit_config.set_option("global.showWarningOnDirectExecution", False)
+    streamlit_logger.set_log_level(logging.ERROR)
+    warnings.filterwarnings("ignore", message=".*was never awaited", category=RuntimeWarning)
+
+    workdir = Path(tempfile.mkdtemp(prefix="pp-bench-"))
+    copy_app(workdir)
+    sys.path.insert(0, str(workdir))
+    results = {}
+    try:
+        if "startup" in selected:
+            bench_startup(workdir, 3 if args.quick else 5, results)
+        # 画面の再実行は通常のst.cache_resourceで計測し、その後に各層を読み込み直す
+        if "rerun" in selected:
+            bench_rerun(workdir, iterations, results)
+
+        start = time.perf_counter()
+        app = load_app(workdir)
+        import_time = time.perf_counter() - start
+        results["import.app"] = summarize([import_time])
+
+        if "generate" in selected:
+            bench_generate_parse(app, iterations, concurrency_levels, results)
+        if "record" in selected:
+            bench_record(app, iterations, writer_counts, results)
+        if "log" in selected:
+            bench_learning_log(app, workdir, row_counts, iterations, results)
+        if "transfer" in selected:
+            bench_transfer(app, workdir, row_counts, results)
+        if "maintenance" in selected:
+            bench_maintenance(app, workdir, row_counts, iterations, results)
+        if "search" in selected:
+            bench_search(app, workdir, row_counts, iterations, results)
+        if "novelty" in selected:
+            bench_novelty(app, iterations, results)
+        if "pack" in selected:
+            bench_pack(app, workdir, 100 if args.quick else 1000, iterations, results)
+        if "exam" in selected:
+            bench_exam(app, [20, 50], 3 if args.quick else 10, results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    import streamlit
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "streamlit": streamlit.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                "iterations": iterations,
+                "rows": row_counts,
+                "writers": writer_counts,
+                "concurrency": concurrency_levels,
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "error_rate": args.error_rate,
+                "malformed_rate": args.malformed_rate,
+                "quick": args.quick,
+                "budgets_ms": budgets if "startup" in selected else None,
+            },
+            "fake_api_calls": dict(fake_genai.calls),
+        },
+        "results": results,
+    }
+
+    print_table(results)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    exceeded = check_budgets(results, budgets) if "startup" in selected else []
+    for message in exceeded:
+        print(f"起動時間の目安を超えました: {message}", file=sys.stderr)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        rows, regressions = compare_results(baseline, report, args.threshold, args.min_delta_ms)
+        print(f"\n前回の結果との比較（p95、{baseline['meta'].get('git_commit')} → {report['meta']['git_commit']}）", file=sys.stderr)
+        for name, before, after, ratio in rows:
+            mark = "  << 遅くなりました" if name in regressions else ""
+            print(f"{name:45} {before:>10.3f} → {after:>10.3f} ms ({ratio:+.1%}){mark}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+    if exceeded:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# PP - AIパーソナル学習（画面は pp.py、各層はこのパッケージのモジュールに分かれている）
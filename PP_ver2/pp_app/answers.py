@@ -0,0 +1,213 @@
+# 回答の記録（その場でのコミットと、まとめてコミットする書き込みキュー）
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import streamlit as st
+
+from pp_app.config import (
+    WRITE_BEHIND, WRITE_BEHIND_BACKOFF_BASE, WRITE_BEHIND_BACKOFF_MAX, WRITE_BEHIND_BATCH, WRITE_BEHIND_FLUSH_TIMEOUT,
+    WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_ATTEMPTS, WRITTEN_BORDERLINE_MARGIN,
+)
+from pp_app.db import current_user_id, get_database_router, get_genre_stats_caches, get_user_database, record_answers
+from pp_app.scheduler import get_review_schedulers
+from pp_app.transfer import EXPORT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+TAKE_BATCH_WAKE_CHECK = 0.05  # take_batch() で wake を確認する間隔（秒）
+
+# コミット済みの回答を、メモリ上に保持している学習者の統計・復習スケジュールに反映する
+def apply_recorded_answers(answers, versions, schedule, stats_caches, schedulers):
+    for user_id, version in versions.items():
+        cache = stats_caches.peek(user_id)
+        if cache:
+            cache.apply([answer for answer in answers if answer[8] == user_id], version)
+    for user_id, updates in schedule.items():
+        scheduler = schedulers.peek(user_id)
+        if scheduler:
+            scheduler.apply(updates)
+
+# キューから最初の1件を待って取り出し、そこから interval 秒以内に届いた分を最大 batch_size 件までまとめる
+# wake（threading.Event）を渡した場合は、それがセットされた時点で interval を待たずにまとめ終える
+def take_batch(q, interval, batch_size, wake=None):
+    batch = [q.get()]
+    deadline = time.time() + interval
+    while len(batch) < batch_size:
+        remaining = deadline - time.time()
+        if remaining <= 0 or (wake and wake.is_set()):
+            break
+        try:
+            batch.append(q.get(timeout=remaining if wake is None else min(remaining, TAKE_BATCH_WAKE_CHECK)))
+        except queue.Empty:
+            if wake is None:
+                break
+    return batch
+
+# 回答をまとめてコミットするバックグラウンドの書き込みキュー
+# 書き込みに失敗した回答は待ち時間を延ばしながら max_attempts 回まで試し、それでも書き込めなければ
+# データベースと同じ場所の JSONL ファイル（dead_letter_path）に退避する。退避したファイルは
+# python -m pp_app.transfer import で取り込める
+class AnswerWriter:
+    def __init__(self, router, stats_caches, schedulers, interval=WRITE_BEHIND_INTERVAL, batch_size=WRITE_BEHIND_BATCH,
+                 max_attempts=WRITE_BEHIND_MAX_ATTEMPTS, dead_letter_path=None):
+        self.router = router
+        self.stats_caches = stats_caches
+        self.schedulers = schedulers
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max(1, max_attempts)
+        self.dead_letter_path = dead_letter_path or router.db_path.with_name(f"{router.db_path.stem}_unwritten.jsonl")
+        self._queue = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._stats = {"written": 0, "commits": 0, "failures": 0, "dead_letters": 0}
+        self._sources = []  # このキューに回答を渡す前段のキュー（AIによる再採点）
+        self._thread = threading.Thread(target=self._run, name="pp-answer-writer", daemon=True)
+        self._thread.start()
+        # プロセス終了時に未書き込みの回答を書き出す
+        atexit.register(self.flush)
+
+    def submit(self, answer):
+        self._queue.put(answer)
+
+    # flush() のときに、先に溜まっている回答を渡させる前段のキュー（drain(deadline) を持つもの）を加える
+    def add_source(self, source):
+        self._sources.append(source)
+
+    def _run(self):
+        while True:
+            # 最初の回答が届いてから interval 秒以内にコミットする
+            self._write(take_batch(self._queue, self.interval, self.batch_size))
+
+    def _write(self, batch):
+        try:
+            with self._write_lock:
+                # 保存先のデータベースごとに1つのトランザクションでまとめて書き込む
+                groups = {}
+                for answer in batch:
+                    groups.setdefault(answer[8], []).append(answer)
+                databases = {}
+                unresolved = []
+                for user_id, answers in groups.items():
+                    try:
+                        databases.setdefault(self.router.for_user(user_id), []).extend(answers)
+                    except sqlite3.Error:
+                        # 保存先を開けなかった学習者の回答は、学習者ごとに開き直して書き込む
+                        self._stats["failures"] += 1
+                        unresolved.append(answers)
+                for database, answers in databases.items():
+                    self._write_database(database, answers)
+                for answers in unresolved:
+                    self._write_database(None, answers, attempts=1)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    # database が None の場合は、回答の学習者の保存先を開くところから試す
+    def _write_database(self, database, answers, attempts=0):
+        while attempts < self.max_attempts:
+            if attempts:
+                time.sleep(min(WRITE_BEHIND_BACKOFF_BASE * 2 ** (attempts - 1), WRITE_BEHIND_BACKOFF_MAX))
+            attempts += 1
+            try:
+                if database is None:
+                    database = self.router.for_user(answers[0][8])
+                with database.transaction() as conn:
+                    versions, schedule = record_answers(conn, answers)
+                apply_recorded_answers(answers, versions, schedule, self.stats_caches, self.schedulers)
+                self._stats["written"] += len(answers)
+                self._stats["commits"] += 1
+                return
+            except sqlite3.Error as e:
+                self._stats["failures"] += 1
+                error = e
+        self._dead_letter(answers, error)
+
+    # 書き込めなかった回答を、学習履歴のエクスポートと同じ JSONL 形式でファイルに追記する
+    def _dead_letter(self, answers, error):
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        lines = []
+        for question, user_answer, correct_answer, is_correct, genre, score, score_detail, quiz_type, user_id in answers:
+            row = (timestamp, user_id, quiz_type, genre, question, user_answer, correct_answer, bool(is_correct), score, score_detail)
+            lines.append(encode(dict(zip(EXPORT_COLUMNS, row))) + "\n")
+        self._stats["dead_letters"] += len(answers)
+        self.router.metrics.increment("answers.dead_letters", len(answers))
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+        except OSError as e:
+            logger.error("%d件の回答を書き込めず、退避もできませんでした（%s / %s）", len(answers), error, e)
+            return
+        logger.error("%d件の回答を書き込めなかったため %s に退避しました（%s）", len(answers), self.dead_letter_path, error)
+
+    # キューに溜まっている回答をすべて書き込む（学習履歴の書き出し・取り込み・削除の前に呼ぶ）
+    # review=False の場合、再採点を待っている回答はローカルの採点結果のまま書き込む
+    # 書き込み中の回答は timeout 秒まで待ち、すべて書き込めたか（退避した分を含む）を返す
+    def flush(self, timeout=WRITE_BEHIND_FLUSH_TIMEOUT, review=True):
+        deadline = time.time() + timeout
+        drained = all([source.drain(deadline, review=review) for source in self._sources])
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning("%d件の回答の書き込みが%.0f秒以内に終わりませんでした", self._queue.unfinished_tasks, timeout)
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return drained
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+@st.cache_resource
+def get_answer_writer():
+    return AnswerWriter(get_database_router(), get_genre_stats_caches(), get_review_schedulers())
+
+# 書き込みキューを使っている場合（ライトビハインド・AIによる再採点）、未書き込みの回答を書き出す
+# AIによる再採点は待たずに、ローカルの採点結果で書き込む（画面の操作をGemini APIの応答で待たせない）
+# 書き込みが終わらない場合は画面を止めずに、まだ反映されていない回答があることを表示する
+def flush_pending_answers():
+    if WRITE_BEHIND or WRITTEN_BORDERLINE_MARGIN > 0:
+        if not get_answer_writer().flush(review=False):
+            st.warning("書き込み中の回答があります。学習ログに反映されるまでしばらくお待ちください。")
+
+# 回答を記録（ライトビハインドが有効ならキューに入れて即座に戻る）
+# score・score_detail は記述式の得点とその内訳（JSON文字列）、quiz_type は問題形式（復習スケジュール用）
+def record_answer(question, user_answer, correct_answer, is_correct, genre, score=None, score_detail=None, quiz_type=None):
+    answer = (question, user_answer, correct_answer, bool(is_correct), genre, score, score_detail, quiz_type, current_user_id())
+    if WRITE_BEHIND:
+        get_answer_writer().submit(answer)
+        return
+    try:
+        with get_user_database().transaction() as conn:
+            versions, schedule = record_answers(conn, [answer])
+        apply_recorded_answers([answer], versions, schedule, get_genre_stats_caches(), get_review_schedulers())
+    except sqlite3.Error as e:
+        st.error(f"データベース操作中にエラーが発生しました: {str(e)}")
+
+# 複数の回答を1つのトランザクションで記録する（模擬試験の提出用。ライトビハインドの設定によらず、戻るまでにコミットする）
+# answers は record_answers() と同じ形式。記録できたかを返す
+def record_answers_at_once(answers):
+    try:
+        with get_user_database().transaction() as conn:
+            versions, schedule = record_answers(conn, answers)
+    except sqlite3.Error as e:
+        st.error(f"データベース操作中にエラーが発生しました: {str(e)}")
+        return False
+    apply_recorded_answers(answers, versions, schedule, get_genre_stats_caches(), get_review_schedulers())
+    return True
@@ -0,0 +1,133 @@
+# 設定（出題ジャンルと、環境変数で調整できる動作設定）
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+# 環境変数の読み込み（.env の PP_ で始まる設定もここで反映される）
+load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+
+# 出題ジャンル
+GENRES = [
+    "古代（縄文・弥生・古墳時代）",
+    "飛鳥・奈良時代",
+    "平安時代",
+    "鎌倉時代",
+    "室町時代",
+    "安土桃山時代",
+    "江戸時代",
+    "明治時代",
+    "大正時代",
+    "昭和時代",
+    "平成・令和時代"
+]
+
+# 使用するGeminiモデル
+GEMINI_MODEL = os.getenv('PP_GEMINI_MODEL', 'gemini-2.0-flash')  # 利用できない場合は最初に見つかったモデルを使う
+MODEL_DISCOVERY_TTL = int(os.getenv('PP_MODEL_DISCOVERY_TTL', '3600'))  # モデル一覧を再取得するまでの秒数
+
+# 先読み（プリフェッチ）の設定
+PREFETCH_DEPTH = int(os.getenv('PP_PREFETCH_DEPTH', '2'))  # ジャンルごとに保持する問題数（0で無効）
+PREFETCH_TTL = int(os.getenv('PP_PREFETCH_TTL', '1800'))  # 先読みした問題の有効期限（秒）
+PREFETCH_WORKERS = int(os.getenv('PP_PREFETCH_WORKERS', '2'))  # バックグラウンド生成のスレッド数
+
+# 問題バンクの設定
+QUESTION_BANK_RATIO = float(os.getenv('PP_QUESTION_BANK_RATIO', '0.5'))  # 保存済みの問題から出題する割合（0〜1）
+
+# 問題パックの設定（APIキーがない場合やGemini APIの障害時に出題する問題のファイル。python -m pp_app.packs build で作る）
+QUESTION_PACK = os.getenv('PP_QUESTION_PACK', '')  # 問題パックのファイル（空の場合は pp.py と同じ場所の question_pack.ppq）
+PACK_SAMPLE_ATTEMPTS = 5  # 直近に出題した問題とほぼ同じ問題を引いた場合に、問題パックから選び直す回数
+
+# まとめて生成の設定
+BATCH_MAX_SIZE = int(os.getenv('PP_BATCH_MAX_SIZE', '10'))  # 1回のリクエストで生成する最大問題数
+
+# 模擬試験の設定（複数ジャンルの4択問題を並行して生成し、まとめて採点する）
+EXAM_SIZES = [20, 30, 40, 50]  # 選べる問題数
+EXAM_BATCH_SIZE = int(os.getenv('PP_EXAM_BATCH_SIZE', '4'))  # 1回のリクエストで生成する問題数（小さいほど並行して生成され、最初の問題が早く届く）
+EXAM_CONCURRENCY = int(os.getenv('PP_EXAM_CONCURRENCY', '16'))  # 模擬試験の問題を同時に生成するリクエスト数の上限（プロセス全体。レート制限は通常の生成と共通）
+EXAM_SECONDS_PER_QUESTION = float(os.getenv('PP_EXAM_SECONDS_PER_QUESTION', '60'))  # 制限時間（1問あたりの秒数、0で制限なし）
+EXAM_POLL_INTERVAL = 0.5  # 問題を用意している間に画面を更新する間隔（秒）
+EXAM_COUNTDOWN_INTERVAL = 1.0  # 試験中に画面を再実行して残り時間の表示を更新する間隔（秒）
+EXAM_DUE_GENRE_WEIGHT = 3.0  # 模擬試験で、復習の期限が来た（試験中に来る）ジャンルを他のジャンルの何倍選びやすくするか
+
+# SQLiteの接続設定
+DB_POOL_SIZE = int(os.getenv('PP_DB_POOL_SIZE', '8'))  # プロセス全体で同時に使う接続数の上限
+DB_BUSY_TIMEOUT = float(os.getenv('PP_DB_BUSY_TIMEOUT', '5'))  # ロック待ち・接続待ちの上限（秒）
+DB_CACHE_SIZE_KB = int(os.getenv('PP_DB_CACHE_SIZE_KB', '8192'))  # 接続ごとのページキャッシュ（KB）
+DB_STATEMENT_CACHE = 256  # 接続ごとに保持するプリペアドステートメント数
+
+# 学習者ごとのデータの設定
+DEFAULT_USER_ID = "default"  # 学習者IDを指定しない場合（以前のバージョンのデータもこの学習者のものになる）
+USER_ID_MAX_LENGTH = 64
+DB_SHARDS = int(os.getenv('PP_DB_SHARDS', '1'))  # 2以上にすると学習者のデータをこの数のSQLiteファイルに分けて保存する
+USER_CACHE_SIZE = int(os.getenv('PP_USER_CACHE_SIZE', '512'))  # 統計・復習スケジュールをメモリに保持する学習者数の上限
+BANK_SAMPLE_SIZE = 20  # 問題バンクから未回答の問題を探すときに、一度に候補として取り出す問題数
+
+# ジャンル別統計のキャッシュ設定
+STATS_CACHE_TTL = int(os.getenv('PP_STATS_CACHE_TTL', '60'))  # 他プロセスによる更新を確認する間隔（秒）
+
+# 回答の書き込み設定（ライトビハインド：回答をキューに溜めてまとめてコミットする）
+WRITE_BEHIND = os.getenv('PP_WRITE_BEHIND', '0') == '1'  # 1で有効
+WRITE_BEHIND_INTERVAL = float(os.getenv('PP_WRITE_BEHIND_INTERVAL', '0.5'))  # 最初の回答からコミットまでの最大待ち時間（秒）
+WRITE_BEHIND_BATCH = int(os.getenv('PP_WRITE_BEHIND_BATCH', '200'))  # 1回のコミットでまとめる最大件数
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv('PP_WRITE_BEHIND_MAX_ATTEMPTS', '5'))  # 1回分の回答を書き込む最大試行回数（書き込めなかった回答はファイルに退避する）
+WRITE_BEHIND_BACKOFF_BASE = 0.1  # 再試行までの待ち時間の基準（秒）
+WRITE_BEHIND_BACKOFF_MAX = 2.0  # 再試行までの待ち時間の上限（秒）
+WRITE_BEHIND_FLUSH_TIMEOUT = float(os.getenv('PP_WRITE_BEHIND_FLUSH_TIMEOUT', '10'))  # 学習ログの表示前などに、未書き込みの回答の書き込みを待つ最大時間（秒）
+
+# 問題生成の再試行とサーキットブレーカーの設定
+GENERATION_DEADLINE = float(os.getenv('PP_GENERATION_DEADLINE', '30'))  # 1回の問題生成にかける最大時間（秒、再試行を含む）
+GENERATION_MAX_ATTEMPTS = int(os.getenv('PP_GENERATION_MAX_ATTEMPTS', '3'))  # 再試行を含む最大試行回数
+GENERATION_BACKOFF_BASE = 0.5  # 再試行までの待ち時間の基準（秒）
+GENERATION_BACKOFF_MAX = 8.0  # 再試行までの待ち時間の上限（秒）
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('PP_BREAKER_FAILURE_THRESHOLD', '5'))  # 連続でこの回数失敗すると生成を止める
+BREAKER_RESET_TIMEOUT = float(os.getenv('PP_BREAKER_RESET_TIMEOUT', '30'))  # 止めてから試しに再開するまでの秒数
+
+# Gemini APIの呼び出し制限（全セッション共通）
+GEMINI_RPM = int(os.getenv('PP_GEMINI_RPM', '60'))  # 1分あたりのリクエスト数の上限
+GEMINI_TPM = int(os.getenv('PP_GEMINI_TPM', '1000000'))  # 1分あたりのトークン数の上限
+GENERATION_CONCURRENCY = int(os.getenv('PP_GENERATION_CONCURRENCY', '4'))  # 同時に実行するリクエスト数の上限
+
+# その場で生成するときに、問題文を受信しながら表示する（0で無効）
+STREAMING = os.getenv('PP_STREAMING', '1') == '1'
+
+# 応答の形式が崩れていた場合に、問題を作り直さずに形式だけの修正を依頼する（0で無効）
+PARSE_REPAIR = os.getenv('PP_PARSE_REPAIR', '1') == '1'
+
+# 復習スケジュール（SM-2方式）の設定
+SR_RELEARN_DELAY = float(os.getenv('PP_SR_RELEARN_DELAY', '600'))  # 間違えた問題・ジャンルを再び出題するまでの秒数
+SR_DEFER = float(os.getenv('PP_SR_DEFER', '60'))  # 出題したジャンル・問題を、回答が記録されるまで後回しにする秒数
+SR_INITIAL_EASE = 2.5  # 復習間隔の初期の伸び率
+SR_MIN_EASE = 1.3  # 復習間隔の伸び率の下限
+
+# 直近に出題した問題とほぼ同じ問題の検出（問題文の文字の3つ組の MinHash と LSH）
+NOVELTY_WINDOW = int(os.getenv('PP_NOVELTY_WINDOW', '200'))  # 比べる対象にする、学習者ごとの直近の出題数（0で無効）
+NOVELTY_THRESHOLD = float(os.getenv('PP_NOVELTY_THRESHOLD', '0.7'))  # 問題文の類似度（Jaccard係数、0〜1）がこの値以上なら同じ問題とみなす
+NOVELTY_PERMUTATIONS = 64  # MinHashの署名の長さ（長いほど類似度の推定が正確になるが、計算に時間がかかる）
+NOVELTY_SHINGLE_SIZE = 3  # 問題文を何文字ずつの組に分けて比べるか
+
+# 記述式の採点設定（模範解答との文字n-gramの一致度で採点し、合格点付近だけAIで再採点する）
+WRITTEN_PASS_SCORE = float(os.getenv('PP_WRITTEN_PASS_SCORE', '60'))  # 正解とみなす得点（0〜100）
+WRITTEN_BORDERLINE_MARGIN = float(os.getenv('PP_WRITTEN_BORDERLINE_MARGIN', '10'))  # 合格点±この範囲の回答をAIで再採点する（0で無効）
+WRITTEN_FULL_CREDIT_COVERAGE = 0.5  # 観点ごとの重要な語句をこの割合含んでいれば満点とする
+SCORING_CORPUS_TTL = 600  # 語句の重要度（IDF）を問題バンクから計算し直す間隔（秒）
+REVIEW_INTERVAL = float(os.getenv('PP_REVIEW_INTERVAL', '5'))  # 再採点をまとめて依頼するまでの最大待ち時間（秒）
+REVIEW_BATCH = int(os.getenv('PP_REVIEW_BATCH', '10'))  # 1回のリクエストで再採点する最大件数
+
+# 計測の設定（デバッグモードで表示し、ファイルにも書き出せる）
+METRICS_FILE = os.getenv('PP_METRICS_FILE')  # 計測結果の書き出し先（.json ならJSON、それ以外はPrometheusのテキスト形式）
+METRICS_EXPORT_INTERVAL = float(os.getenv('PP_METRICS_EXPORT_INTERVAL', '15'))  # 書き出す最短の間隔（秒）
+METRICS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # ヒストグラムの区切り（秒）
+DB_LOCK_WAIT_THRESHOLD = 0.005  # 書き込みロックの取得にこの秒数以上かかった場合をロック待ちとして数える
+
+# データベースの保守（統計の照合・古い学習ログの集計・空き領域の解放）
+MAINTENANCE_INTERVAL = float(os.getenv('PP_MAINTENANCE_INTERVAL', '3600'))  # バックグラウンドで保守を行う間隔（秒、0で無効）
+LOG_RETENTION_DAYS = int(os.getenv('PP_LOG_RETENTION_DAYS', '0'))  # この日数より古い学習ログを日別の集計にまとめる（0で無効）
+MAINTENANCE_BATCH = 5000  # 1回のトランザクションで集計にまとめる学習ログの行数
+VACUUM_PAGES = int(os.getenv('PP_VACUUM_PAGES', '1000'))  # 1回の保守で解放する空きページ数の上限
+VACUUM_CONVERT_MAX_MB = float(os.getenv('PP_VACUUM_CONVERT_MAX_MB', '16'))  # 空きページを解放できない既存のファイルを、アプリの保守で作り直す最大のサイズ（MB）
+
+# 学習ログの検索
+SEARCH_RANK_WINDOW = int(os.getenv('PP_SEARCH_RANK_WINDOW', '10000'))  # 関連度順に並べる対象にする、新しい順の一致件数（0ですべて）
+
+# 学習履歴のエクスポート・インポート
+TRANSFER_BATCH_SIZE = int(os.getenv('PP_TRANSFER_BATCH_SIZE', '1000'))  # 1回に読み書きする行数（メモリ使用量はこの行数分で一定）
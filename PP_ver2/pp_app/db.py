@@ -0,0 +1,1003 @@
+# データベース層（SQLite接続のプール、学習者ごとの振り分け、スキーマのマイグレーション、統計・学習ログ・問題バンクの読み書き）
+import json
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import streamlit as st
+
+from pp_app.config import (
+    BANK_SAMPLE_SIZE, DB_BUSY_TIMEOUT, DB_CACHE_SIZE_KB, DB_LOCK_WAIT_THRESHOLD, DB_POOL_SIZE, DB_SHARDS,
+    DB_STATEMENT_CACHE, DEFAULT_USER_ID, GENRES, SEARCH_RANK_WINDOW, SR_INITIAL_EASE, SR_MIN_EASE, SR_RELEARN_DELAY,
+    STATS_CACHE_TTL, USER_CACHE_SIZE, USER_ID_MAX_LENGTH,
+)
+from pp_app.metrics import Metrics, get_metrics
+
+# データベースファイルのパスを設定
+def get_db_path():
+    if 'STREAMLIT_SHARING_MODE' in os.environ:
+        # Streamlit Cloud環境での保存先
+        return Path.home() / '.streamlit' / 'learning_log.db'
+    else:
+        # ローカル環境での保存先
+        return Path(__file__).resolve().parent.parent / 'learning_log.db'
+
+# よく使うSQL（接続を使い回すことで、プリペアドステートメントがキャッシュされたまま再利用される）
+# 学習者ごとのデータは user_id を先頭にした主キー・インデックスで引くため、学習者が増えても読む範囲は一定
+SQL_SELECT_GENRE_STATS = '''
+    SELECT genre, total_questions, correct_answers
+    FROM genre_stats
+    WHERE user_id = ?
+'''
+SQL_INSERT_LEARNING_LOG = '''
+    INSERT INTO learning_log (question, user_answer, correct_answer, is_correct, genre, score, score_detail, quiz_type, user_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_UPDATE_GENRE_STATS = '''
+    INSERT INTO genre_stats (user_id, genre, total_questions, correct_answers)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, genre) DO UPDATE
+    SET total_questions = total_questions + excluded.total_questions,
+        correct_answers = correct_answers + excluded.correct_answers,
+        last_updated = CURRENT_TIMESTAMP
+'''
+SQL_BUMP_STATS_VERSION = '''
+    INSERT INTO cache_versions (name, version) VALUES (?, 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1
+'''
+SQL_SELECT_STATS_VERSION = '''
+    SELECT version FROM cache_versions WHERE name = ?
+'''
+SQL_SELECT_REVIEW_GENRE = '''
+    SELECT repetitions, interval_days, ease FROM review_genres WHERE user_id = ? AND genre = ?
+'''
+SQL_REPLACE_REVIEW_GENRE = '''
+    INSERT OR REPLACE INTO review_genres (user_id, genre, repetitions, interval_days, ease, due_at, last_reviewed)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_SELECT_REVIEW_ITEM = '''
+    SELECT repetitions, interval_days, ease FROM review_items WHERE user_id = ? AND quiz_type = ? AND question = ?
+'''
+SQL_REPLACE_REVIEW_ITEM = '''
+    INSERT OR REPLACE INTO review_items
+    (user_id, quiz_type, question, genre, repetitions, interval_days, ease, due_at, last_reviewed)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_QUESTION_BANK = '''
+    INSERT OR IGNORE INTO question_bank (quiz_type, genre, question, options, correct_index, model_answer)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# SQLite接続のプール（WALモードで読み書きを並行させ、接続をスレッド間で使い回す）
+class Database:
+    def __init__(self, db_path, pool_size=DB_POOL_SIZE, metrics=None):
+        self.db_path = Path(db_path)
+        self.metrics = metrics or Metrics()
+        # データベースディレクトリの作成
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        # マイグレーションの実行状態（init_db() を参照）
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+
+    def _connect(self):
+        # isolation_level=None: トランザクションは transaction() で明示的に開始する
+        conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=DB_BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        # 新しく作るデータベースは、最初から空きページを少しずつ解放できるようにする（既存のファイルには効かない）
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    # 接続を1つ借りる（読み取り用。各文は自動コミット）
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(blocking=False):
+            # 接続の空き待ち（同時に使う接続数が上限に達している）
+            self.metrics.increment("db.pool_waits")
+            with self.metrics.span("db.pool_wait"):
+                if not self._slots.acquire(timeout=DB_BUSY_TIMEOUT):
+                    raise sqlite3.OperationalError("データベース接続の空きがありません")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    # 書き込み用のトランザクション（途中で例外が起きた場合はロールバック）
+    @contextmanager
+    def transaction(self):
+        with self.metrics.span("db.write"), self.connection() as conn:
+            # 先に書き込みロックを取ることで、読み取りからの昇格時のロック競合を避ける
+            started = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError:
+                self.metrics.increment("db.busy_errors")
+                raise
+            finally:
+                waited = time.perf_counter() - started
+                self.metrics.observe("db.lock_wait", waited)
+                if waited >= DB_LOCK_WAIT_THRESHOLD:
+                    self.metrics.increment("db.lock_waits")
+            yield conn
+            conn.execute("COMMIT")
+
+# 共有データ（問題バンク）のデータベースと、学習者ごとのデータを保存するデータベースの振り分け
+# シャードを使わない場合は、どちらも同じデータベースになる
+class DatabaseRouter:
+    def __init__(self, db_path, shards=DB_SHARDS, metrics=None):
+        self.db_path = Path(db_path)
+        self.shards = shards
+        self.metrics = metrics or Metrics()
+        self.shared = Database(self.db_path, metrics=self.metrics)
+        self._shard_databases = {}
+        self._lock = threading.Lock()
+
+    # 学習者IDから保存先を決める（プロセスや再起動をまたいでも同じ結果になるハッシュを使う）
+    def for_user(self, user_id):
+        if self.shards <= 1:
+            return self.shared
+        index = zlib.crc32(user_id.encode('utf-8')) % self.shards
+        with self._lock:
+            database = self._shard_databases.get(index)
+            if database is None:
+                database = Database(self.db_path.with_name(f"{self.db_path.stem}_shard{index}.db"), metrics=self.metrics)
+                self._shard_databases[index] = database
+        ensure_schema(database)
+        return database
+
+    def databases(self):
+        with self._lock:
+            return [self.shared, *self._shard_databases.values()]
+
+    # 学習者のデータを保存するすべてのデータベース（まだ開いていないシャードも含む）
+    def user_databases(self):
+        if self.shards <= 1:
+            return [self.shared]
+        databases = []
+        for index in range(self.shards):
+            with self._lock:
+                database = self._shard_databases.get(index)
+                if database is None:
+                    database = Database(self.db_path.with_name(f"{self.db_path.stem}_shard{index}.db"), metrics=self.metrics)
+                    self._shard_databases[index] = database
+            ensure_schema(database)
+            databases.append(database)
+        return databases
+
+# データベース接続はプロセス全体で共有する
+# （バックグラウンドスレッドからはst.cache_resourceが使えないため、必要な処理には引数で渡す）
+@st.cache_resource
+def get_database_router():
+    return DatabaseRouter(get_db_path(), metrics=get_metrics())
+
+# 問題バンクなど、全学習者で共有するデータのデータベース
+def get_database():
+    return get_database_router().shared
+
+# 現在の学習者ID（サイドバーで切り替える。未設定の場合は既定の学習者）
+def current_user_id():
+    return st.session_state.get('user_id', DEFAULT_USER_ID)
+
+def normalize_user_id(text):
+    return (text or "").strip()[:USER_ID_MAX_LENGTH] or DEFAULT_USER_ID
+
+# 現在の学習者のデータを保存するデータベース
+def get_user_database():
+    return get_database_router().for_user(current_user_id())
+
+# 学習者ごとのキャッシュ（統計・復習スケジュール）を、最近使った学習者から一定数だけ保持する
+class UserCacheRegistry:
+    def __init__(self, factory, capacity=USER_CACHE_SIZE):
+        self.factory = factory
+        self.capacity = capacity
+        self._caches = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            cache = self._caches.get(user_id)
+            if cache is None:
+                cache = self._caches[user_id] = self.factory(user_id)
+                if len(self._caches) > self.capacity:
+                    self._caches.popitem(last=False)
+            else:
+                self._caches.move_to_end(user_id)
+            return cache
+
+    # 保持している場合だけ返す（保持していない学習者は、次に使うときにSQLiteから読み込まれる）
+    def peek(self, user_id):
+        with self._lock:
+            return self._caches.get(user_id)
+
+# --- スキーマのマイグレーション ---
+# 各ステップは一度だけ適用され、適用済みのバージョンは schema_version テーブルに記録される。
+# 新しい列やインデックスを追加するときは、MIGRATIONS の末尾にステップを追加すること。
+
+# 列が存在しない場合だけ追加する（SQLiteには ADD COLUMN IF NOT EXISTS がないため）
+def add_column_if_missing(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def migrate_initial_tables(conn):
+    # 学習ログテーブルの作成
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS learning_log
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+         question TEXT,
+         user_answer TEXT,
+         correct_answer TEXT,
+         is_correct BOOLEAN,
+         genre TEXT)
+    ''')
+    
+    # ジャンルごとの統計テーブル
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS genre_stats
+        (genre TEXT PRIMARY KEY,
+         total_questions INTEGER DEFAULT 0,
+         correct_answers INTEGER DEFAULT 0,
+         last_updated DATETIME DEFAULT CURRENT_TIMESTAMP)
+    ''')
+    
+    # 初期ジャンルの登録
+    for genre in GENRES:
+        conn.execute('''
+            INSERT OR IGNORE INTO genre_stats (genre, total_questions, correct_answers)
+            VALUES (?, 0, 0)
+        ''', (genre,))
+
+def migrate_question_bank(conn):
+    # 生成済み問題の保存テーブル（問題バンク）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS question_bank
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+         quiz_type TEXT,
+         genre TEXT,
+         question TEXT,
+         options TEXT,
+         correct_index INTEGER,
+         model_answer TEXT,
+         UNIQUE (quiz_type, question))
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_question_bank_type_genre
+        ON question_bank (quiz_type, genre)
+    ''')
+    # 出題済みかどうかの判定用
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_learning_log_question
+        ON learning_log (question)
+    ''')
+
+def migrate_learning_log_indexes(conn):
+    # 学習ログのページ送り（新しい順）とジャンル絞り込み用
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_learning_log_timestamp
+        ON learning_log (timestamp, id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_learning_log_genre_timestamp
+        ON learning_log (genre, timestamp, id)
+    ''')
+
+def migrate_cache_versions(conn):
+    # プロセス内キャッシュの検証用。統計を更新するトランザクションで version を1つ進める
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions
+        (name TEXT PRIMARY KEY,
+         version INTEGER DEFAULT 0)
+    ''')
+    conn.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('genre_stats', 0)")
+
+def migrate_answer_scores(conn):
+    # 記述式の得点（0〜100）と観点ごとの内訳（JSON）。4択の回答では NULL
+    add_column_if_missing(conn, "learning_log", "score", "REAL")
+    add_column_if_missing(conn, "learning_log", "score_detail", "TEXT")
+
+def migrate_review_schedule(conn):
+    # 復習スケジュールを問題ごとに持つため、学習ログにも問題形式を記録する
+    add_column_if_missing(conn, "learning_log", "quiz_type", "TEXT")
+    # ジャンルごと・問題ごとの復習スケジュール（due_at, last_reviewed はUNIX時刻）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS review_genres
+        (genre TEXT PRIMARY KEY,
+         repetitions INTEGER DEFAULT 0,
+         interval_days REAL DEFAULT 0,
+         ease REAL,
+         due_at REAL,
+         last_reviewed REAL)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS review_items
+        (quiz_type TEXT,
+         question TEXT,
+         genre TEXT,
+         repetitions INTEGER DEFAULT 0,
+         interval_days REAL DEFAULT 0,
+         ease REAL,
+         due_at REAL,
+         last_reviewed REAL,
+         PRIMARY KEY (quiz_type, question))
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_review_items_due
+        ON review_items (quiz_type, due_at)
+    ''')
+    # スケジュールの初期値は migrate_user_partitioning() で学習ログから作る
+
+# 復習スケジュールの初期値を作るときのSM-2の設定（このマイグレーションを作った時点の値に固定する。
+# 後から設定や sm2_next()・update_review_schedule() を変えても、このマイグレーションの結果は変わらない）
+BACKFILL_INITIAL_EASE = 2.5
+BACKFILL_MIN_EASE = 1.3
+BACKFILL_RELEARN_DELAY = 600
+
+# これまでの学習ログを古い順に再生して、復習スケジュールの初期値を作る（問題形式は問題バンクから補う）
+# スケジュールはメモリ上で計算し、最後にまとめて書き込む
+def backfill_review_schedule(conn):
+    def next_state(state, quality, now):
+        repetitions, interval, ease = state[:3] if state else (0, 0.0, BACKFILL_INITIAL_EASE)
+        if quality >= 3:
+            repetitions += 1
+            interval = 1.0 if repetitions == 1 else 6.0 if repetitions == 2 else interval * ease
+            due_at = now + interval * 86400
+        else:
+            repetitions = 0
+            interval = 0.0
+            due_at = now + BACKFILL_RELEARN_DELAY
+        ease = max(BACKFILL_MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        return repetitions, interval, ease, due_at, now
+
+    quiz_types = dict(conn.execute("SELECT question, quiz_type FROM question_bank").fetchall())
+    genres = {}  # (user_id, genre) -> (repetitions, interval_days, ease, due_at, last_reviewed)
+    items = {}  # (user_id, quiz_type, question) -> (genre, repetitions, interval_days, ease, due_at, last_reviewed)
+    rows = conn.execute('''
+        SELECT timestamp, question, is_correct, genre, score, user_id
+        FROM learning_log
+        ORDER BY timestamp, id
+    ''')
+    for timestamp, question, is_correct, genre, score, user_id in rows.fetchall():
+        try:
+            answered_at = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            answered_at = time.time()
+        quality = min(5, int(score // 20)) if score is not None else 4 if is_correct else 1
+        genres[(user_id, genre)] = next_state(genres.get((user_id, genre)), quality, answered_at)
+        quiz_type = quiz_types.get(question)
+        if quiz_type:
+            key = (user_id, quiz_type, question)
+            state = items.get(key)
+            items[key] = (genre, *next_state(state[1:] if state else None, quality, answered_at))
+    conn.executemany('''
+        INSERT OR REPLACE INTO review_genres (user_id, genre, repetitions, interval_days, ease, due_at, last_reviewed)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(*key, *state) for key, state in genres.items()])
+    conn.executemany('''
+        INSERT OR REPLACE INTO review_items
+        (user_id, quiz_type, question, genre, repetitions, interval_days, ease, due_at, last_reviewed)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(*key, *state) for key, state in items.items()])
+
+# テーブルを作り直す（SQLiteでは主キーを変更できないため）。columns は新しいテーブルに移す列
+def rebuild_table(conn, table, definition, columns, select):
+    conn.execute(f"CREATE TABLE {table}_new ({definition})")
+    conn.execute(f"INSERT INTO {table}_new ({columns}) SELECT {select} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+# 既定の学習者の統計キャッシュのバージョン名（このマイグレーションを作った時点の stats_version_name() の値に固定する）
+PARTITION_STATS_VERSION_NAME = f"genre_stats:{DEFAULT_USER_ID}"
+
+def migrate_user_partitioning(conn):
+    # これまでのデータはすべて既定の学習者のものとする
+    add_column_if_missing(conn, "learning_log", "user_id", f"TEXT NOT NULL DEFAULT '{DEFAULT_USER_ID}'")
+    # 学習ログの検索はすべて学習者で絞り込むため、学習者IDを先頭にしたインデックスに置き換える
+    conn.execute("DROP INDEX IF EXISTS idx_learning_log_timestamp")
+    conn.execute("DROP INDEX IF EXISTS idx_learning_log_genre_timestamp")
+    conn.execute("DROP INDEX IF EXISTS idx_learning_log_question")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_learning_log_user_timestamp
+        ON learning_log (user_id, timestamp, id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_learning_log_user_genre_timestamp
+        ON learning_log (user_id, genre, timestamp, id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_learning_log_user_question
+        ON learning_log (user_id, question)
+    ''')
+    
+    # 統計・復習スケジュールは学習者ごとの行にする（行は最初の回答時に作成される）
+    rebuild_table(
+        conn, "genre_stats",
+        '''user_id TEXT,
+           genre TEXT,
+           total_questions INTEGER DEFAULT 0,
+           correct_answers INTEGER DEFAULT 0,
+           last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (user_id, genre)''',
+        "user_id, genre, total_questions, correct_answers, last_updated",
+        f"'{DEFAULT_USER_ID}', genre, total_questions, correct_answers, last_updated",
+    )
+    rebuild_table(
+        conn, "review_genres",
+        '''user_id TEXT,
+           genre TEXT,
+           repetitions INTEGER DEFAULT 0,
+           interval_days REAL DEFAULT 0,
+           ease REAL,
+           due_at REAL,
+           last_reviewed REAL,
+           PRIMARY KEY (user_id, genre)''',
+        "user_id, genre, repetitions, interval_days, ease, due_at, last_reviewed",
+        f"'{DEFAULT_USER_ID}', genre, repetitions, interval_days, ease, due_at, last_reviewed",
+    )
+    rebuild_table(
+        conn, "review_items",
+        '''user_id TEXT,
+           quiz_type TEXT,
+           question TEXT,
+           genre TEXT,
+           repetitions INTEGER DEFAULT 0,
+           interval_days REAL DEFAULT 0,
+           ease REAL,
+           due_at REAL,
+           last_reviewed REAL,
+           PRIMARY KEY (user_id, quiz_type, question)''',
+        "user_id, quiz_type, question, genre, repetitions, interval_days, ease, due_at, last_reviewed",
+        f"'{DEFAULT_USER_ID}', quiz_type, question, genre, repetitions, interval_days, ease, due_at, last_reviewed",
+    )
+    # 統計キャッシュのバージョンも学習者ごとに持つ
+    conn.execute(
+        "UPDATE cache_versions SET name = ? WHERE name = 'genre_stats'",
+        (PARTITION_STATS_VERSION_NAME,)
+    )
+    if not conn.execute("SELECT 1 FROM review_genres LIMIT 1").fetchone():
+        backfill_review_schedule(conn)
+
+def migrate_maintenance(conn):
+    # 保守処理（pp_app/maintenance.py）の状態。stats_high_water までの学習ログは genre_stats_baseline に集計済み
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_state
+        (name TEXT PRIMARY KEY,
+         value INTEGER DEFAULT 0)
+    ''')
+    conn.execute("INSERT OR IGNORE INTO maintenance_state (name, value) VALUES ('stats_high_water', 0)")
+    # 学習ログから集計した正しい統計（genre_stats との照合に使う）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS genre_stats_baseline
+        (user_id TEXT,
+         genre TEXT,
+         total_questions INTEGER DEFAULT 0,
+         correct_answers INTEGER DEFAULT 0,
+         PRIMARY KEY (user_id, genre))
+    ''')
+    # 集計済みの学習ログが削除されたら、集計からも差し引く（削除した処理に関係なく集計が正しく保たれる）
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS learning_log_baseline_delete
+        AFTER DELETE ON learning_log
+        WHEN old.id <= (SELECT value FROM maintenance_state WHERE name = 'stats_high_water')
+        BEGIN
+            UPDATE genre_stats_baseline
+            SET total_questions = total_questions - 1,
+                correct_answers = correct_answers - (CASE WHEN old.is_correct THEN 1 ELSE 0 END)
+            WHERE user_id = old.user_id AND genre = old.genre;
+        END
+    ''')
+    # 保存期間を過ぎた学習ログを日ごと・ジャンルごとにまとめた集計
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS learning_log_daily
+        (user_id TEXT,
+         day TEXT,
+         genre TEXT,
+         total_questions INTEGER DEFAULT 0,
+         correct_answers INTEGER DEFAULT 0,
+         score_sum REAL DEFAULT 0,
+         score_count INTEGER DEFAULT 0,
+         PRIMARY KEY (user_id, day, genre))
+    ''')
+
+def migrate_full_text_search(conn):
+    # 学習ログの全文検索用の索引（trigram は文字の3つ組で索引を作るため、単語を空白で区切らない日本語も部分一致で検索できる）
+    # 内容は learning_log から読むため、索引のみを持つ
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS learning_log_fts
+            USING fts5(question, user_answer, correct_answer,
+                       content='learning_log', content_rowid='id', tokenize='trigram')
+        ''')
+    except sqlite3.OperationalError:
+        # FTS5・trigram に対応していないSQLite（3.34より前）では索引を作らず、検索は LIKE で行う
+        return
+    # 学習ログの追加・削除・変更に合わせて索引を更新する（記録・インポート・保守のどの処理でも同期される）
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS learning_log_fts_insert
+        AFTER INSERT ON learning_log
+        BEGIN
+            INSERT INTO learning_log_fts (rowid, question, user_answer, correct_answer)
+            VALUES (new.id, new.question, new.user_answer, new.correct_answer);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS learning_log_fts_delete
+        AFTER DELETE ON learning_log
+        BEGIN
+            INSERT INTO learning_log_fts (learning_log_fts, rowid, question, user_answer, correct_answer)
+            VALUES ('delete', old.id, old.question, old.user_answer, old.correct_answer);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS learning_log_fts_update
+        AFTER UPDATE OF question, user_answer, correct_answer ON learning_log
+        BEGIN
+            INSERT INTO learning_log_fts (learning_log_fts, rowid, question, user_answer, correct_answer)
+            VALUES ('delete', old.id, old.question, old.user_answer, old.correct_answer);
+            INSERT INTO learning_log_fts (rowid, question, user_answer, correct_answer)
+            VALUES (new.id, new.question, new.user_answer, new.correct_answer);
+        END
+    ''')
+    # 既存の学習ログから索引を作る
+    conn.execute("INSERT INTO learning_log_fts (learning_log_fts) VALUES ('rebuild')")
+
+def migrate_question_signatures(conn):
+    # 学習者ごとの直近の出題の MinHash の署名（pp_app/novelty.py。ほぼ同じ問題を続けて出題しないために使う）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS question_signatures
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         user_id TEXT,
+         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+         question TEXT,
+         signature BLOB)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_question_signatures_user
+        ON question_signatures (user_id, id)
+    ''')
+
+# (バージョン, 説明, 適用する関数) の順序付きリスト
+MIGRATIONS = [
+    (1, "学習ログとジャンル統計", migrate_initial_tables),
+    (2, "問題バンク", migrate_question_bank),
+    (3, "学習ログのインデックス", migrate_learning_log_indexes),
+    (4, "キャッシュのバージョン管理", migrate_cache_versions),
+    (5, "記述式の得点", migrate_answer_scores),
+    (6, "復習スケジュール", migrate_review_schedule),
+    (7, "学習者ごとのデータ", migrate_user_partitioning),
+    (8, "統計の照合と学習ログの集計", migrate_maintenance),
+    (9, "学習ログの全文検索", migrate_full_text_search),
+    (10, "出題済みの問題の署名", migrate_question_signatures),
+]
+
+def get_schema_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version
+        (version INTEGER PRIMARY KEY,
+         description TEXT,
+         applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+# 未適用のマイグレーションを1つのトランザクションで適用する
+def migrate_database(database):
+    latest = MIGRATIONS[-1][0]
+    with database.connection() as conn:
+        if get_schema_version(conn) >= latest:
+            return
+    with database.metrics.span("db.migrate"), database.transaction() as conn:
+        # 他のプロセスが先に適用している場合があるため、書き込みロックを取った後に再確認する
+        current = get_schema_version(conn)
+        for version, description, migrate in MIGRATIONS:
+            if version > current:
+                migrate(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+
+# プロセス内・データベースファイルごとに一度だけマイグレーションを実行する
+def ensure_schema(database):
+    if database.schema_ready:
+        return
+    with database.schema_lock:
+        if not database.schema_ready:
+            migrate_database(database)
+            database.schema_ready = True
+
+# データベースの初期化関数（共有データと現在の学習者のデータベース）
+def init_db():
+    try:
+        with get_metrics().span("db.init"):
+            ensure_schema(get_database())
+            get_user_database()
+    except sqlite3.Error as e:
+        st.error(f"データベースの初期化中にエラーが発生しました: {str(e)}")
+        return False
+    return True
+
+# ジャンル別統計のプロセス内キャッシュ
+# 回答の記録時にその場で加算し、SQLiteからは初回・不整合時・他プロセスの更新を検知したときだけ読み直す
+class GenreStatsCache:
+    def __init__(self, database, user_id, ttl=STATS_CACHE_TTL):
+        self.database = database
+        self.user_id = user_id
+        self.version_name = stats_version_name(user_id)
+        self.ttl = ttl  # 他プロセスによる更新を確認する間隔（秒）
+        self._stats = None  # {genre: [total, correct]}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self.database.connection() as conn:
+            # 統計とバージョンを同じスナップショットから読む
+            conn.execute("BEGIN")
+            rows = conn.execute(SQL_SELECT_GENRE_STATS, (self.user_id,)).fetchall()
+            self._version = self._read_version(conn)
+            conn.execute("COMMIT")
+        # まだ回答していないジャンルは行がないため0件として扱う
+        self._stats = {genre: [0, 0] for genre in GENRES}
+        for genre, total, correct in rows:
+            self._stats[genre] = [total, correct]
+        self._checked_at = time.time()
+
+    def _read_version(self, conn):
+        row = conn.execute(SQL_SELECT_STATS_VERSION, (self.version_name,)).fetchone()
+        return row[0] if row else 0
+
+    def get(self):
+        with self._lock:
+            if self._stats is None:
+                self._load()
+            elif time.time() - self._checked_at > self.ttl:
+                with self.database.connection() as conn:
+                    version = self._read_version(conn)
+                if version != self._version:
+                    self._load()
+                self._checked_at = time.time()
+            stats = [
+                (genre, total, correct, round(correct / total * 100, 2) if total > 0 else 0)
+                for genre, (total, correct) in self._stats.items()
+            ]
+        return sorted(stats, key=lambda row: row[3])
+
+    # コミット済みの回答を反映する（version はそのトランザクションで進めた後の値）
+    def apply(self, answers, version):
+        with self._lock:
+            if self._stats is None:
+                return
+            if version != self._version + 1:
+                # 間に別の更新が入っているので、次回の取得時に読み直す
+                self._stats = None
+                return
+            for _, _, _, is_correct, genre, *_ in answers:
+                if genre in self._stats:
+                    self._stats[genre][0] += 1
+                    self._stats[genre][1] += 1 if is_correct else 0
+            self._version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._stats = None
+
+# 学習者ごとの統計キャッシュのバージョンを記録する cache_versions の名前
+def stats_version_name(user_id):
+    return f"genre_stats:{user_id}"
+
+@st.cache_resource
+def get_genre_stats_caches():
+    router = get_database_router()
+    return UserCacheRegistry(lambda user_id: GenreStatsCache(router.for_user(user_id), user_id))
+
+def get_genre_stats_cache():
+    return get_genre_stats_caches().get(current_user_id())
+
+# ジャンルの正答率を取得
+def get_genre_stats():
+    return get_genre_stats_cache().get()
+
+# 日付（ローカル時刻）の始まりを、学習ログの timestamp と同じ UTC の文字列にする
+# timestamp は UTC で保存されているため、列の側を変換せずに比べることで索引を使えるようにする
+def local_day_start_utc(day):
+    start = datetime.combine(day, datetime.min.time()).astimezone(timezone.utc)
+    return start.strftime("%Y-%m-%d %H:%M:%S")
+
+# 学習ログの絞り込み条件（prefix は学習ログのテーブルの別名）
+def learning_log_conditions(genre=None, is_correct=None, date_from=None, date_to=None, prefix=""):
+    conditions = [f"{prefix}user_id = ?"]
+    params = [current_user_id()]
+    if genre:
+        conditions.append(f"{prefix}genre = ?")
+        params.append(genre)
+    if is_correct is not None:
+        conditions.append(f"{prefix}is_correct = ?")
+        params.append(1 if is_correct else 0)
+    if date_from:
+        conditions.append(f"{prefix}timestamp >= ?")
+        params.append(local_day_start_utc(date_from))
+    if date_to:
+        conditions.append(f"{prefix}timestamp < ?")
+        params.append(local_day_start_utc(date_to + timedelta(days=1)))
+    return conditions, params
+
+# 学習ログを新しい順に1ページ分取得（キーセット方式：前ページ最後の (timestamp, id) より古いものを取得）
+# 戻り値は (ログのリスト, 次のページがあるか)
+def fetch_learning_log_page(page_size, cursor=None, genre=None, is_correct=None, date_from=None, date_to=None):
+    conditions, params = learning_log_conditions(genre, is_correct, date_from, date_to)
+    if cursor:
+        conditions.append("(timestamp, id) < (?, ?)")
+        params.extend(cursor)
+    
+    with get_user_database().connection() as conn:
+        logs = conn.execute(f'''
+            SELECT id, timestamp, question, user_answer, correct_answer, is_correct, genre, score
+            FROM learning_log
+            WHERE {' AND '.join(conditions)}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        ''', (*params, page_size + 1)).fetchall()
+    return logs[:page_size], len(logs) > page_size
+
+def has_full_text_search(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'learning_log_fts'").fetchone() is not None
+
+# 検索語を FTS5 の検索式にする（各語をフレーズとして扱い、すべてを含む行に一致させる）
+def fts_query(terms):
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+def escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# 学習ログをキーワードで検索し、1ページ分を返す（問題文・あなたの回答・正解のいずれかに、空白で区切ったすべての語を含むもの）
+# 3文字以上の語は全文検索の索引で探して関連度（bm25）の高い順に並べる。関連度の計算は一致した行ごとに行われるため、
+# 多くの行に一致する語でも時間がかからないよう、並べる対象は新しい順に SEARCH_RANK_WINDOW 件までの一致にする。
+# trigram の索引は2文字以下の語には使えないため、短い語は LIKE で絞り込み、短い語だけの検索は新しい順に並べる
+# 戻り値は (ログのリスト, 次のページがあるか)。ログの最後の列は一致した箇所を **太字** にした問題文
+def search_learning_log(query, page_size, page=0, genre=None, is_correct=None, date_from=None, date_to=None):
+    terms = query.split()
+    conditions, params = learning_log_conditions(genre, is_correct, date_from, date_to, prefix="l.")
+    database = get_user_database()
+    with database.metrics.span("db.search"), database.connection() as conn:
+        long_terms = [term for term in terms if len(term) >= 3] if has_full_text_search(conn) else []
+        for term in terms:
+            if term not in long_terms:
+                conditions.append(
+                    "(l.question LIKE ? ESCAPE '\\' OR l.user_answer LIKE ? ESCAPE '\\' OR l.correct_answer LIKE ? ESCAPE '\\')"
+                )
+                params.extend([f"%{escape_like(term)}%"] * 3)
+        if long_terms:
+            match = fts_query(long_terms)
+            if SEARCH_RANK_WINDOW > 0:
+                # 並べる対象の境目は、この学習者の絞り込み条件に合う一致だけで数える
+                # （他の学習者の新しい一致で、この学習者の一致が対象から外れないようにする）
+                oldest = conn.execute(f'''
+                    SELECT learning_log_fts.rowid
+                    FROM learning_log_fts
+                    JOIN learning_log l ON l.id = learning_log_fts.rowid
+                    WHERE learning_log_fts MATCH ? AND {' AND '.join(conditions)}
+                    ORDER BY learning_log_fts.rowid DESC
+                    LIMIT 1 OFFSET ?
+                ''', (match, *params, SEARCH_RANK_WINDOW - 1)).fetchone()
+                if oldest:
+                    conditions.append("learning_log_fts.rowid >= ?")
+                    params.append(oldest[0])
+            sql = f'''
+                SELECT l.id, l.timestamp, l.question, l.user_answer, l.correct_answer, l.is_correct, l.genre, l.score,
+                       highlight(learning_log_fts, 0, '**', '**')
+                FROM learning_log_fts
+                JOIN learning_log l ON l.id = learning_log_fts.rowid
+                WHERE learning_log_fts MATCH ? AND {' AND '.join(conditions)}
+                ORDER BY learning_log_fts.rank, l.id DESC
+                LIMIT ? OFFSET ?
+            '''
+            params.insert(0, match)
+        else:
+            sql = f'''
+                SELECT l.id, l.timestamp, l.question, l.user_answer, l.correct_answer, l.is_correct, l.genre, l.score,
+                       l.question
+                FROM learning_log l
+                WHERE {' AND '.join(conditions)}
+                ORDER BY l.timestamp DESC, l.id DESC
+                LIMIT ? OFFSET ?
+            '''
+        logs = conn.execute(sql, (*params, page_size + 1, page * page_size)).fetchall()
+    return logs[:page_size], len(logs) > page_size
+
+# 保存期間を過ぎて日別にまとめた学習履歴を新しい日から取得（(日付, ジャンル, 回答数, 正解数, 平均得点) のリスト）
+def fetch_daily_summaries(limit):
+    with get_user_database().connection() as conn:
+        return conn.execute('''
+            SELECT day, genre, total_questions, correct_answers,
+                   CASE WHEN score_count > 0 THEN score_sum / score_count END
+            FROM learning_log_daily
+            WHERE user_id = ?
+            ORDER BY day DESC, genre
+            LIMIT ?
+        ''', (current_user_id(), limit)).fetchall()
+
+# --- 復習スケジュール（SM-2方式） ---
+# 正解するたびに復習間隔を 1日 → 6日 → 前回の間隔×伸び率 と延ばし、間違えたら短い間隔から学び直す。
+# スケジュールはSQLiteに保存し、次に出題するジャンル・問題は ReviewScheduler の優先度付きキューから取り出す。
+
+# 回答の出来（0〜5）。記述式は得点から、4択は正誤から決める
+def review_quality(is_correct, score):
+    if score is not None:
+        return min(5, int(score // 20))
+    return 4 if is_correct else 1
+
+# state: (repetitions, interval_days, ease) または None（初めての回答）
+# 戻り値: (repetitions, interval_days, ease, due_at)
+def sm2_next(state, quality, now):
+    repetitions, interval, ease = state or (0, 0.0, SR_INITIAL_EASE)
+    if quality >= 3:
+        repetitions += 1
+        interval = 1.0 if repetitions == 1 else 6.0 if repetitions == 2 else interval * ease
+        due_at = now + interval * 86400
+    else:
+        repetitions = 0
+        interval = 0.0
+        due_at = now + SR_RELEARN_DELAY
+    ease = max(SR_MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return repetitions, interval, ease, due_at
+
+# 回答をもとにジャンルと問題の復習スケジュールを更新する（呼び出し側のトランザクション内で実行）
+# 戻り値は {学習者ID: ReviewScheduler.apply() に渡す (種類, キー, 次の期限) のリスト}
+def update_review_schedule(conn, answers, now=None):
+    now = now or time.time()
+    updates = {}
+    for question, _, _, is_correct, genre, score, _, quiz_type, user_id in answers:
+        quality = review_quality(is_correct, score)
+        user_updates = updates.setdefault(user_id, [])
+        repetitions, interval, ease, due_at = sm2_next(
+            conn.execute(SQL_SELECT_REVIEW_GENRE, (user_id, genre)).fetchone(), quality, now
+        )
+        conn.execute(SQL_REPLACE_REVIEW_GENRE, (user_id, genre, repetitions, interval, ease, due_at, now))
+        user_updates.append(("genre", genre, due_at))
+        if quiz_type:
+            repetitions, interval, ease, due_at = sm2_next(
+                conn.execute(SQL_SELECT_REVIEW_ITEM, (user_id, quiz_type, question)).fetchone(), quality, now
+            )
+            conn.execute(
+                SQL_REPLACE_REVIEW_ITEM,
+                (user_id, quiz_type, question, genre, repetitions, interval, ease, due_at, now)
+            )
+            user_updates.append(("item", (quiz_type, question), due_at))
+    return updates
+
+# 回答を学習ログに追加し、ジャンルの統計をSQL内で加算して、復習スケジュールを更新する（呼び出し側のトランザクション内で実行）
+# answers: (question, user_answer, correct_answer, is_correct, genre, score, score_detail, quiz_type, user_id) のリスト
+# 戻り値は学習者ごとの統計キャッシュの新しいバージョンと、ReviewScheduler.apply() に渡すスケジュールの更新
+def record_answers(conn, answers):
+    conn.executemany(SQL_INSERT_LEARNING_LOG, answers)
+    
+    # 学習者・ジャンルごとに集計してから更新することで、まとめて書き込むときの更新回数を減らす
+    totals = {}
+    for _, _, _, is_correct, genre, _, _, _, user_id in answers:
+        total = totals.setdefault((user_id, genre), [0, 0])
+        total[0] += 1
+        total[1] += 1 if is_correct else 0
+    conn.executemany(
+        SQL_UPDATE_GENRE_STATS,
+        [(user_id, genre, total, correct) for (user_id, genre), (total, correct) in totals.items()]
+    )
+    versions = {}
+    for user_id in {user_id for user_id, _ in totals}:
+        name = stats_version_name(user_id)
+        conn.execute(SQL_BUMP_STATS_VERSION, (name,))
+        versions[user_id] = conn.execute(SQL_SELECT_STATS_VERSION, (name,)).fetchone()[0]
+    return versions, update_review_schedule(conn, answers)
+
+# 解析済みの問題を問題バンクに保存し、問題IDを返す
+# （バックグラウンドスレッドからも呼ばれるため、ここではst.errorを使わない）
+def save_to_question_bank(quiz, database=None):
+    try:
+        with (database or get_database()).transaction() as conn:
+            c = conn.execute(SQL_INSERT_QUESTION_BANK, (
+                quiz["type"],
+                quiz["genre"],
+                quiz["question"],
+                json.dumps(quiz["options"], ensure_ascii=False) if quiz.get("options") else None,
+                quiz.get("correct"),
+                quiz.get("answer"),
+            ))
+            if c.rowcount:
+                return c.lastrowid
+            # 同じ問題が保存済み
+            row = conn.execute('''
+                SELECT id FROM question_bank WHERE quiz_type = ? AND question = ?
+            ''', (quiz["type"], quiz["question"])).fetchone()
+            return row[0] if row else None
+    except sqlite3.Error:
+        return None
+
+# 問題バンクから未出題の問題を1つ取得（学習者が回答済みの問題と、このセッションで表示済みの問題を除く）
+# genre=None の場合はすべてのジャンルから、include_answered=True の場合は回答済みの問題も含めて選ぶ
+# 回答済みかどうかは学習者のデータベースで確認するため（シャードを使う場合は問題バンクと別のファイル）、
+# ランダムな位置から BANK_SAMPLE_SIZE 件の候補を取り出し、その中から未回答のものを選ぶ
+# 位置は条件に合う問題の id の範囲から選び、(quiz_type, genre, id) のインデックスでその id から読むため、
+# ORDER BY RANDOM() と違って問題バンク全体を並べ替えない（末尾まで足りなければ先頭から続けて読む）
+def pick_from_question_bank(quiz_type, genre, exclude_ids=(), include_answered=False):
+    # ジャンルを指定しない場合は（quiz_type, genre）のインデックスでは id 順に読めないため、
+    # 「+」でインデックスを使わせずに主キー（id）の順に読む
+    conditions = ["quiz_type = ?" if genre else "+quiz_type = ?"]
+    params = [quiz_type]
+    if genre:
+        conditions.append("genre = ?")
+        params.append(genre)
+    if exclude_ids:
+        conditions.append(f"id NOT IN ({','.join('?' * len(exclude_ids))})")
+        params.extend(exclude_ids)
+    where = ' AND '.join(conditions)
+    limit = 1 if include_answered else BANK_SAMPLE_SIZE
+    try:
+        with get_database().connection() as conn:
+            low, high = conn.execute(f'''
+                SELECT (SELECT MIN(id) FROM question_bank WHERE {where}),
+                       (SELECT MAX(id) FROM question_bank WHERE {where})
+            ''', (*params, *params)).fetchone()
+            rows = []
+            if low is not None:
+                start = random.randint(low, high)
+                for comparison in (">=", "<"):
+                    rows += conn.execute(f'''
+                        SELECT id, genre, question, options, correct_index, model_answer
+                        FROM question_bank
+                        WHERE {where} AND id {comparison} ?
+                        ORDER BY id
+                        LIMIT ?
+                    ''', (*params, start, limit - len(rows))).fetchall()
+                    if len(rows) >= limit:
+                        break
+        if rows and not include_answered:
+            with get_user_database().connection() as conn:
+                answered = {row[0] for row in conn.execute(f'''
+                    SELECT question FROM learning_log
+                    WHERE user_id = ? AND question IN ({','.join('?' * len(rows))})
+                ''', (current_user_id(), *[row[2] for row in rows]))}
+            rows = [row for row in rows if row[2] not in answered]
+    except sqlite3.Error as e:
+        st.error(f"問題バンクの取得中にエラーが発生しました: {str(e)}")
+        return None
+    
+    return quiz_from_bank_row(quiz_type, rows[0]) if rows else None
+
+# 問題バンクの行 (id, genre, question, options, correct_index, model_answer) を問題の辞書に変換
+def quiz_from_bank_row(quiz_type, row):
+    question_id, genre, question, options, correct_index, model_answer = row
+    quiz = {"id": question_id, "type": quiz_type, "genre": genre, "question": question}
+    if quiz_type == "multiple_choice":
+        quiz["options"] = json.loads(options)
+        quiz["correct"] = correct_index
+    else:
+        quiz["answer"] = model_answer
+    return quiz
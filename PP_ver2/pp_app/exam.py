@@ -0,0 +1,151 @@
+# 模擬試験（複数ジャンルの4択問題を並行して生成し、回答をまとめて採点・記録する）
+# 問題は EXAM_BATCH_SIZE 問ずつのリクエストに分けて同時に生成し、届いた順に出題する。
+# そのため、試験全体を用意する時間は問題数ではなく、1回のリクエストの応答時間でほぼ決まる
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from pp_app.config import EXAM_BATCH_SIZE, EXAM_CONCURRENCY
+from pp_app.generation import (
+    GenerationExecutor, batch_capacity, get_generation_executor, get_generation_guard, request_quiz_batch,
+)
+
+UNANSWERED = "（未回答）"
+
+class MockExam:
+    def __init__(self, size, time_limit=None, metrics=None):
+        self.exam_id = uuid.uuid4().hex[:8]  # 画面の入力欄のキーに使う
+        self.size = size
+        self.time_limit = time_limit  # 秒（Noneは制限なし）
+        self.metrics = metrics
+        self.created_at = time.time()
+        self.started_at = None  # 最初の問題が届いた時刻（制限時間はここから数える）
+        self.submitted_at = None
+        self.results = None  # 提出後の回答（record_answers() の形式）
+        self.topped_up = False  # 生成できなかった分を保存済みの問題で補ったか
+        self._questions = []
+        self._choices = {}  # {問題の番号: 選んだ選択肢}（制限時間内に選んだものだけ）
+        self._requested = 0
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    # genres（出題するジャンルのリスト）の問題を batch_size 問ずつに分けて、workers で並行して生成する
+    # 生成した問題のうち、直近に出題した問題とほぼ同じ問題（novelty_index で照合）は使わない
+    def generate(self, genres, model, database, executor, workers, novelty_index=None, batch_size=EXAM_BATCH_SIZE, session_id=None):
+        batch_size = max(1, min(batch_size, batch_capacity("multiple_choice")))
+        with self._lock:
+            self._requested += len(genres)
+        for i in range(0, len(genres), batch_size):
+            batch = dict(Counter(genres[i:i + batch_size]))
+            workers.submit(self._generate_batch, batch, model, database, executor, novelty_index, session_id)
+
+    def _generate_batch(self, batch, model, database, executor, novelty_index, session_id):
+        try:
+            quizzes = request_quiz_batch(
+                "multiple_choice", batch, model=model, database=database, executor=executor, session_id=session_id
+            )
+        except Exception:
+            quizzes = []
+        if novelty_index:
+            quizzes = [quiz for quiz in quizzes if not self._is_recent_duplicate(novelty_index, quiz)]
+        self.add(quizzes, failures=sum(batch.values()) - len(quizzes))
+
+    def _is_recent_duplicate(self, novelty_index, quiz):
+        try:
+            return novelty_index.find_duplicate(quiz["question"]) is not None
+        except sqlite3.Error:
+            return False
+
+    # 用意できた問題を加える（generate() で依頼した分は failures に用意できなかった問題数を渡す）
+    def add(self, quizzes, failures=0):
+        with self._lock:
+            was_empty = not self._questions
+            known = {quiz["question"] for quiz in self._questions}
+            for quiz in quizzes:
+                if len(self._questions) < self.size and quiz["question"] not in known:
+                    known.add(quiz["question"])
+                    self._questions.append(quiz)
+                    if self.started_at is None:
+                        self.started_at = time.time()
+                else:
+                    failures += 1
+            self._failures += failures
+            finished = self._requested and len(self._questions) + self._failures == self._requested
+        if self.metrics:
+            elapsed = time.time() - self.created_at
+            if was_empty and quizzes:
+                self.metrics.observe("exam.first_question", elapsed)
+            if finished:
+                self.metrics.observe("exam.assemble", elapsed)
+
+    # 用意できた問題（届いた順）
+    def questions(self):
+        with self._lock:
+            return list(self._questions)
+
+    # まだ生成中の問題があるか
+    @property
+    def generating(self):
+        with self._lock:
+            return len(self._questions) + self._failures < self._requested
+
+    # 制限時間が終わる時刻（制限なし、またはまだ問題が届いていない場合はNone）
+    @property
+    def deadline(self):
+        if not self.time_limit or self.started_at is None:
+            return None
+        return self.started_at + self.time_limit
+
+    # 残り時間（秒。制限なしの場合はNone。問題が届くまでは制限時間のまま減らない）
+    def remaining(self):
+        if not self.time_limit:
+            return None
+        if self.deadline is None:
+            return self.time_limit
+        return self.deadline - time.time()
+
+    # 選択肢を選んだ（選び直した）ことを記録する。制限時間を過ぎてからの変更は記録せずにFalseを返す
+    # （採点には画面の入力欄の値ではなく、ここで記録した選択肢を使う）
+    def choose(self, index, choice, at=None):
+        at = time.time() if at is None else at
+        if self.deadline is not None and at >= self.deadline:
+            return False
+        with self._lock:
+            if choice is None:
+                self._choices.pop(index, None)
+            else:
+                self._choices[index] = choice
+        return True
+
+    # 制限時間内に選んだ選択肢（{問題の番号: 選択肢}）
+    def choices(self):
+        with self._lock:
+            return dict(self._choices)
+
+    # 選んだ選択肢（{問題の番号: 選択肢。未回答はNone}）を採点し、学習ログに記録する形式の回答のリストを返す
+    def grade(self, choices, user_id):
+        answers = []
+        for i, quiz in enumerate(self.questions()):
+            choice = choices.get(i)
+            correct_option = quiz["options"][quiz["correct"] - 1]
+            is_correct = choice is not None and quiz["options"].index(choice) + 1 == quiz["correct"]
+            answers.append((
+                quiz["question"], choice or UNANSWERED, correct_option, is_correct, quiz["genre"],
+                None, None, "multiple_choice", user_id,
+            ))
+        return answers
+
+# 模擬試験用の実行キュー（通常の生成とサーキットブレーカー・レート制限を共有し、同時実行数だけを分ける）
+@st.cache_resource
+def get_exam_executor():
+    return GenerationExecutor(get_generation_guard(), concurrency=EXAM_CONCURRENCY, limiter=get_generation_executor().limiter)
+
+# 模擬試験の問題を生成するスレッド（プロセス全体で共有する）
+@st.cache_resource
+def get_exam_workers():
+    return ThreadPoolExecutor(max_workers=max(1, EXAM_CONCURRENCY), thread_name_prefix="pp-exam")
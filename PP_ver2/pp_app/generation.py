@@ -0,0 +1,722 @@
+# 生成層（Gemini APIの呼び出し・再試行・レート制限・先読み）
+# google.generativeai は読み込みに時間がかかるため、最初に問題を生成するときまで読み込まない
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from pp_app.config import (
+    BATCH_MAX_SIZE, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, GEMINI_MODEL, GEMINI_RPM, GEMINI_TPM,
+    GENERATION_BACKOFF_BASE, GENERATION_BACKOFF_MAX, GENERATION_CONCURRENCY, GENERATION_DEADLINE,
+    GENERATION_MAX_ATTEMPTS, MODEL_DISCOVERY_TTL, PREFETCH_DEPTH, PREFETCH_TTL, PREFETCH_WORKERS,
+)
+from pp_app.db import get_database, save_to_question_bank
+from pp_app.metrics import Metrics, get_metrics
+from pp_app.parsing import QUIZ_JSON_SCHEMAS, format_model_answer, matches_schema, parse_json_array, read_quiz
+
+# google.generativeai を読み込む（最初の1回だけ時間がかかるため、その時間を計測する）
+def load_genai():
+    genai = sys.modules.get("google.generativeai")
+    if genai is None:
+        with get_metrics().span("gemini.import"):
+            import google.generativeai as genai
+    return genai
+
+# 利用するGeminiモデルの管理（モデル一覧の取得とモデルインスタンスをプロセス全体で使い回す）
+class ModelRegistry:
+    def __init__(self, preferred=GEMINI_MODEL, ttl=MODEL_DISCOVERY_TTL, metrics=None):
+        self.preferred = preferred
+        self.ttl = ttl
+        self.metrics = metrics or Metrics()
+        self.model_name = None
+        self._model = None
+        self._discovered_at = 0.0
+        self._lock = threading.Lock()
+
+    # generateContentに対応したモデルを探す（希望のモデルがあればそれを優先）
+    def _discover(self):
+        with self.metrics.span("gemini.list_models"):
+            names = [
+                model.name for model in load_genai().list_models()
+                if 'generateContent' in model.supported_generation_methods
+            ]
+        if not names:
+            raise LookupError("利用可能なGenerative AIモデルが見つかりませんでした。")
+        preferred = self.preferred if self.preferred.startswith("models/") else f"models/{self.preferred}"
+        return preferred if preferred in names else names[0]
+
+    def model(self):
+        with self._lock:
+            if self._model is None or time.time() - self._discovered_at > self.ttl:
+                try:
+                    name = self._discover()
+                except Exception:
+                    if self._model is None:
+                        raise
+                    name = self.model_name  # 再取得に失敗した場合はこれまでのモデルを使い続ける
+                if self._model is None or name != self.model_name:
+                    self._model = load_genai().GenerativeModel(name)
+                    self.model_name = name
+                self._discovered_at = time.time()
+            return self._model
+
+@st.cache_resource
+def get_model_registry():
+    return ModelRegistry(metrics=get_metrics())
+
+# サーキットブレーカーが開いている（生成を一時停止している）ことを表す例外
+# （呼び出し側では、他のサーバーエラーと同じく再試行できるエラー（503 Service Unavailable）として扱う）
+class CircuitOpenError(Exception):
+    code = 503
+
+# 時間内に応答がなかったことを表す例外
+class GenerationTimeoutError(TimeoutError):
+    pass
+
+# 再試行すれば成功する可能性があるエラー（レート制限・サーバーエラー・タイムアウト）かどうか
+# Gemini APIのSDKの例外は、SDKを読み込んだ後にしか発生しないため、読み込み済みの場合だけ照合する
+# （画面やヘルパーを読み込むだけでSDKを読み込まないよう、ここでは import しない）
+def retryable_errors():
+    errors = (TimeoutError, ConnectionError)
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    if google_exceptions is None:
+        return errors
+    return errors + (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.InternalServerError,
+        google_exceptions.BadGateway,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.DeadlineExceeded,
+    )
+
+def is_retryable_error(error):
+    if isinstance(error, retryable_errors()):
+        return True
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+# Gemini API呼び出しの保護（期限付きの再試行と、プロセス全体で共有するサーキットブレーカー）
+class GenerationGuard:
+    def __init__(
+        self,
+        deadline=GENERATION_DEADLINE,
+        max_attempts=GENERATION_MAX_ATTEMPTS,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+        metrics=None,
+    ):
+        self.deadline = deadline
+        self.metrics = metrics or Metrics()
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # closed: 通常 / open: 停止中 / half_open: 試しに1件だけ通す
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0}
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self._stats["rejected"] += 1
+                    self.metrics.increment("gemini.rejected")
+                    raise CircuitOpenError("AIの応答が不安定なため、問題の生成を一時停止しています。")
+                self.state = "half_open"
+            elif self.state == "half_open":
+                # 試しの1件の結果が出るまでは他の呼び出しを通さない
+                self._stats["rejected"] += 1
+                self.metrics.increment("gemini.rejected")
+                raise CircuitOpenError("AIの応答が不安定なため、問題の生成を一時停止しています。")
+            self._stats["calls"] += 1
+
+    def _record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def _record_failure(self, retryable):
+        with self._lock:
+            self._stats["failures"] += 1
+            if not retryable:
+                # 入力の誤りなどはAPIの障害ではないため、ブレーカーの判定には数えない
+                if self.state == "half_open":
+                    self.state = "closed"
+                return
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.metrics.increment("gemini.breaker_opened")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    # fn() を実行する。再試行できるエラーは期限内に限り指数バックオフ（ジッター付き）で再試行する
+    # retry_allowed() が False を返す場合は再試行しない（失敗はブレーカーに数える）
+    # （応答を待つ時間そのものの打ち切りは、結果を待つ側が GenerationExecutor.run() で行う）
+    def call(self, fn, deadline=None, retry_allowed=None):
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        for attempt in range(self.max_attempts):
+            self._before_call()
+            try:
+                result = fn()
+            except Exception as e:
+                error = e
+            else:
+                self._record_success()
+                return result
+            
+            retryable = is_retryable_error(error)
+            self._record_failure(retryable)
+            delay = random.uniform(0, min(GENERATION_BACKOFF_MAX, GENERATION_BACKOFF_BASE * 2 ** attempt))
+            if not retryable or attempt == self.max_attempts - 1 or time.monotonic() + delay >= deadline_at:
+                raise error
+            time.sleep(delay)
+            # 待っている間に再試行が不要になった場合（呼び出し元が待つのをやめた場合など）は、APIを呼ばない
+            if retry_allowed and not retry_allowed():
+                raise error
+            with self._lock:
+                self._stats["retries"] += 1
+            self.metrics.increment("gemini.retries")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"] = self.state
+        return stats
+
+# リクエスト数とトークン数の2つのトークンバケットによるレート制限
+class TokenBucketLimiter:
+    def __init__(self, requests_per_minute=GEMINI_RPM, tokens_per_minute=GEMINI_TPM):
+        self.request_capacity = requests_per_minute
+        self.token_capacity = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0  # 制限により待った合計秒数
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._requests = min(self.request_capacity, self._requests + elapsed * self.request_capacity / 60)
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_capacity / 60)
+
+    # 1リクエスト分と tokens 分の枠が空くまで待ってから消費する
+    def acquire(self, tokens):
+        tokens = min(tokens, self.token_capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.request_capacity,
+                    (tokens - self._tokens) * 60 / self.token_capacity,
+                )
+                self.waited += wait
+            time.sleep(wait)
+
+# プロンプトと最大出力からトークン数を見積もる（日本語はおおよそ1文字1トークンとして多めに見積もる）
+def estimate_tokens(prompt, max_output_tokens):
+    return len(prompt) + max_output_tokens
+
+# 全セッションのGemini API呼び出しを受け付ける実行キュー
+# - 同時実行数はワーカースレッド数で制限する
+# - セッションごとのキューを順番に処理し、1つのセッションが大量に依頼しても他のセッションを待たせない
+# - 同じ key の依頼が実行中・待機中なら、新たに呼び出さずに同じ結果を共有する
+# - 結果を待つ呼び出し元がすべて待つのをやめた依頼は、順番待ちなら取り消し、実行中なら再試行しない
+class GenerationExecutor:
+    def __init__(self, guard, concurrency=GENERATION_CONCURRENCY, limiter=None):
+        self.guard = guard
+        self.metrics = guard.metrics
+        self.limiter = limiter or TokenBucketLimiter()
+        self._queues = OrderedDict()  # session_id -> deque[(fn, tokens, key, future, submitted_at, retry_allowed)]
+        self._pending = {}  # key -> Future
+        self._waiters = {}  # Future -> 結果を待っている呼び出し元の数
+        self._cond = threading.Condition()
+        self._stats = {"submitted": 0, "coalesced": 0, "completed": 0, "cancelled": 0}
+        for i in range(max(1, concurrency)):
+            threading.Thread(target=self._work, name=f"pp-gemini_{i}", daemon=True).start()
+
+    # retry_allowed() が False を返す間は、失敗しても再試行しない
+    def submit(self, fn, session_id, tokens, key=None, retry_allowed=None):
+        with self._cond:
+            self._stats["submitted"] += 1
+            if key is not None and key in self._pending:
+                self._stats["coalesced"] += 1
+                future = self._pending[key]
+                self._waiters[future] += 1
+                return future
+            future = Future()
+            if key is not None:
+                self._pending[key] = future
+            self._waiters[future] = 1
+            self._queues.setdefault(session_id, deque()).append(
+                (fn, tokens, key, future, time.perf_counter(), retry_allowed)
+            )
+            self._cond.notify()
+            return future
+
+    # 依頼して結果を待つ。期限を過ぎたら待つのをやめ、他に待っている呼び出し元がいなければ依頼を取り下げる
+    def run(self, fn, session_id, tokens, key=None, deadline=None):
+        future = self.submit(fn, session_id, tokens, key)
+        try:
+            return future.result(timeout=deadline or self.guard.deadline)
+        except FutureTimeoutError:
+            self.abandon(future, key)
+            raise GenerationTimeoutError("AIの応答が時間内に返りませんでした。")
+
+    # submit() した依頼の結果を待つのをやめる（順番待ちの依頼はAPIを呼ばずに取り消される）
+    def abandon(self, future, key=None):
+        with self._cond:
+            if future not in self._waiters:
+                return
+            self._waiters[future] -= 1
+            if self._waiters[future] > 0:
+                return
+            del self._waiters[future]
+            # 同じ key の新しい依頼は、取り下げた依頼の結果を待たずに改めて呼び出す
+            if key is not None and self._pending.get(key) is future:
+                del self._pending[key]
+        if future.cancel():
+            self.metrics.increment("gemini.cancelled")
+
+    def _is_abandoned(self, future):
+        with self._cond:
+            return future not in self._waiters
+
+    # 先頭のセッションから1件取り出し、そのセッションを末尾に回す（ラウンドロビン）
+    def _next_job(self):
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+            session_id, jobs = next(iter(self._queues.items()))
+            job = jobs.popleft()
+            del self._queues[session_id]
+            if jobs:
+                self._queues[session_id] = jobs
+            return job
+
+    def _work(self):
+        while True:
+            fn, tokens, key, future, submitted_at, retry_allowed = self._next_job()
+            # 順番待ちの間に取り消された依頼はAPIを呼ばずに捨てる
+            if not future.set_running_or_notify_cancel():
+                with self._cond:
+                    self._stats["cancelled"] += 1
+                continue
+            self.metrics.observe("gemini.queue_wait", time.perf_counter() - submitted_at)
+            try:
+                result = self.guard.call(
+                    lambda: self._attempt(fn, tokens),
+                    retry_allowed=lambda: not self._is_abandoned(future) and (retry_allowed is None or retry_allowed()),
+                )
+            except Exception as e:
+                self.metrics.increment("gemini.generation_failures")
+                future.set_exception(e)
+            else:
+                self.metrics.increment("gemini.generations")
+                future.set_result(result)
+            finally:
+                with self._cond:
+                    if key is not None and self._pending.get(key) is future:
+                        del self._pending[key]
+                    self._waiters.pop(future, None)
+                    self._stats["completed"] += 1
+
+    # 1回のAPI呼び出し（再試行のたびにレート制限の枠を消費する）
+    def _attempt(self, fn, tokens):
+        with self.metrics.span("gemini.rate_limit_wait"):
+            self.limiter.acquire(tokens)
+        with self.metrics.span("gemini.generate"):
+            return fn()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = sum(len(jobs) for jobs in self._queues.values())
+        stats["rate_limited_seconds"] = round(self.limiter.waited, 1)
+        return stats
+
+@st.cache_resource
+def get_generation_guard():
+    return GenerationGuard(metrics=get_metrics())
+
+@st.cache_resource
+def get_generation_executor():
+    return GenerationExecutor(get_generation_guard())
+
+# 公平に順番待ちをするための、現在のセッションの識別子
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "background"
+
+# 1問ずつ生成するときの生成パラメータ
+QUIZ_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+# 問題生成用のプロンプトを作成
+def build_quiz_prompt(quiz_type, genre):
+    if quiz_type == "multiple_choice":
+        return f"""
+        日本の歴史の「{genre}」に関する4択問題を1つ生成してください。
+        以下の形式で出力してください：
+        質問：
+        選択肢1：
+        選択肢2：
+        選択肢3：
+        選択肢4：
+        正解：（数字のみ）
+        ジャンル：{genre}
+        """
+    else:  # written_answer
+        return f"""
+        日本の歴史の「{genre}」に関する記述式の問題を1つ生成してください。
+        
+        以下の条件を満たす問題を生成してください：
+        1. 歴史的な出来事の因果関係や影響を説明させる問題
+        2. 時代背景や社会状況との関連を考察させる問題
+        3. 単なる年号や人物名ではなく、歴史的な意義や評価を問う問題
+        4. 複数の視点から考察できる問題
+        
+        以下の形式で必ず出力してください：
+        ---
+        質問：（歴史的考察を促す問い）
+        
+        模範解答：
+        ・歴史的事実の説明：
+        （100字以内で記述）
+        
+        ・社会的背景：
+        （100字以内で記述）
+        
+        ・影響と意義：
+        （100字以内で記述）
+        
+        ・具体例：
+        （100字以内で記述）
+        ---
+        
+        ジャンル：{genre}
+        """
+
+# Gemini APIで問題文を生成（Streamlitに依存しないためバックグラウンドスレッドからも呼び出せる）
+# 同じ (問題形式, ジャンル) の依頼が同時に来た場合は1回の呼び出しにまとめる
+def request_quiz_text(quiz_type, genre, model=None, executor=None, session_id=None):
+    model = model or get_model_registry().model()
+    prompt = build_quiz_prompt(quiz_type, genre)
+    response = (executor or get_generation_executor()).run(
+        lambda: model.generate_content(prompt, generation_config=QUIZ_GENERATION_CONFIG),
+        session_id or current_session_id(),
+        estimate_tokens(prompt, QUIZ_GENERATION_CONFIG["max_output_tokens"]),
+        key=("text", quiz_type, genre),
+    )
+    return response.text
+
+# Gemini APIで問題文をストリーミング生成し、受信したテキストを順に返す（次の受信までをそれぞれ期限付きで待つ）
+# 受信は最後まで実行キューのワーカーで行うため、途中で途切れた場合も GenerationGuard の失敗として数えられる。
+# まだ何も受信していなければ再試行し、受信した後に途切れた場合は例外を送出する（呼び出し側で生成し直す）
+def stream_quiz_text(quiz_type, genre, model=None, executor=None, session_id=None):
+    model = model or get_model_registry().model()
+    executor = executor or get_generation_executor()
+    prompt = build_quiz_prompt(quiz_type, genre)
+    chunks = queue.Queue()
+    received = threading.Event()
+
+    def generate():
+        for chunk in model.generate_content(prompt, generation_config=QUIZ_GENERATION_CONFIG, stream=True):
+            chunks.put(chunk.text)
+            received.set()
+
+    future = executor.submit(
+        generate,
+        session_id or current_session_id(),
+        estimate_tokens(prompt, QUIZ_GENERATION_CONFIG["max_output_tokens"]),
+        retry_allowed=lambda: not received.is_set(),
+    )
+    future.add_done_callback(lambda _: chunks.put(None))
+    try:
+        while True:
+            try:
+                text = chunks.get(timeout=executor.guard.deadline)
+            except queue.Empty:
+                raise GenerationTimeoutError("AIの応答が時間内に返りませんでした。")
+            if text is None:
+                # 受信を終えた（失敗した場合はその例外を送出する）
+                future.result()
+                return
+            yield text
+    finally:
+        # 途中で読むのをやめた場合（画面の再実行など）は、依頼を取り下げて再試行させない
+        if not future.done():
+            executor.abandon(future)
+
+# 形式の修正を依頼するときの出力形式（build_quiz_prompt() と同じ見出し）
+QUIZ_TEXT_FORMATS = {
+    "multiple_choice": """質問：（問題文）
+選択肢1：（本文）
+選択肢2：（本文）
+選択肢3：（本文）
+選択肢4：（本文）
+正解：（1〜4の数字のみ）""",
+    "written_answer": """質問：（問題文）
+
+模範解答：
+・歴史的事実の説明：
+（本文）
+
+・社会的背景：
+（本文）
+
+・影響と意義：
+（本文）
+
+・具体例：
+（本文）""",
+}
+
+# 形式の修正用のプロンプトを作成（内容はそのままで、見出しの書き方だけを直させる）
+def build_repair_prompt(quiz_type, quiz_text, problems):
+    problem_lines = "\n".join(f"- {problem}" for problem in problems)
+    return f"""次のテキストは問題の出力形式が崩れています。
+問題・選択肢・正解・模範解答の内容は変えずに、指定の形式に書き直したテキストのみを出力してください。
+
+形式の問題点：
+{problem_lines}
+
+指定の形式：
+{QUIZ_TEXT_FORMATS[quiz_type]}
+
+テキスト：
+{quiz_text}
+"""
+
+# Gemini APIで応答の形式だけを修正して解析し直す（新しい問題を生成するより入出力が短く、温度0で内容を変えない）
+# 修正しても形式が正しくない場合は QuizFormatError
+def request_quiz_repair(quiz_type, quiz_text, error, model=None, executor=None, session_id=None):
+    model = model or get_model_registry().model()
+    prompt = build_repair_prompt(quiz_type, quiz_text, error.problems)
+    generation_config = {
+        "temperature": 0,
+        "max_output_tokens": min(QUIZ_GENERATION_CONFIG["max_output_tokens"], len(quiz_text) * 2 + 64),
+    }
+    executor = executor or get_generation_executor()
+    executor.metrics.increment("parse.repairs")
+    response = executor.run(
+        lambda: model.generate_content(prompt, generation_config=generation_config),
+        session_id or current_session_id(),
+        estimate_tokens(prompt, generation_config["max_output_tokens"]),
+    )
+    with executor.metrics.span(f"parse.{quiz_type}"):
+        return read_quiz(quiz_type, response.text)
+
+# 1問あたりの出力トークンの目安（まとめて生成するときの上限計算に使う）
+BATCH_TOKENS_PER_QUESTION = {"multiple_choice": 256, "written_answer": 1024}
+BATCH_MAX_OUTPUT_TOKENS = 8192
+
+# 1回のリクエストで生成できる問題数
+def batch_capacity(quiz_type):
+    return max(1, min(BATCH_MAX_SIZE, BATCH_MAX_OUTPUT_TOKENS // BATCH_TOKENS_PER_QUESTION[quiz_type]))
+
+# まとめて生成するためのプロンプトを作成（genre_counts: {ジャンル: 問題数}）
+def build_batch_prompt(quiz_type, genre_counts):
+    total = sum(genre_counts.values())
+    genre_lines = "\n".join(f"- 「{genre}」：{count}問" for genre, count in genre_counts.items())
+    if quiz_type == "multiple_choice":
+        kind = "4択問題"
+        rules = """
+        - options は4つの選択肢の本文のみ（番号は付けない）
+        - correct は正解の選択肢の番号（1〜4の整数）"""
+    else:
+        kind = "記述式の問題"
+        rules = """
+        - 歴史的な出来事の因果関係・時代背景・意義を考察させる問題にする
+        - model_answer は各観点を100字以内で記述する"""
+    return f"""
+        日本の歴史について、次のジャンルの{kind}を合計{total}問生成してください。
+{genre_lines}
+
+        出力は次のJSONスキーマに従う配列（JSON）のみとし、説明文やコードブロックは含めないでください。
+        配列の各要素がこのスキーマに一致すること：
+        {json.dumps(QUIZ_JSON_SCHEMAS[quiz_type], ensure_ascii=False)}
+        {rules}
+        - genre は上記のジャンル名をそのまま使う
+        - 同じ内容の問題を重複させない
+        """
+
+# Gemini APIで複数の問題をまとめて生成し、スキーマに一致した問題だけを返す
+# （バックグラウンドスレッドからはst.cache_resourceが使えないため、model・database・executorを渡して呼び出す）
+def request_quiz_batch(quiz_type, genre_counts, model=None, database=None, executor=None, session_id=None):
+    total = sum(genre_counts.values())
+    model = model or get_model_registry().model()
+    prompt = build_batch_prompt(quiz_type, genre_counts)
+    generation_config = {
+        "temperature": 0.7,
+        "top_p": 0.8,
+        "top_k": 40,
+        "max_output_tokens": min(BATCH_MAX_OUTPUT_TOKENS, BATCH_TOKENS_PER_QUESTION[quiz_type] * total),
+    }
+    executor = executor or get_generation_executor()
+    response = executor.run(
+        lambda: model.generate_content(prompt, generation_config=generation_config),
+        session_id or current_session_id(),
+        estimate_tokens(prompt, generation_config["max_output_tokens"]),
+    )
+    
+    metrics = executor.metrics
+    try:
+        with metrics.span("parse.batch"):
+            items = parse_json_array(response.text)
+    except ValueError:
+        metrics.increment("parse.failures")
+        raise
+    
+    quizzes = []
+    remaining = dict(genre_counts)
+    for item in items:
+        if not matches_schema(item, QUIZ_JSON_SCHEMAS[quiz_type]):
+            metrics.increment("parse.invalid_items")
+            continue
+        genre = item["genre"].strip()
+        if remaining.get(genre, 0) <= 0:
+            continue
+        remaining[genre] -= 1
+        
+        quiz = {"type": quiz_type, "genre": genre, "question": item["question"].strip()}
+        if quiz_type == "multiple_choice":
+            quiz["options"] = [option.strip() for option in item["options"]]
+            quiz["correct"] = item["correct"]
+        else:
+            quiz["answer"] = format_model_answer(item["model_answer"])
+        quiz["id"] = save_to_question_bank(quiz, database)
+        quizzes.append(quiz)
+    return quizzes
+
+# ジャンルごとの問題数を、1回のリクエストに収まる単位に分割
+def split_batches(quiz_type, genre_counts):
+    capacity = batch_capacity(quiz_type)
+    batches = []
+    current = {}
+    for genre, count in genre_counts.items():
+        while count > 0:
+            if sum(current.values()) >= capacity:
+                batches.append(current)
+                current = {}
+            size = min(count, capacity - sum(current.values()))
+            current[genre] = current.get(genre, 0) + size
+            count -= size
+    if current:
+        batches.append(current)
+    return batches
+
+# 解析済みの問題を (問題形式, ジャンル) ごとに先読みしておくバッファ
+class QuestionPrefetchPool:
+    def __init__(self, model_registry, database, executor, depth=PREFETCH_DEPTH, ttl=PREFETCH_TTL, workers=PREFETCH_WORKERS):
+        self.model_registry = model_registry
+        self.database = database
+        self.executor = executor
+        self.depth = depth
+        self.ttl = ttl
+        self._buffers = {}
+        self._filling = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pp-prefetch")
+        self._stats = {"hits": 0, "misses": 0, "generated": 0, "evicted": 0, "failures": 0}
+
+    # 有効期限切れの問題を破棄（ロック取得済みで呼び出すこと）
+    def _evict_stale(self, key):
+        buffer = self._buffers.setdefault(key, deque())
+        now = time.time()
+        while buffer and now - buffer[0][0] > self.ttl:
+            buffer.popleft()
+            self._stats["evicted"] += 1
+        return buffer
+
+    # 先読み済みの問題を1つ取り出す（なければNone）。取り出した分はバックグラウンドで補充する
+    def take(self, quiz_type, genre):
+        key = (quiz_type, genre)
+        with self._lock:
+            buffer = self._evict_stale(key)
+            if buffer:
+                quiz = buffer.popleft()[1]
+                self._stats["hits"] += 1
+            else:
+                quiz = None
+                self._stats["misses"] += 1
+        self.refill(quiz_type, genre)
+        return quiz
+
+    def refill(self, quiz_type, genre):
+        self.warm(quiz_type, [genre])
+
+    # 不足しているジャンルの問題を、なるべく少ないリクエストでまとめて補充する
+    def warm(self, quiz_type, genres):
+        if self.depth <= 0 or self.executor.guard.state == "open":
+            return
+        genre_counts = {}
+        with self._lock:
+            for genre in genres:
+                key = (quiz_type, genre)
+                if key in self._filling:
+                    continue
+                shortage = self.depth - len(self._evict_stale(key))
+                if shortage > 0:
+                    genre_counts[genre] = shortage
+                    self._filling.add(key)
+        if genre_counts:
+            self._executor.submit(self._fill, quiz_type, genre_counts)
+
+    def _fill(self, quiz_type, genre_counts):
+        try:
+            for batch in split_batches(quiz_type, genre_counts):
+                try:
+                    # 先読みは1つのセッションとして順番待ちし、生徒の依頼を待たせないようにする
+                    quizzes = request_quiz_batch(
+                        quiz_type,
+                        batch,
+                        model=self.model_registry.model(),
+                        database=self.database,
+                        executor=self.executor,
+                        session_id="prefetch",
+                    )
+                except Exception:
+                    quizzes = []
+                with self._lock:
+                    self._stats["failures"] += sum(batch.values()) - len(quizzes)
+                    for quiz in quizzes:
+                        self._buffers[(quiz_type, quiz["genre"])].append((time.time(), quiz))
+                        self._stats["generated"] += 1
+        finally:
+            with self._lock:
+                for genre in genre_counts:
+                    self._filling.discard((quiz_type, genre))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["buffered"] = sum(len(buffer) for buffer in self._buffers.values())
+        served = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / served * 100, 2) if served else 0
+        return stats
+
+# 先読みバッファはプロセス全体で共有する
+@st.cache_resource
+def get_prefetch_pool():
+    return QuestionPrefetchPool(get_model_registry(), get_database(), get_generation_executor())
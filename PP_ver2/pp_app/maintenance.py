@@ -0,0 +1,235 @@
+# データベースの保守（ジャンル統計の照合・古い学習ログの集計・空き領域の解放）
+# 長く動かし続けてもデータベースのファイルサイズと検索時間が増え続けないよう、バックグラウンドで定期的に実行する
+#
+#   python -m pp_app.maintenance   # 1回だけ実行する（cron などから）
+import argparse
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import streamlit as st
+
+from pp_app.config import (
+    LOG_RETENTION_DAYS, MAINTENANCE_BATCH, MAINTENANCE_INTERVAL, VACUUM_CONVERT_MAX_MB, VACUUM_PAGES,
+)
+from pp_app.db import (
+    SQL_BUMP_STATS_VERSION, DatabaseRouter, ensure_schema, get_database_router, get_db_path,
+    get_genre_stats_caches, stats_version_name,
+)
+
+logger = logging.getLogger(__name__)
+
+# アプリの実行中の保守で、ファイル全体を作り直してよい最大のサイズ（incremental_vacuum() を参照）
+APP_CONVERT_MAX_BYTES = int(VACUUM_CONVERT_MAX_MB * 1024 * 1024)
+
+SQL_SELECT_HIGH_WATER = "SELECT value FROM maintenance_state WHERE name = 'stats_high_water'"
+SQL_UPDATE_HIGH_WATER = "UPDATE maintenance_state SET value = ? WHERE name = 'stats_high_water'"
+SQL_ADD_BASELINE = '''
+    INSERT INTO genre_stats_baseline (user_id, genre, total_questions, correct_answers)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, genre) DO UPDATE
+    SET total_questions = total_questions + excluded.total_questions,
+        correct_answers = correct_answers + excluded.correct_answers
+'''
+# 集計と一致しない統計（統計の行がない場合と、集計にない統計の行も含む）
+SQL_SELECT_STATS_DRIFT = '''
+    SELECT b.user_id, b.genre, b.total_questions, b.correct_answers
+    FROM genre_stats_baseline b
+    LEFT JOIN genre_stats s ON s.user_id = b.user_id AND s.genre = b.genre
+    WHERE s.user_id IS NULL
+       OR s.total_questions != b.total_questions
+       OR s.correct_answers != b.correct_answers
+    UNION ALL
+    SELECT s.user_id, s.genre, 0, 0
+    FROM genre_stats s
+    LEFT JOIN genre_stats_baseline b ON b.user_id = s.user_id AND b.genre = s.genre
+    WHERE b.user_id IS NULL AND (s.total_questions != 0 OR s.correct_answers != 0)
+'''
+SQL_REPLACE_GENRE_STATS = '''
+    INSERT INTO genre_stats (user_id, genre, total_questions, correct_answers)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, genre) DO UPDATE
+    SET total_questions = excluded.total_questions,
+        correct_answers = excluded.correct_answers,
+        last_updated = CURRENT_TIMESTAMP
+'''
+# 保存期間を過ぎた学習ログ（照合済みの行だけ）を古い順に MAINTENANCE_BATCH 件ずつまとめる
+SQL_SELECT_EXPIRED_BATCH_END = '''
+    SELECT MAX(id) FROM (
+        SELECT id FROM learning_log
+        WHERE id <= ? AND timestamp < ?
+        ORDER BY id
+        LIMIT ?
+    )
+'''
+SQL_ROLL_UP_DAILY = '''
+    INSERT INTO learning_log_daily (user_id, day, genre, total_questions, correct_answers, score_sum, score_count)
+    SELECT user_id, date(timestamp), genre, COUNT(*), COALESCE(SUM(is_correct), 0), COALESCE(SUM(score), 0), COUNT(score)
+    FROM learning_log
+    WHERE id <= ? AND timestamp < ?
+    GROUP BY user_id, date(timestamp), genre
+    ON CONFLICT (user_id, day, genre) DO UPDATE
+    SET total_questions = total_questions + excluded.total_questions,
+        correct_answers = correct_answers + excluded.correct_answers,
+        score_sum = score_sum + excluded.score_sum,
+        score_count = score_count + excluded.score_count
+'''
+SQL_SELECT_EXPIRED_TOTALS = '''
+    SELECT user_id, genre, COUNT(*), COALESCE(SUM(is_correct), 0)
+    FROM learning_log
+    WHERE id <= ? AND timestamp < ?
+    GROUP BY user_id, genre
+'''
+SQL_DELETE_EXPIRED = "DELETE FROM learning_log WHERE id <= ? AND timestamp < ?"
+
+# ジャンル統計を学習ログと照合し、ずれていた統計を直す（戻り値は直した学習者IDの集合）
+# 前回の照合以降に追加された行（id が stats_high_water より大きい行）だけを集計に加えるため、
+# 学習ログ全体を読み直すのは初回だけ。照合済みの行の削除はトリガーで集計から差し引かれる
+def reconcile_genre_stats(database):
+    with database.metrics.span("maintenance.reconcile"), database.transaction() as conn:
+        high_water = conn.execute(SQL_SELECT_HIGH_WATER).fetchone()[0]
+        latest = conn.execute("SELECT COALESCE(MAX(id), 0) FROM learning_log").fetchone()[0]
+        if latest > high_water:
+            conn.executemany(SQL_ADD_BASELINE, conn.execute('''
+                SELECT user_id, genre, COUNT(*), COALESCE(SUM(is_correct), 0)
+                FROM learning_log
+                WHERE id > ? AND id <= ?
+                GROUP BY user_id, genre
+            ''', (high_water, latest)).fetchall())
+            conn.execute(SQL_UPDATE_HIGH_WATER, (latest,))
+        drift = conn.execute(SQL_SELECT_STATS_DRIFT).fetchall()
+        conn.executemany(SQL_REPLACE_GENRE_STATS, drift)
+        users = {user_id for user_id, *_ in drift}
+        for user_id in users:
+            conn.execute(SQL_BUMP_STATS_VERSION, (stats_version_name(user_id),))
+    database.metrics.increment("maintenance.stats_fixed", len(drift))
+    return users
+
+# 保存期間を過ぎた学習ログを日別・ジャンル別の集計（learning_log_daily）にまとめて削除する（戻り値はまとめた行数）
+# ジャンル統計には引き続き含めるため、削除で集計から差し引かれる分を先に足し戻しておく
+# 1回のトランザクションは MAINTENANCE_BATCH 件までにして、回答の記録を長く待たせない
+def compact_learning_log(database, retention_days, batch_size=MAINTENANCE_BATCH):
+    if retention_days <= 0:
+        return 0
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+    compacted = 0
+    with database.metrics.span("maintenance.compact"):
+        while True:
+            with database.transaction() as conn:
+                high_water = conn.execute(SQL_SELECT_HIGH_WATER).fetchone()[0]
+                batch_end = conn.execute(SQL_SELECT_EXPIRED_BATCH_END, (high_water, cutoff, batch_size)).fetchone()[0]
+                if batch_end is None:
+                    break
+                conn.execute(SQL_ROLL_UP_DAILY, (batch_end, cutoff))
+                conn.executemany(SQL_ADD_BASELINE, conn.execute(SQL_SELECT_EXPIRED_TOTALS, (batch_end, cutoff)).fetchall())
+                rows = conn.execute(SQL_DELETE_EXPIRED, (batch_end, cutoff)).rowcount
+            compacted += rows
+            if rows < batch_size:
+                break
+    database.metrics.increment("maintenance.rows_compacted", compacted)
+    return compacted
+
+# 空きページをファイルから解放する（戻り値は解放したページ数）
+# auto_vacuum が無効のまま作られた既存のデータベースは、VACUUM でファイル全体を作り直して INCREMENTAL に切り替える。
+# 作り直しの間は他の接続が書き込めないため、convert_max_bytes（None は制限なし）より大きいファイルは切り替えない
+# （大きいファイルはアプリを止めてコマンドラインの python -m pp_app.maintenance で切り替える）
+def incremental_vacuum(database, max_pages=VACUUM_PAGES, convert_max_bytes=None):
+    with database.metrics.span("maintenance.vacuum"), database.connection() as conn:
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if convert_max_bytes is not None and before * conn.execute("PRAGMA page_size").fetchone()[0] > convert_max_bytes:
+                database.metrics.increment("maintenance.vacuum_skipped")
+                return 0
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        elif max_pages > 0 and conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            # execute() では1ページ分しか進まないため、最後まで実行される executescript() を使う
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        # VACUUM で auto_vacuum 用のページが増えた場合は0とする
+        freed = max(0, before - conn.execute("PRAGMA page_count").fetchone()[0])
+    database.metrics.increment("maintenance.pages_vacuumed", freed)
+    return freed
+
+# すべてのデータベースファイルの保守を1回行う（convert_max_bytes は incremental_vacuum() を参照）
+# 戻り値は {"stats_fixed": 直した学習者IDの集合, "rows_compacted", "pages_vacuumed"}
+def run_maintenance(router, retention_days=LOG_RETENTION_DAYS, vacuum_pages=VACUUM_PAGES, convert_max_bytes=None):
+    result = {"stats_fixed": set(), "rows_compacted": 0, "pages_vacuumed": 0}
+    databases = [router.shared, *[database for database in router.user_databases() if database is not router.shared]]
+    for database in databases:
+        ensure_schema(database)
+        # 集計にまとめるのは照合済みの行だけなので、先に照合する
+        result["stats_fixed"] |= reconcile_genre_stats(database)
+        result["rows_compacted"] += compact_learning_log(database, retention_days)
+        result["pages_vacuumed"] += incremental_vacuum(database, vacuum_pages, convert_max_bytes)
+    return result
+
+# 保守を interval 秒ごとに行うバックグラウンドスレッド
+# （バックグラウンドスレッドからはst.cache_resourceが使えないため、router・統計キャッシュを渡す）
+class MaintenanceJob:
+    def __init__(self, router, stats_caches, interval=MAINTENANCE_INTERVAL, retention_days=LOG_RETENTION_DAYS):
+        self.router = router
+        self.stats_caches = stats_caches
+        self.interval = interval
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "failures": 0, "stats_fixed": 0, "rows_compacted": 0, "pages_vacuumed": 0, "last_run": None}
+        self._thread = threading.Thread(target=self._run, name="pp-maintenance", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            # 起動直後の画面表示と重ならないよう、最初の保守も interval 秒後に行う
+            time.sleep(self.interval)
+            # どのような例外でも、スレッドを止めずに次の保守を行う
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("データベースの保守に失敗しました")
+                self.router.metrics.increment("maintenance.failures")
+                self._stats["failures"] += 1
+
+    def run_once(self):
+        with self._lock:
+            result = run_maintenance(self.router, self.retention_days, convert_max_bytes=APP_CONVERT_MAX_BYTES)
+            # 統計を直した学習者は、メモリ上のキャッシュも読み直させる
+            for user_id in result["stats_fixed"]:
+                cache = self.stats_caches.peek(user_id)
+                if cache:
+                    cache.invalidate()
+            self._stats["runs"] += 1
+            self._stats["stats_fixed"] += len(result["stats_fixed"])
+            self._stats["rows_compacted"] += result["rows_compacted"]
+            self._stats["pages_vacuumed"] += result["pages_vacuumed"]
+            self._stats["last_run"] = time.time()
+        return result
+
+    def stats(self):
+        return dict(self._stats)
+
+@st.cache_resource
+def get_maintenance_job():
+    return MaintenanceJob(get_database_router(), get_genre_stats_caches())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="データベースの保守（統計の照合・古い学習ログの集計・空き領域の解放）")
+    parser.add_argument("--db", help="データベースファイル（省略時はアプリと同じ learning_log.db）")
+    parser.add_argument("--retention-days", type=int, default=LOG_RETENTION_DAYS, help="この日数より古い学習ログを日別の集計にまとめる（0で無効）")
+    parser.add_argument("--vacuum-pages", type=int, default=VACUUM_PAGES, help="解放する空きページ数の上限")
+    args = parser.parse_args(argv)
+    try:
+        router = DatabaseRouter(args.db or get_db_path())
+        result = run_maintenance(router, args.retention_days, args.vacuum_pages)
+    except sqlite3.Error as e:
+        print(f"エラー: {str(e)}", file=sys.stderr)
+        return 1
+    print(
+        f"統計を直した学習者: {len(result['stats_fixed'])}人 / "
+        f"集計にまとめた学習ログ: {result['rows_compacted']}件 / 解放したページ: {result['pages_vacuumed']}"
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# 計測（処理ごとの所要時間のヒストグラムと件数のカウンター）
+import bisect
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import streamlit as st
+
+from pp_app.config import METRICS_BUCKETS, METRICS_EXPORT_INTERVAL
+
+# --- 計測 ---
+# 処理ごとの所要時間（スパン）をヒストグラムに、生成回数・解析の失敗・再試行・ロック待ちなどをカウンターに、プロセス全体で集計する。
+# スパンの名前は「対象.処理」（例: gemini.generate, db.write）とし、例外で抜けたスパンは「名前.errors」のカウンターにも数える。
+class Metrics:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.started_at = time.time()
+        self._histograms = {}  # name -> {"counts": 区切りごとの件数（最後は上限超え）, "sum": 合計秒数, "max": 最大秒数}
+        self._counters = Counter()
+        self._exported_at = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "max": 0.0}
+            histogram["counts"][index] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment(f"{name}.errors")
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def _copy(self):
+        with self._lock:
+            histograms = {
+                name: {"counts": list(histogram["counts"]), "sum": histogram["sum"], "max": histogram["max"]}
+                for name, histogram in self._histograms.items()
+            }
+            return histograms, dict(self._counters)
+
+    # ヒストグラムからパーセンタイルを推定する（区切りの中は一様に分布しているとみなす）
+    def _quantile(self, histogram, q):
+        counts = histogram["counts"]
+        rank = q * sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = min(self.buckets[i], histogram["max"]) if i < len(self.buckets) else histogram["max"]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def snapshot(self):
+        histograms, counters = self._copy()
+        spans = {}
+        for name, histogram in sorted(histograms.items()):
+            count = sum(histogram["counts"])
+            cumulative = 0
+            buckets = []
+            for bound, bucket_count in zip([*self.buckets, "+Inf"], histogram["counts"]):
+                cumulative += bucket_count
+                buckets.append([bound, cumulative])
+            spans[name] = {
+                "count": count,
+                "mean_ms": round(histogram["sum"] / count * 1000, 3),
+                "p50_ms": round(self._quantile(histogram, 0.5) * 1000, 3),
+                "p95_ms": round(self._quantile(histogram, 0.95) * 1000, 3),
+                "p99_ms": round(self._quantile(histogram, 0.99) * 1000, 3),
+                "max_ms": round(histogram["max"] * 1000, 3),
+                "buckets": buckets,
+            }
+        return {
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "spans": spans,
+            "counters": dict(sorted(counters.items())),
+        }
+
+    # Prometheusのテキスト形式（スパンは span ラベル、カウンターは event ラベルで区別する）
+    def to_prometheus(self):
+        histograms, counters = self._copy()
+        lines = [
+            "# HELP pp_process_start_time_seconds Start time of the process since unix epoch in seconds.",
+            "# TYPE pp_process_start_time_seconds gauge",
+            f"pp_process_start_time_seconds {self.started_at:.3f}",
+            "# HELP pp_span_seconds Duration of instrumented stages in seconds.",
+            "# TYPE pp_span_seconds histogram",
+        ]
+        for name, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], histogram["counts"]):
+                cumulative += count
+                lines.append(f'pp_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'pp_span_seconds_sum{{span="{name}"}} {histogram["sum"]:.6f}')
+            lines.append(f'pp_span_seconds_count{{span="{name}"}} {cumulative}')
+        lines += [
+            "# HELP pp_events_total Number of events such as generations, parse failures, retries and lock waits.",
+            "# TYPE pp_events_total counter",
+        ]
+        for name, count in sorted(counters.items()):
+            lines.append(f'pp_events_total{{event="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    # ファイルに書き出す（読み取り側が書きかけのファイルを読まないよう、一時ファイルから置き換える）
+    def export(self, path):
+        path = Path(path)
+        if path.suffix == ".json":
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        else:
+            text = self.to_prometheus()
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.write_text(text, encoding="utf-8")
+        os.replace(temporary, path)
+
+    # 前回の書き出しから interval 秒以上経っていれば書き出す
+    def export_if_due(self, path, interval=METRICS_EXPORT_INTERVAL):
+        with self._lock:
+            if time.time() - self._exported_at < interval:
+                return False
+            self._exported_at = time.time()
+        self.export(path)
+        return True
+
+# 計測結果はプロセス全体で共有する（バックグラウンドの処理には引数で渡す）
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+# 計測結果の表示（デバッグモード用。処理ごとの所要時間と各種の件数をプロセス全体で集計したもの）
+def show_metrics_panel():
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+    with st.expander("計測結果", expanded=True):
+        st.caption(f"プロセスの起動から {snapshot['uptime_seconds']}秒（p50・p95・p99はヒストグラムからの推定値）")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("問題の生成", counters.get("gemini.generations", 0))
+        col2.metric("解析の失敗", counters.get("parse.failures", 0))
+        col3.metric("再試行", counters.get("gemini.retries", 0))
+        col4.metric("ロック待ち", counters.get("db.lock_waits", 0))
+        # 表はMarkdownで表示する（再実行のたびに描画するため、データフレームの変換を避ける）
+        if snapshot["spans"]:
+            rows = [
+                "| 処理 | 回数 | 平均(ms) | p50(ms) | p95(ms) | p99(ms) | 最大(ms) | エラー |",
+                "|---|---:|---:|---:|---:|---:|---:|---:|",
+            ]
+            for name, span in snapshot["spans"].items():
+                rows.append(
+                    f"| {name} | {span['count']} | {span['mean_ms']} | {span['p50_ms']} | {span['p95_ms']} | "
+                    f"{span['p99_ms']} | {span['max_ms']} | {counters.get(f'{name}.errors', 0)} |"
+                )
+            st.markdown("\n".join(rows))
+        events = [f"| {name} | {count} |" for name, count in counters.items() if not name.endswith(".errors")]
+        if events:
+            st.markdown("\n".join(["| 項目 | 件数 |", "|---|---:|", *events]))
+        prometheus_col, json_col = st.columns(2)
+        prometheus_col.download_button(
+            "Prometheus形式で保存", metrics.to_prometheus(), file_name="pp_metrics.prom", mime="text/plain"
+        )
+        json_col.download_button(
+            "JSONで保存", json.dumps(snapshot, ensure_ascii=False, indent=2),
+            file_name="pp_metrics.json", mime="application/json"
+        )
@@ -0,0 +1,189 @@
+# 直近に出題した問題とほぼ同じ問題の検出（問題文の文字の3つ組による MinHash と LSH）
+# 学習者ごとに直近 NOVELTY_WINDOW 問の署名をデータベースに保存し、プロセスごとにメモリに読み込んで照合する
+import functools
+import hashlib
+import operator
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+import streamlit as st
+
+from pp_app.config import NOVELTY_PERMUTATIONS, NOVELTY_SHINGLE_SIZE, NOVELTY_THRESHOLD, NOVELTY_WINDOW
+from pp_app.db import UserCacheRegistry, current_user_id, get_database_router
+from pp_app.metrics import get_metrics
+
+# 署名の値の下位ビット（残りの上位ビットには、空のビンが値を借りたビンまでの距離を入れる）
+BIN_VALUE_BITS = 58
+
+SQL_INSERT_SIGNATURE = "INSERT INTO question_signatures (user_id, question, signature) VALUES (?, ?, ?)"
+# window 件より古い署名を削除する
+SQL_TRIM_SIGNATURES = '''
+    DELETE FROM question_signatures
+    WHERE user_id = ? AND id <= (
+        SELECT id FROM question_signatures WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+    )
+'''
+
+# 問題文を文字の組の集合にする（全角・半角と大文字・小文字の違い、空白・記号は無視する）
+def shingles(text, size=NOVELTY_SHINGLE_SIZE):
+    text = unicodedata.normalize('NFKC', text or "").lower()
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PZSC")
+    return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+
+# MinHashの署名（2つの署名で値が一致する割合が、文字の組の集合の Jaccard 係数の推定値になる）
+# 文字の組ごとにハッシュ関数を NOVELTY_PERMUTATIONS 回計算する代わりに、1回のハッシュ値を
+# NOVELTY_PERMUTATIONS 個のビンに振り分けて各ビンの最小値を取る（one permutation hashing）。
+# 問題文が短く空のビンができた場合は、次の空でないビンの値を距離つきで借りる（densification）。
+# ハッシュ値はプロセスや再起動をまたいで同じになるため、保存した署名とそのまま比べられる。
+# 照合と履歴への追加で同じ問題文の署名を2回計算しないよう、最近の結果を保持する
+@functools.lru_cache(maxsize=256)
+def question_signature(question):
+    bins = [None] * NOVELTY_PERMUTATIONS
+    for shingle in shingles(question):
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        index, value = h % NOVELTY_PERMUTATIONS, (h // NOVELTY_PERMUTATIONS) & ((1 << BIN_VALUE_BITS) - 1)
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+    signature = []
+    for i in range(NOVELTY_PERMUTATIONS):
+        distance = 0
+        while bins[(i + distance) % NOVELTY_PERMUTATIONS] is None:
+            distance += 1
+        signature.append((distance << BIN_VALUE_BITS) | bins[(i + distance) % NOVELTY_PERMUTATIONS])
+    return tuple(signature)
+
+def signature_similarity(a, b):
+    return sum(map(operator.eq, a, b)) / len(a)
+
+# LSHの (バンド数, 1バンドの行数)。いずれかのバンドがすべて一致した問題だけを候補として照合する。
+# 候補になりやすい類似度の境目 (1 / バンド数) ^ (1 / 行数) が threshold の8割以下になる最大の行数を選び、
+# threshold 付近の問題を取りこぼさないようにする（候補は署名全体で照合し直す）
+def lsh_bands(permutations, threshold):
+    rows = 1
+    for r in range(1, permutations + 1):
+        if permutations % r == 0 and (r / permutations) ** (1 / r) <= threshold * 0.8:
+            rows = r
+    return permutations // rows, rows
+
+# 学習者ごとの直近の出題の索引
+# 照合は問題文の署名の計算（1回）と、バンドごとの辞書の参照だけで済むため、履歴の件数にほぼよらない
+class NoveltyIndex:
+    def __init__(self, database, user_id, window=NOVELTY_WINDOW, threshold=NOVELTY_THRESHOLD):
+        self.database = database
+        self.user_id = user_id
+        self.window = window
+        self.threshold = threshold
+        self.bands, self.rows = lsh_bands(NOVELTY_PERMUTATIONS, threshold)
+        self._entries = None  # {id: (問題文, 署名)}（古い順。None は未読み込み）
+        self._buckets = {}  # {(バンドの番号, バンドの値): {id}}
+        self._lock = threading.Lock()
+        self._stats = {"checks": 0, "duplicates": 0}
+
+    def _band_keys(self, signature):
+        return [(i, signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def _load(self):
+        with self.database.connection() as conn:
+            rows = conn.execute('''
+                SELECT id, question, signature FROM question_signatures
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (self.user_id, self.window)).fetchall()
+        self._entries = OrderedDict()
+        self._buckets = {}
+        for entry_id, question, blob in reversed(rows):
+            # 署名の長さの設定を変えた場合は、問題文から計算し直す
+            signature = array('Q', blob) if blob and len(blob) == 8 * NOVELTY_PERMUTATIONS else question_signature(question)
+            self._insert(entry_id, question, tuple(signature))
+
+    def _insert(self, entry_id, question, signature):
+        self._entries[entry_id] = (question, signature)
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, set()).add(entry_id)
+        while len(self._entries) > self.window:
+            old_id, (_, old_signature) = self._entries.popitem(last=False)
+            for key in self._band_keys(old_signature):
+                bucket = self._buckets[key]
+                bucket.discard(old_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    # 直近に出題した問題のうち、最も似ている問題を (類似度, 問題文) で返す（threshold 以上の問題がなければNone）
+    def find_duplicate(self, question):
+        if self.window <= 0:
+            return None
+        signature = question_signature(question)
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates |= self._buckets.get(key, set())
+            match = None
+            for entry_id in candidates:
+                entry_question, entry_signature = self._entries[entry_id]
+                similarity = signature_similarity(signature, entry_signature)
+                if similarity >= self.threshold and (match is None or similarity > match[0]):
+                    match = (similarity, entry_question)
+            self._stats["checks"] += 1
+            if match:
+                self._stats["duplicates"] += 1
+            return match
+
+    # 出題した問題を履歴に加える（データベースにも保存し、window 件より古い署名は削除する）
+    def add(self, question):
+        if self.window <= 0:
+            return
+        signature = question_signature(question)
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            with self.database.transaction() as conn:
+                entry_id = conn.execute(
+                    SQL_INSERT_SIGNATURE, (self.user_id, question, array('Q', signature).tobytes())
+                ).lastrowid
+                conn.execute(SQL_TRIM_SIGNATURES, (self.user_id, self.user_id, self.window))
+            self._insert(entry_id, question, signature)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["history"] = len(self._entries) if self._entries is not None else 0
+        return stats
+
+@st.cache_resource
+def get_novelty_indexes():
+    router = get_database_router()
+    return UserCacheRegistry(lambda user_id: NoveltyIndex(router.for_user(user_id), user_id))
+
+def get_novelty_index():
+    return get_novelty_indexes().get(current_user_id())
+
+# 現在の学習者に直近で出題した問題とほぼ同じ問題なら (類似度, 出題済みの問題文) を返す
+# 照合できなかった場合（データベースのエラー）は、出題を止めないよう重複なしとして扱う
+def find_recent_duplicate(quiz):
+    metrics = get_metrics()
+    try:
+        with metrics.span("novelty.check"):
+            match = get_novelty_index().find_duplicate(quiz["question"])
+    except sqlite3.Error:
+        metrics.increment("novelty.failures")
+        return None
+    if match:
+        metrics.increment("novelty.duplicates")
+    return match
+
+# 出題した問題を現在の学習者の履歴に加える
+def remember_question(quiz):
+    try:
+        get_novelty_index().add(quiz["question"])
+    except sqlite3.Error:
+        get_metrics().increment("novelty.failures")
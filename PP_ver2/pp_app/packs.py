@@ -0,0 +1,279 @@
+# 問題パック（事前に生成・検証した問題をまとめたファイル）
+# APIキーがない場合やGemini APIの障害時に、通信なし・待ち時間なしで出題するために使う。
+# アプリはファイルをメモリマップで開き、問題形式・ジャンルを指定して O(1) で1問ずつ取り出す。
+#
+#   python -m pp_app.packs build --per-genre 100          # Gemini APIで生成して作る（GOOGLE_API_KEY が必要）
+#   python -m pp_app.packs build --source bank            # これまでに生成して問題バンクに保存した問題から作る
+#   python -m pp_app.packs info                           # 問題形式・ジャンルごとの問題数を表示する
+#
+# ファイルの形式（数値はリトルエンディアン）:
+#   PACK_MAGIC (8バイト) | ヘッダーの長さ (uint32) | ヘッダー (JSON)
+#   | 問題の位置の表 (uint64 × 問題数) | 問題 (長さ uint32 + JSON) × 問題数
+# ヘッダーには問題形式・ジャンルごとに、位置の表での開始番号と問題数を記録する。
+# 同じ問題形式の問題は表の中で連続しているため、ジャンルを指定しない場合も1回の乱数で選べる。
+import argparse
+import json
+import mmap
+import os
+import random
+import sqlite3
+import struct
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import streamlit as st
+
+from pp_app.config import GENRES, NOVELTY_PERMUTATIONS, NOVELTY_THRESHOLD, QUESTION_PACK
+from pp_app.db import DatabaseRouter, ensure_schema, get_db_path, quiz_from_bank_row
+from pp_app.metrics import get_metrics
+from pp_app.novelty import lsh_bands, question_signature, signature_similarity
+from pp_app.parsing import QUIZ_TEXT_SCHEMAS, matches_schema
+
+PACK_MAGIC = b"PPQPACK1"
+PACK_QUIZ_TYPES = ("multiple_choice", "written_answer")
+PACK_GENERATION_ROUNDS = 3  # 生成した問題が不足したジャンルを生成し直す回数
+
+# 問題パックのファイル（指定がなければ pp.py と同じ場所。Streamlit Cloudでもリポジトリに含めて配置できる）
+def get_pack_path():
+    return Path(QUESTION_PACK) if QUESTION_PACK else Path(__file__).resolve().parent.parent / 'question_pack.ppq'
+
+# --- 読み込み ---
+
+class QuestionPack:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._mmap[:len(PACK_MAGIC)] != PACK_MAGIC:
+                raise ValueError(f"問題パックのファイルではありません: {self.path}")
+            header_length = struct.unpack_from("<I", self._mmap, len(PACK_MAGIC))[0]
+            self._table = len(PACK_MAGIC) + 4 + header_length
+            header = json.loads(self._mmap[len(PACK_MAGIC) + 4:self._table])
+            self.sections = header["sections"]  # {問題形式: {"start", "count", "genres": {ジャンル: [開始番号, 問題数]}}}
+            self.created_at = header.get("created_at")
+            self.total = sum(section["count"] for section in self.sections.values())
+            if len(self._mmap) < self._table + 8 * self.total:
+                raise ValueError(f"問題パックのファイルが途中で切れています: {self.path}")
+        except (ValueError, KeyError, struct.error) as e:
+            self._mmap.close()
+            raise ValueError(str(e)) from e
+
+    def _read(self, index):
+        position = struct.unpack_from("<Q", self._mmap, self._table + 8 * index)[0]
+        length = struct.unpack_from("<I", self._mmap, position)[0]
+        return json.loads(self._mmap[position + 4:position + 4 + length])
+
+    def count(self, quiz_type, genre=None):
+        section = self.sections.get(quiz_type)
+        if not section:
+            return 0
+        if genre is None:
+            return section["count"]
+        return section["genres"].get(genre, [0, 0])[1]
+
+    # 問題を1問ランダムに取り出す（指定したジャンルの問題がなければ、同じ問題形式のすべての問題から選ぶ）
+    def sample(self, quiz_type, genre=None, rng=random):
+        section = self.sections.get(quiz_type)
+        if not section or not section["count"]:
+            return None
+        start, count = section["genres"].get(genre) or (section["start"], section["count"])
+        quiz = self._read(start + rng.randrange(count))
+        quiz["type"] = quiz_type
+        return quiz
+
+    def close(self):
+        self._mmap.close()
+
+# 問題パックはプロセス全体で共有する（ファイルがない場合はNone。作り直した場合はアプリの再起動で読み込まれる）
+@st.cache_resource
+def get_question_pack():
+    path = get_pack_path()
+    if not path.exists():
+        return None
+    try:
+        with get_metrics().span("pack.open"):
+            return QuestionPack(path)
+    except (OSError, ValueError):
+        get_metrics().increment("pack.load_failures")
+        return None
+
+# --- 作成 ---
+
+# 問題パックに入れられる問題か（問題形式ごとのスキーマに一致し、ジャンルが出題ジャンルのいずれか）
+def is_valid_pack_quiz(quiz):
+    return (
+        quiz.get("type") in QUIZ_TEXT_SCHEMAS
+        and quiz.get("genre") in GENRES
+        and matches_schema(quiz, QUIZ_TEXT_SCHEMAS[quiz["type"]])
+    )
+
+# 同じ問題形式・ジャンルの中で、先に採用した問題とほぼ同じ問題を除く
+# 直近の出題の索引と同じく、LSHのバンドが一致した問題だけを署名全体で照合する
+# seen（{(問題形式, ジャンル, バンドの番号, バンドの値): {署名}}）を渡すと、前回までに採用した問題とも比べて追記する
+def remove_near_duplicates(quizzes, threshold=NOVELTY_THRESHOLD, seen=None):
+    seen = {} if seen is None else seen
+    bands, rows = lsh_bands(NOVELTY_PERMUTATIONS, threshold)
+    kept = []
+    for quiz in quizzes:
+        signature = question_signature(quiz["question"])
+        keys = [(quiz["type"], quiz["genre"], i, signature[i * rows:(i + 1) * rows]) for i in range(bands)]
+        candidates = set()
+        for key in keys:
+            candidates.update(seen.get(key, ()))
+        if any(signature_similarity(signature, other) >= threshold for other in candidates):
+            continue
+        for key in keys:
+            seen.setdefault(key, set()).add(signature)
+        kept.append(quiz)
+    return kept
+
+def encode_pack_quiz(quiz):
+    record = {"genre": quiz["genre"], "question": quiz["question"]}
+    if quiz["type"] == "multiple_choice":
+        record["options"] = quiz["options"]
+        record["correct"] = quiz["correct"]
+    else:
+        record["answer"] = quiz["answer"]
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# 問題を検証して問題パックのファイルに書き出す（戻り値は {問題形式: {ジャンル: 問題数}}）
+# 書き出し中のファイルをアプリが開かないよう、一時ファイルに書いてから置き換える
+def write_pack(path, quizzes):
+    groups = {}
+    for quiz in remove_near_duplicates([quiz for quiz in quizzes if is_valid_pack_quiz(quiz)]):
+        groups.setdefault(quiz["type"], {}).setdefault(quiz["genre"], []).append(quiz)
+
+    records = []
+    sections = {}
+    for quiz_type in PACK_QUIZ_TYPES:
+        section = {"start": len(records), "count": 0, "genres": {}}
+        for genre in GENRES:
+            genre_quizzes = groups.get(quiz_type, {}).get(genre, [])
+            if genre_quizzes:
+                section["genres"][genre] = [len(records), len(genre_quizzes)]
+                records.extend(encode_pack_quiz(quiz) for quiz in genre_quizzes)
+        section["count"] = len(records) - section["start"]
+        sections[quiz_type] = section
+    header = json.dumps({
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sections": sections,
+    }, ensure_ascii=False).encode("utf-8")
+
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    position = len(PACK_MAGIC) + 4 + len(header) + 8 * len(records)
+    with open(tmp_path, "wb") as f:
+        f.write(PACK_MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for record in records:
+            f.write(struct.pack("<Q", position))
+            position += 4 + len(record)
+        for record in records:
+            f.write(struct.pack("<I", len(record)))
+            f.write(record)
+    os.replace(tmp_path, path)
+    return {quiz_type: {genre: count for genre, (_, count) in section["genres"].items()} for quiz_type, section in sections.items()}
+
+# 問題バンクに保存済みの問題（新しいものから、ジャンルごとに per_genre 問まで）
+def collect_from_bank(database, quiz_types, per_genre):
+    quizzes = []
+    with database.connection() as conn:
+        for quiz_type in quiz_types:
+            for genre in GENRES:
+                rows = conn.execute('''
+                    SELECT id, genre, question, options, correct_index, model_answer
+                    FROM question_bank
+                    WHERE quiz_type = ? AND genre = ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (quiz_type, genre, per_genre)).fetchall()
+                quizzes.extend(quiz_from_bank_row(quiz_type, row) for row in rows)
+    return quizzes
+
+# Gemini APIでジャンルごとに per_genre 問ずつまとめて生成する（不足したジャンルは PACK_GENERATION_ROUNDS 回まで生成し直す）
+# 生成した問題は問題バンクにも保存される
+def collect_generated(database, quiz_types, per_genre, model, executor, progress=None):
+    from pp_app.generation import request_quiz_batch, split_batches
+    quizzes = []
+    seen = {}
+    for quiz_type in quiz_types:
+        counts = {genre: 0 for genre in GENRES}
+        for _ in range(PACK_GENERATION_ROUNDS):
+            shortage = {genre: per_genre - count for genre, count in counts.items() if count < per_genre}
+            if not shortage:
+                break
+            for batch in split_batches(quiz_type, shortage):
+                try:
+                    generated = request_quiz_batch(
+                        quiz_type, batch, model=model, database=database, executor=executor, session_id="pack"
+                    )
+                except Exception as e:
+                    if progress:
+                        progress(f"生成に失敗しました（{quiz_type}）: {str(e)}")
+                    continue
+                for quiz in remove_near_duplicates(generated, seen=seen):
+                    counts[quiz["genre"]] += 1
+                    quizzes.append(quiz)
+            if progress:
+                progress(f"{quiz_type}: {sum(min(count, per_genre) for count in counts.values())}/{per_genre * len(GENRES)}問")
+    return quizzes
+
+def build_command(args):
+    database = DatabaseRouter(args.db or get_db_path()).shared
+    ensure_schema(database)
+    quiz_types = args.types.split(",")
+    if args.source == "bank":
+        quizzes = collect_from_bank(database, quiz_types, args.per_genre)
+    else:
+        api_key = os.getenv('GOOGLE_API_KEY')
+        if not api_key:
+            print("エラー: Gemini APIで生成するには環境変数 GOOGLE_API_KEY が必要です", file=sys.stderr)
+            return 1
+        from pp_app.generation import GenerationExecutor, GenerationGuard, ModelRegistry, load_genai
+        load_genai().configure(api_key=api_key)
+        metrics = get_metrics()
+        executor = GenerationExecutor(GenerationGuard(metrics=metrics))
+        model = ModelRegistry(metrics=metrics).model()
+        quizzes = collect_generated(
+            database, quiz_types, args.per_genre, model, executor, progress=lambda text: print(text, file=sys.stderr)
+        )
+    counts = write_pack(args.out or get_pack_path(), quizzes)
+    for quiz_type, genre_counts in counts.items():
+        print(f"{quiz_type}: {sum(genre_counts.values())}問（{len(genre_counts)}ジャンル）")
+    return 0
+
+def info_command(args):
+    pack = QuestionPack(args.path or get_pack_path())
+    print(f"{pack.path}（{pack.path.stat().st_size // 1024} KB、作成: {pack.created_at}）")
+    for quiz_type, section in pack.sections.items():
+        print(f"{quiz_type}: {section['count']}問")
+        for genre, (_, count) in section["genres"].items():
+            print(f"  {genre}: {count}問")
+    pack.close()
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="問題パック（オフラインで出題する問題のファイル）の作成")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="問題パックを作る")
+    build_parser.add_argument("--out", help="書き出すファイル（省略時は PP_QUESTION_PACK または question_pack.ppq）")
+    build_parser.add_argument("--source", choices=["gemini", "bank"], default="gemini", help="問題の取得元")
+    build_parser.add_argument("--per-genre", type=int, default=100, help="問題形式・ジャンルごとの問題数")
+    build_parser.add_argument("--types", default=",".join(PACK_QUIZ_TYPES), help="問題形式（カンマ区切り）")
+    build_parser.add_argument("--db", help="問題バンクのデータベースファイル（省略時はアプリと同じ learning_log.db）")
+    info_parser = subparsers.add_parser("info", help="問題パックの問題数を表示する")
+    info_parser.add_argument("path", nargs="?", help="問題パックのファイル")
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "build":
+            return build_command(args)
+        return info_command(args)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"エラー: {str(e)}", file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# 各モードの画面（必要なモードを開いたときに読み込む）
@@ -0,0 +1,372 @@
+# 4択・記述式のクイズ画面で共通に使う処理（出題、練習セット、デバッグ用の統計）
+import os
+import random
+
+import streamlit as st
+
+from pp_app.answers import get_answer_writer
+from pp_app.config import (
+    PACK_SAMPLE_ATTEMPTS, PARSE_REPAIR, QUESTION_BANK_RATIO, STREAMING, WRITE_BEHIND, WRITTEN_BORDERLINE_MARGIN,
+)
+from pp_app.db import pick_from_question_bank, save_to_question_bank
+from pp_app.generation import (
+    get_generation_executor, get_generation_guard, get_model_registry, get_prefetch_pool, is_retryable_error,
+    load_genai, request_quiz_batch, request_quiz_repair, request_quiz_text, split_batches, stream_quiz_text,
+)
+from pp_app.metrics import get_metrics
+from pp_app.novelty import find_recent_duplicate, get_novelty_index, remember_question
+from pp_app.packs import get_question_pack
+from pp_app.parsing import QuizFormatError, read_quiz, scan_quiz_text
+from pp_app.scheduler import get_review_scheduler, pick_due_review, select_genre
+from pp_app.scoring import get_answer_reviewer
+
+# Gemini APIのキーを取得（環境変数 → Streamlit CloudのSecrets → 画面で入力 の順）
+# 入力されていなければNone
+def get_api_key():
+    api_key = os.getenv('GOOGLE_API_KEY')
+    
+    # Streamlit Cloudでの実行時の設定
+    if not api_key and 'STREAMLIT_SHARING_MODE' in os.environ:
+        # Streamlit Cloudの環境変数から取得
+        api_key = st.secrets.get("GOOGLE_API_KEY")
+        if api_key:
+            st.session_state.api_key_set = True
+    
+    # ローカル開発環境での実行時の設定（入力したキーはセッションの間保持する）
+    api_key = api_key or st.session_state.get('api_key')
+    if not api_key and not st.session_state.api_key_set:
+        st.warning("このアプリはStreamlit Cloudでの実行を推奨します。")
+        st.info("以下の入力欄にAPIキーを直接入力")
+        
+        # 直接入力オプション
+        api_key_input = st.text_input("Google API Keyを直接入力：", type="password")
+        if api_key_input:
+            api_key = st.session_state.api_key = api_key_input
+            st.session_state.api_key_set = True
+    return api_key
+
+# クイズの画面を表示する前の準備（SDKの読み込みと設定、利用可能なモデルの確認）
+# 学習ログの画面では呼び出さないため、SDKの読み込みとモデル一覧の取得は最初にクイズを開いたときに行われる
+# Gemini APIを使えない場合は問題パックからの出題に切り替える（戻り値はGemini APIを使えるか）
+def prepare_generation():
+    api_key = get_api_key()
+    if not api_key:
+        return start_offline_mode()
+    with get_metrics().span("gemini.configure"):
+        load_genai().configure(api_key=api_key)
+    
+    # 利用可能なモデルの確認（プロセス内で一度だけ行い、以降はキャッシュを使う）
+    try:
+        get_model_registry().model()
+    except LookupError as e:
+        return start_offline_mode(str(e))
+    except Exception as e:
+        return start_offline_mode(f"モデルリストの取得中にエラーが発生しました: {str(e)}")
+    
+    st.session_state.offline_mode = False
+    if st.session_state.get('debug_mode', False):
+        st.sidebar.text(f"使用モデル: {get_model_registry().model_name}")
+    return True
+
+# オフラインでの出題（問題パックがなければ、これまでどおりクイズの画面を表示しない）
+def start_offline_mode(message=None):
+    pack = get_question_pack()
+    if not pack:
+        if message:
+            st.error(message)
+        st.stop()
+    if message:
+        st.warning(message)
+    st.info(f"問題パック（{pack.total}問）からオフラインで出題しています。AIによる問題の生成と再採点は行いません。")
+    st.session_state.offline_mode = True
+    return False
+
+# 問題パックから1問取り出す（直近に出題した問題とほぼ同じ問題は選び直す。パックがなければNone）
+# パックの問題は問題バンクに保存しない（出題のたびに書き込まないため。出題の履歴は直近の出題の索引に残る）
+def pick_from_pack(quiz_type, genre):
+    pack = get_question_pack()
+    if not pack:
+        return None
+    quiz = None
+    for _ in range(PACK_SAMPLE_ATTEMPTS):
+        quiz = pack.sample(quiz_type, genre)
+        if not quiz or not find_recent_duplicate(quiz):
+            break
+    if quiz:
+        get_metrics().increment("pack.served")
+    return quiz
+
+# 受信途中の問題を表示（正解や模範解答は回答前に見えないよう表示しない）
+def render_partial_quiz(quiz_type, quiz_text, question_placeholder, body_placeholder):
+    # 最後の行は受信途中の可能性があるため、改行まで届いた行だけを完成後の問題と同じ解析で読む
+    fields = scan_quiz_text(quiz_text[:quiz_text.rfind('\n') + 1])
+    question = fields["question"]
+    if not question:
+        return
+    question_placeholder.write(question)
+    if quiz_type == "multiple_choice":
+        options = [f"選択肢{number}：{option}" for number, option in sorted(fields["options"].items())]
+        body_placeholder.text("\n".join(options) if options else "選択肢を生成しています...")
+    else:
+        body_placeholder.text("回答欄を準備しています...")
+
+# 問題文をストリーミングで受け取りながら、問題文が届いた時点で画面に表示する
+def stream_quiz_with_preview(quiz_type, genre):
+    question_placeholder = st.empty()
+    body_placeholder = st.empty()
+    body_placeholder.text("問題を生成しています...")
+    quiz_text = ""
+    try:
+        with get_metrics().span("gemini.stream"):
+            for chunk in stream_quiz_text(quiz_type, genre):
+                quiz_text += chunk
+                render_partial_quiz(quiz_type, quiz_text, question_placeholder, body_placeholder)
+    except Exception:
+        # 受信の途中で途切れた場合は、ストリーミングせずに生成し直す
+        # （何も受信していない場合は再試行を済ませているため、そのまま失敗とする）
+        if not quiz_text:
+            raise
+        get_metrics().increment("gemini.stream_fallbacks")
+        body_placeholder.text("問題を生成し直しています...")
+        quiz_text = request_quiz_text(quiz_type, genre)
+    finally:
+        # 完成した問題は各モードの画面で改めて表示する
+        question_placeholder.empty()
+        body_placeholder.empty()
+    return quiz_text
+
+# 問題文を生成（再試行は GenerationGuard が行う。失敗した場合は例外を送出する）
+def generate_quiz_with_retry(quiz_type="multiple_choice", genre=None, stream=False):
+    selected_genre = genre or select_genre()
+    if stream:
+        quiz_text = stream_quiz_with_preview(quiz_type, selected_genre)
+    else:
+        quiz_text = request_quiz_text(quiz_type, selected_genre)
+    
+    if not quiz_text:
+        raise ValueError("問題の生成に失敗しました。")
+        
+    if st.session_state.get('debug_mode', False):
+        st.write("生成された内容:", quiz_text)
+    
+    return quiz_text, selected_genre
+
+# 指定したジャンルの問題をまとめて生成（画面から呼び出す用。オフラインの場合は問題パックから選ぶ）
+def generate_quiz_batch(quiz_type, genres):
+    if st.session_state.get('offline_mode'):
+        quizzes = {}
+        for genre in genres:
+            quiz = pick_from_pack(quiz_type, genre)
+            if quiz:
+                quizzes[quiz["question"]] = quiz
+        return list(quizzes.values())
+    
+    genre_counts = {}
+    for genre in genres:
+        genre_counts[genre] = genre_counts.get(genre, 0) + 1
+    
+    quizzes = []
+    for batch in split_batches(quiz_type, genre_counts):
+        try:
+            quizzes.extend(request_quiz_batch(quiz_type, batch))
+        except Exception as e:
+            st.error(f"問題のまとめて生成中にエラーが発生しました: {str(e)}")
+    # 直近に出題した問題とほぼ同じ問題は練習セットに入れない
+    quizzes = [quiz for quiz in quizzes if not find_recent_duplicate(quiz)]
+    random.shuffle(quizzes)
+    return quizzes
+
+# 生成できないときの代替問題
+# （同じジャンルの未出題 → 全ジャンルの未出題 → 問題パック → 回答済みも含む の順に探す）
+def fallback_question(quiz_type, genre, seen):
+    return (
+        pick_from_question_bank(quiz_type, genre, exclude_ids=seen)
+        or pick_from_question_bank(quiz_type, None, exclude_ids=seen)
+        or pick_from_pack(quiz_type, genre)
+        or pick_from_question_bank(quiz_type, None, include_answered=True)
+    )
+
+# 形式の崩れた応答を、問題を作り直さずに形式だけ修正して解析し直す（修正できなければ None）
+def repair_quiz(quiz_type, quiz_text, error):
+    metrics = get_metrics()
+    try:
+        with st.spinner("問題の形式を修正しています..."):
+            quiz = request_quiz_repair(quiz_type, quiz_text, error)
+    except Exception as e:
+        metrics.increment("parse.repair_failures")
+        if st.session_state.get('debug_mode', False):
+            st.write(f"形式の修正に失敗しました: {str(e)}")
+        return None
+    if st.session_state.get('debug_mode', False):
+        st.write(f"形式を修正して出題しました（{str(error)}）")
+    return quiz
+
+# その場で問題を生成して解析し、問題バンクに保存する（生成できない場合は保存済みの問題で代替し、それもなければNone）
+def generate_question(quiz_type, genre, seen):
+    try:
+        quiz_text, genre = generate_quiz_with_retry(quiz_type=quiz_type, genre=genre, stream=STREAMING)
+    except Exception as e:
+        # APIの障害中は保存済みの問題で代替する
+        if is_retryable_error(e):
+            quiz = fallback_question(quiz_type, genre, seen)
+            if quiz:
+                if quiz.get("id"):
+                    seen.add(quiz["id"])
+                st.warning("AIの応答が不安定なため、保存済みの問題から出題しています。")
+                return quiz
+        st.error(f"問題生成中にエラーが発生しました: {str(e)}")
+        return None
+    metrics = get_metrics()
+    try:
+        with metrics.span(f"parse.{quiz_type}"):
+            quiz = read_quiz(quiz_type, quiz_text)
+    except QuizFormatError as e:
+        metrics.increment("parse.failures")
+        quiz = repair_quiz(quiz_type, quiz_text, e) if PARSE_REPAIR else None
+        if not quiz:
+            st.error(f"問題の形式が正しくありません（{str(e)}）。もう一度生成してください。")
+            return None
+    quiz["type"] = quiz_type
+    quiz["genre"] = genre
+    quiz["id"] = save_to_question_bank(quiz)
+    if quiz["id"]:
+        seen.add(quiz["id"])
+    return quiz
+
+# 直近に出題した問題とほぼ同じでない、先読み済みまたは保存済みの問題（なければNone）
+def novel_replacement(quiz_type, genre, seen):
+    quiz = get_prefetch_pool().take(quiz_type, genre)
+    if quiz and not find_recent_duplicate(quiz):
+        return quiz
+    quiz = pick_from_question_bank(quiz_type, genre, exclude_ids=seen)
+    if quiz and not find_recent_duplicate(quiz):
+        return quiz
+    return None
+
+# 次の問題を選ぶ
+# 一定の割合で問題バンクの未出題問題を再利用し、それ以外は先読み済みの問題、なければその場で生成する
+# オフラインの場合は、先読み・生成の代わりに問題パックから出題する
+# 先読み・生成した問題が直近に出題した問題とほぼ同じ場合は、別の問題に差し替える
+def choose_question(quiz_type):
+    if 'seen_question_ids' not in st.session_state:
+        st.session_state.seen_question_ids = set()
+    seen = st.session_state.seen_question_ids
+    
+    # まとめて生成した練習セットがあればそこから順に出題
+    practice_set = st.session_state.get('practice_sets', {}).get(quiz_type)
+    if practice_set:
+        quiz = practice_set.pop(0)
+        if quiz.get("id"):
+            seen.add(quiz["id"])
+        return quiz
+    
+    # 復習の期限が来た問題があれば優先して出題（復習は同じ問題を出題するため、重複の確認はしない）
+    quiz = pick_due_review(quiz_type)
+    if quiz:
+        seen.add(quiz["id"])
+        if st.session_state.get('debug_mode', False):
+            st.write("復習の問題を出題しました")
+        return quiz
+    
+    genre = select_genre()
+    if random.random() < QUESTION_BANK_RATIO:
+        quiz = pick_from_question_bank(quiz_type, genre, exclude_ids=seen)
+        if quiz:
+            seen.add(quiz["id"])
+            if st.session_state.get('debug_mode', False):
+                st.write("問題バンクから出題しました")
+            return quiz
+    
+    if st.session_state.get('offline_mode'):
+        quiz = pick_from_pack(quiz_type, genre) or fallback_question(quiz_type, genre, seen)
+        if quiz and quiz.get("id"):
+            seen.add(quiz["id"])
+        return quiz
+    
+    quiz = get_prefetch_pool().take(quiz_type, genre)
+    if quiz and not find_recent_duplicate(quiz):
+        if quiz.get("id"):
+            seen.add(quiz["id"])
+        if st.session_state.get('debug_mode', False):
+            st.write("先読み済みの問題を使用しました")
+        return quiz
+
+    quiz = generate_question(quiz_type, genre, seen)
+    match = quiz and find_recent_duplicate(quiz)
+    if match:
+        # 先読み済み・保存済みの問題に差し替え、なければ1回だけ作り直す（作り直した問題はそのまま出題する）
+        replacement = novel_replacement(quiz_type, genre, seen) or generate_question(quiz_type, genre, seen)
+        if st.session_state.get('debug_mode', False):
+            st.write(f"直近に出題した問題とほぼ同じ問題（類似度 {match[0]:.2f}）が生成されました: {match[1]}")
+        if replacement:
+            quiz = replacement
+            if quiz.get("id"):
+                seen.add(quiz["id"])
+    return quiz
+
+# 次の問題を取得し、直近の出題の履歴に加える
+def next_question(quiz_type):
+    quiz = choose_question(quiz_type)
+    if quiz:
+        remember_question(quiz)
+    return quiz
+
+# 練習セット（複数問をまとめて生成してセッションに保持）の操作パネル
+def show_practice_set_controls(quiz_type):
+    if 'practice_sets' not in st.session_state:
+        st.session_state.practice_sets = {}
+    practice_set = st.session_state.practice_sets.setdefault(quiz_type, [])
+    
+    st.sidebar.subheader("練習セット")
+    set_size = st.sidebar.selectbox("問題数", [10, 20], key=f"{quiz_type}_set_size")
+    if st.sidebar.button("まとめて生成", key=f"{quiz_type}_batch_generate"):
+        with st.spinner(f"{set_size}問をまとめて生成しています..."):
+            quizzes = generate_quiz_batch(quiz_type, [select_genre() for _ in range(set_size)])
+        practice_set.extend(quizzes)
+        if quizzes:
+            st.sidebar.success(f"{len(quizzes)}問を用意しました。")
+    if practice_set:
+        st.sidebar.text(f"練習セットの残り: {len(practice_set)}問")
+
+# 先読みの統計（デバッグモード用）
+def show_prefetch_stats():
+    stats = get_prefetch_pool().stats()
+    st.sidebar.subheader("先読みの統計")
+    st.sidebar.text(f"ヒット率: {stats['hit_rate']}% ({stats['hits']}/{stats['hits'] + stats['misses']})")
+    st.sidebar.text(f"待機中の問題: {stats['buffered']}")
+    st.sidebar.text(f"生成: {stats['generated']} / 期限切れ: {stats['evicted']} / 失敗: {stats['failures']}")
+    guard_stats = get_generation_guard().stats()
+    st.sidebar.text(
+        f"API呼び出し: {guard_stats['calls']} / 再試行: {guard_stats['retries']} / "
+        f"失敗: {guard_stats['failures']} / 遮断: {guard_stats['rejected']} ({guard_stats['state']})"
+    )
+    executor_stats = get_generation_executor().stats()
+    st.sidebar.text(
+        f"生成キュー: 待機 {executor_stats['queued']} / 共有 {executor_stats['coalesced']} / "
+        f"レート制限待ち {executor_stats['rate_limited_seconds']}秒"
+    )
+    if WRITE_BEHIND:
+        writer_stats = get_answer_writer().stats()
+        st.sidebar.text(
+            f"回答の書き込み: {writer_stats['written']}件 / {writer_stats['commits']}回 "
+            f"(待機中: {writer_stats['pending']}, 失敗: {writer_stats['failures']}, 退避: {writer_stats['dead_letters']})"
+        )
+    pack = get_question_pack()
+    if pack:
+        st.sidebar.text(f"問題パック: {pack.total}問 (作成: {pack.created_at})")
+    novelty_stats = get_novelty_index().stats()
+    st.sidebar.text(
+        f"重複の検出: 照合 {novelty_stats['checks']}問 / 重複 {novelty_stats['duplicates']}問 "
+        f"(履歴: {novelty_stats['history']}問)"
+    )
+    scheduler_stats = get_review_scheduler().stats()
+    st.sidebar.text(
+        f"復習: 期限切れ {scheduler_stats['due_items']}問 / 予定 {scheduler_stats['scheduled_items']}問 "
+        f"(次のジャンル: {scheduler_stats['next_genre']})"
+    )
+    if WRITTEN_BORDERLINE_MARGIN > 0:
+        reviewer_stats = get_answer_reviewer().stats()
+        st.sidebar.text(
+            f"AIによる再採点: {reviewer_stats['reviewed']}件 / 判定変更 {reviewer_stats['changed']}件 "
+            f"(待機中: {reviewer_stats['pending']}, 失敗: {reviewer_stats['failures']})"
+        )
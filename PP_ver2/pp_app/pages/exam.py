@@ -0,0 +1,174 @@
+# 模擬試験の画面（複数ジャンルの4択問題をまとめて用意し、制限時間内に解いて一度に提出する）
+import time
+
+import streamlit as st
+
+from pp_app.answers import record_answers_at_once
+from pp_app.config import EXAM_COUNTDOWN_INTERVAL, EXAM_POLL_INTERVAL, EXAM_SECONDS_PER_QUESTION, EXAM_SIZES
+from pp_app.db import current_user_id, get_database
+from pp_app.exam import MockExam, get_exam_executor, get_exam_workers
+from pp_app.generation import current_session_id, get_model_registry
+from pp_app.metrics import get_metrics
+from pp_app.novelty import get_novelty_index, remember_question
+from pp_app.pages.common import fallback_question, pick_from_pack, prepare_generation
+from pp_app.scheduler import sample_genres
+
+def choice_key(exam, index):
+    return f"exam_{exam.exam_id}_{index}"
+
+# 選択肢を選んだときに、その時刻で記録する（制限時間を過ぎてからの変更は採点に使わない）
+def record_choice(exam, index):
+    exam.choose(index, st.session_state.get(choice_key(exam, index)))
+
+# 試験を始める（出題するジャンルは、未回答・間違えたジャンル・試験中に復習の期限が来るジャンルを多めに選ぶ）
+# オフラインの場合は問題パックからすぐに用意する
+def start_exam(size, online):
+    time_limit = size * EXAM_SECONDS_PER_QUESTION or None
+    genres = sample_genres(size, horizon=time_limit or 0.0)
+    exam = MockExam(size, time_limit=time_limit, metrics=get_metrics())
+    if online:
+        exam.generate(
+            genres,
+            get_model_registry().model(),
+            get_database(),
+            get_exam_executor(),
+            get_exam_workers(),
+            novelty_index=get_novelty_index(),
+            session_id=current_session_id(),
+        )
+    else:
+        exam.add([quiz for quiz in (pick_from_pack("multiple_choice", genre) for genre in genres) if quiz])
+    st.session_state.mock_exam = exam
+
+# 生成できなかった分を、保存済みの問題（なければ問題パック）で補う
+def fill_missing_questions(exam):
+    seen = {quiz["id"] for quiz in exam.questions() if quiz.get("id")}
+    quizzes = []
+    for genre in sample_genres(exam.size - len(exam.questions())):
+        quiz = fallback_question("multiple_choice", genre, seen)
+        if quiz:
+            if quiz.get("id"):
+                seen.add(quiz["id"])
+            quizzes.append(quiz)
+    exam.add(quizzes)
+
+# 回答をまとめて採点し、1つのトランザクションで学習ログとジャンル別の統計に記録する（記録できたかを返す）
+def submit_exam(exam):
+    questions = exam.questions()
+    answers = exam.grade(exam.choices(), current_user_id())
+    with get_metrics().span("exam.submit"):
+        if not record_answers_at_once(answers):
+            return False
+    for quiz in questions:
+        remember_question(quiz)
+    exam.submitted_at = time.time()
+    exam.results = answers
+    return True
+
+def format_seconds(seconds):
+    seconds = max(0, int(seconds))
+    return f"{seconds // 60}分{seconds % 60:02d}秒"
+
+def show_exam_start(online):
+    st.subheader("模擬試験")
+    st.write("複数のジャンルから出題される4択問題を、制限時間内にまとめて解いて提出します。最初の問題が届いたらすぐに解き始められます。")
+    size = st.selectbox("問題数", EXAM_SIZES, key="exam_size")
+    if EXAM_SECONDS_PER_QUESTION > 0:
+        st.caption(f"制限時間: {format_seconds(size * EXAM_SECONDS_PER_QUESTION)}")
+    if st.button("模擬試験を開始", key="exam_start"):
+        start_exam(size, online)
+        st.rerun()
+
+def show_exam(exam):
+    generating = exam.generating
+    if not generating and not exam.topped_up and len(exam.questions()) < exam.size:
+        fill_missing_questions(exam)
+        exam.topped_up = True
+    questions = exam.questions()
+
+    remaining = exam.remaining()
+    # 制限時間を過ぎていれば、ここまでの回答で提出する
+    if remaining is not None and remaining <= 0 and not generating and submit_exam(exam):
+        st.rerun()
+
+    st.subheader(f"模擬試験（{exam.size}問）")
+    if generating:
+        st.progress(len(questions) / exam.size, text=f"問題を用意しています... {len(questions)}/{exam.size}問")
+    elif len(questions) < exam.size:
+        st.warning(f"{exam.size}問のうち{len(questions)}問だけ用意できました。")
+    if remaining is not None:
+        st.caption(f"残り時間: {format_seconds(remaining)}")
+
+    for i, quiz in enumerate(questions):
+        st.markdown(f"**問{i + 1}**（{quiz['genre']}）")
+        st.write(quiz["question"])
+        st.radio(
+            "答えを選んでください：", quiz["options"], index=None, key=choice_key(exam, i),
+            on_change=record_choice, args=(exam, i),
+        )
+
+    if not questions and not generating:
+        st.error("問題を用意できませんでした。しばらくしてからもう一度お試しください。")
+    st.text(f"回答済み: {len(exam.choices())}/{len(questions)}問")
+    if st.button("提出して採点する", key="exam_submit", disabled=generating or not questions) and submit_exam(exam):
+        st.rerun()
+    if st.button("試験をやめる", key="exam_cancel"):
+        del st.session_state.mock_exam
+        st.rerun()
+
+    # 問題を用意している間は、届いた問題を表示するために画面を更新し続ける
+    if generating:
+        time.sleep(EXAM_POLL_INTERVAL)
+        st.rerun()
+    # 制限時間がある場合は、短い間隔で再実行して残り時間の表示を更新する（時間切れになった再実行で提出する）
+    elif remaining is not None and remaining > 0 and questions:
+        time.sleep(min(EXAM_COUNTDOWN_INTERVAL, remaining))
+        st.rerun()
+
+def show_exam_results(exam):
+    answers = exam.results
+    correct = sum(1 for answer in answers if answer[3])
+    st.subheader("模擬試験の結果")
+    st.success(
+        f"{correct}/{len(answers)}問正解（正答率 {round(correct / len(answers) * 100, 1)}%）"
+        f"　所要時間: {format_seconds(exam.submitted_at - exam.started_at)}"
+    )
+
+    # ジャンル別の結果
+    genres = {}
+    for answer in answers:
+        total = genres.setdefault(answer[4], [0, 0])
+        total[0] += 1
+        total[1] += 1 if answer[3] else 0
+    rows = ["| ジャンル | 問題数 | 正解 | 正答率 |", "|---|---:|---:|---:|"]
+    for genre, (total, genre_correct) in genres.items():
+        rows.append(f"| {genre} | {total} | {genre_correct} | {round(genre_correct / total * 100, 1)}% |")
+    st.markdown("\n".join(rows))
+
+    if exam.time_limit and exam.submitted_at - exam.started_at >= exam.time_limit:
+        st.info("制限時間を過ぎたため、それまでの回答で採点しました。")
+
+    wrong = [answer for answer in answers if not answer[3]]
+    if wrong:
+        with st.expander(f"間違えた問題（{len(wrong)}問）"):
+            for question, user_answer, correct_answer, _, genre, *_ in wrong:
+                st.write(f"**{genre}**　{question}")
+                st.write(f"あなたの回答: {user_answer}　／　正解: {correct_answer}")
+
+    if st.button("新しい模擬試験", key="exam_new"):
+        del st.session_state.mock_exam
+        st.rerun()
+
+def exam_mode():
+    online = prepare_generation()
+    try:
+        exam = st.session_state.get('mock_exam')
+        if exam is None:
+            show_exam_start(online)
+        elif exam.results is None:
+            show_exam(exam)
+        else:
+            show_exam_results(exam)
+    except Exception as e:
+        st.error(f"予期せぬエラーが発生しました: {str(e)}")
+        st.info("アプリケーションを再読み込みしてください。")
@@ -0,0 +1,284 @@
+# 学習ログの画面（Gemini APIを使わないため、生成層は読み込まない）
+import csv
+import sqlite3
+import tempfile
+
+import streamlit as st
+
+from pp_app.answers import flush_pending_answers
+from pp_app.config import GENRES, MAINTENANCE_INTERVAL
+from pp_app.db import (
+    SQL_BUMP_STATS_VERSION, SQL_UPDATE_GENRE_STATS, current_user_id, fetch_daily_summaries, fetch_learning_log_page,
+    get_database_router, get_genre_stats_cache, get_user_database, search_learning_log, stats_version_name,
+)
+from pp_app.maintenance import APP_CONVERT_MAX_BYTES, get_maintenance_job, run_maintenance
+from pp_app.novelty import get_novelty_index
+from pp_app.scheduler import get_review_scheduler
+from pp_app.transfer import EXPORT_FORMATS, export_learning_log, format_for_path, import_learning_log, read_learning_log
+
+def delete_all_learning_logs():
+    try:
+        flush_pending_answers()
+        user_id = current_user_id()
+        with get_user_database().transaction() as conn:
+            # 現在の学習者の学習ログの削除
+            conn.execute("DELETE FROM learning_log WHERE user_id = ?", (user_id,))
+            # ジャンル統計と、保守用の集計・日別の集計のリセット
+            conn.execute("DELETE FROM genre_stats WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM genre_stats_baseline WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM learning_log_daily WHERE user_id = ?", (user_id,))
+            conn.execute(SQL_BUMP_STATS_VERSION, (stats_version_name(user_id),))
+            # 復習スケジュールのリセット
+            conn.execute("DELETE FROM review_genres WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM review_items WHERE user_id = ?", (user_id,))
+            # 直近の出題の履歴（ほぼ同じ問題の検出用）のリセット
+            conn.execute("DELETE FROM question_signatures WHERE user_id = ?", (user_id,))
+        get_genre_stats_cache().invalidate()
+        get_review_scheduler().invalidate()
+        get_novelty_index().invalidate()
+        return True
+    except sqlite3.Error as e:
+        st.error(f"学習履歴の削除中にエラーが発生しました: {str(e)}")
+        return False
+
+def delete_specific_log(log_id):
+    try:
+        flush_pending_answers()
+        user_id = current_user_id()
+        with get_user_database().transaction() as conn:
+            # 特定の学習ログを削除（他の学習者の記録は削除しない）
+            row = conn.execute(
+                "SELECT genre, is_correct FROM learning_log WHERE id = ? AND user_id = ?", (log_id, user_id)
+            ).fetchone()
+            if row:
+                conn.execute("DELETE FROM learning_log WHERE id = ?", (log_id,))
+                # 削除した回答の分をジャンル統計から差し引く
+                genre, is_correct = row
+                conn.execute(SQL_UPDATE_GENRE_STATS, (user_id, genre, -1, -1 if is_correct else 0))
+                conn.execute(SQL_BUMP_STATS_VERSION, (stats_version_name(user_id),))
+        get_genre_stats_cache().invalidate()
+        return True
+    except sqlite3.Error as e:
+        st.error(f"学習履歴の削除中にエラーが発生しました: {str(e)}")
+        return False
+
+# 現在の学習者の学習履歴を書き出し、(学習者ID, ファイル名, 内容, 件数) を返す
+# 書き出しは一時ファイルに少しずつ行う（ダウンロードボタンには内容を渡す必要があるため、最後にまとめて読む。
+# 件数が多い場合はコマンドライン（python -m pp_app.transfer export）を使う）
+def export_current_learning_log(fmt):
+    try:
+        flush_pending_answers()
+        user_id = current_user_id()
+        with tempfile.TemporaryFile() as out:
+            count = export_learning_log(get_database_router(), out, fmt, user_id=user_id)
+            out.seek(0)
+            return user_id, f"learning_log_{user_id}{EXPORT_FORMATS[fmt]}", out.read(), count
+    except (OSError, sqlite3.Error) as e:
+        st.error(f"学習履歴のエクスポート中にエラーが発生しました: {str(e)}")
+    except ImportError as e:
+        st.error(f"parquet 形式には pyarrow が必要です: {str(e)}")
+    return None
+
+# アップロードされたファイルの学習履歴を、現在の学習者の履歴として取り込む
+def import_uploaded_learning_log(uploaded):
+    try:
+        flush_pending_answers()
+        records = read_learning_log(uploaded, format_for_path(uploaded.name))
+        summary = import_learning_log(get_database_router(), records, user_id=current_user_id())
+        get_genre_stats_cache().invalidate()
+        return summary
+    except (ValueError, csv.Error, sqlite3.Error) as e:
+        st.error(f"学習履歴のインポート中にエラーが発生しました: {str(e)}")
+    except ImportError as e:
+        st.error(f"parquet 形式には pyarrow が必要です: {str(e)}")
+    return None
+
+def show_transfer_panel():
+    with st.expander("学習履歴のエクスポート・インポート"):
+        col1, col2 = st.columns(2)
+        with col1:
+            fmt = st.selectbox("形式", list(EXPORT_FORMATS), key="export_format")
+            if st.button("エクスポートを作成", key="export_create"):
+                st.session_state.export_file = export_current_learning_log(fmt)
+            # 学習者を切り替えた後は、前の学習者の履歴をダウンロードできないようにする
+            export_file = st.session_state.get('export_file')
+            if export_file and export_file[0] == current_user_id():
+                _, file_name, data, count = export_file
+                st.download_button(f"ダウンロード（{count}件）", data, file_name=file_name, key="export_download")
+        with col2:
+            uploaded = st.file_uploader(
+                "インポートするファイル", type=["csv", "jsonl", "ndjson", "parquet"], key="import_file"
+            )
+            if uploaded and st.button("インポート", key="import_run"):
+                summary = import_uploaded_learning_log(uploaded)
+                if summary:
+                    st.success(
+                        f"{summary['imported']}件の学習履歴を取り込みました"
+                        f"（取り込み済み {summary['duplicates']}件 / 不正な行 {summary['invalid']}件）"
+                    )
+
+# 保存期間を過ぎて日別にまとめた学習履歴（まとめた履歴がある場合だけ表示）
+def show_daily_summaries():
+    summaries = fetch_daily_summaries(100)
+    if not summaries:
+        return
+    with st.expander("過去の学習履歴（日別の集計）"):
+        st.caption("保存期間を過ぎた学習履歴は、日ごと・ジャンルごとの集計として保存されています。")
+        lines = ["| 日付 | ジャンル | 回答数 | 正答率 | 平均得点 |", "|---|---|---:|---:|---:|"]
+        for day, genre, total, correct, score in summaries:
+            rate = f"{correct / total * 100:.1f}%" if total else "-"
+            lines.append(f"| {day} | {genre} | {total} | {rate} | {'-' if score is None else f'{score:.0f}点'} |")
+        st.markdown("\n".join(lines))
+
+# データベースの保守の状況と手動実行（デバッグモード用）
+def show_maintenance_controls():
+    st.sidebar.subheader("データベースの保守")
+    if MAINTENANCE_INTERVAL > 0:
+        stats = get_maintenance_job().stats()
+        st.sidebar.text(f"実行: {stats['runs']}回 / 失敗: {stats['failures']}回")
+        st.sidebar.text(
+            f"統計の修正: {stats['stats_fixed']}人 / 集計: {stats['rows_compacted']}件 / 解放: {stats['pages_vacuumed']}ページ"
+        )
+    if st.sidebar.button("今すぐ実行", key="maintenance_run"):
+        try:
+            flush_pending_answers()
+            if MAINTENANCE_INTERVAL > 0:
+                result = get_maintenance_job().run_once()
+            else:
+                result = run_maintenance(get_database_router(), convert_max_bytes=APP_CONVERT_MAX_BYTES)
+            get_genre_stats_cache().invalidate()
+            st.sidebar.success(
+                f"統計を直した学習者: {len(result['stats_fixed'])}人 / "
+                f"集計にまとめた学習ログ: {result['rows_compacted']}件 / 解放したページ: {result['pages_vacuumed']}"
+            )
+        except sqlite3.Error as e:
+            st.sidebar.error(f"保守の実行中にエラーが発生しました: {str(e)}")
+
+# 学習ログ1件の表示（検索結果では、一致した箇所を太字にした問題文を highlighted に渡す）
+def show_log_entry(log, highlighted=None):
+    with st.expander(f"{log[6]} - {log[2][:50]}..."):
+        st.write(f"回答日時: {log[1]}")
+        st.write(f"ジャンル: {log[6]}")
+        if highlighted:
+            st.markdown(f"問題: {highlighted}")
+        else:
+            st.write(f"問題: {log[2]}")
+        st.write(f"あなたの回答: {log[3]}")
+        st.write(f"正解: {log[4]}")
+        st.write("結果: " + ("正解" if log[5] else "不正解"))
+        if log[7] is not None:
+            st.write(f"得点: {log[7]:.0f}点")
+        
+        # 個別の削除ボタンを追加
+        if st.button("この記録を削除", key=f"delete_{log[0]}"):
+            if delete_specific_log(log[0]):
+                st.success("記録を削除しました。")
+                st.rerun()
+            else:
+                st.error("記録の削除に失敗しました。")
+
+# キーワード検索の結果（関連度の高い順。並べ方が新しい順ではないため、ページ番号でページを送る）
+def show_search_results(query, page_size, genre, is_correct, date_from, date_to):
+    if any(len(term) < 3 for term in query.split()):
+        st.caption("2文字以下の語は索引を使わずに探すため、学習履歴が多いと時間がかかります。")
+    page = st.session_state.log_search_page
+    logs, has_next = search_learning_log(
+        query, page_size, page, genre=genre, is_correct=is_correct, date_from=date_from, date_to=date_to
+    )
+    if not logs:
+        st.info("キーワードに一致する学習履歴はありません。")
+        return
+    for log in logs:
+        show_log_entry(log, highlighted=log[8])
+    
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        if st.button("前のページ", disabled=page == 0, key="search_prev"):
+            st.session_state.log_search_page -= 1
+            st.rerun()
+    with page_col:
+        st.caption(f"{page + 1}ページ目（関連度順）")
+    with next_col:
+        if st.button("次のページ", disabled=not has_next, key="search_next"):
+            st.session_state.log_search_page += 1
+            st.rerun()
+
+def show_learning_log():
+    st.subheader("学習履歴")
+    show_transfer_panel()
+    if st.session_state.get('debug_mode', False):
+        show_maintenance_controls()
+    
+    try:
+        # 削除ボタンを追加
+        if st.button("すべての学習履歴を削除"):
+            if delete_all_learning_logs():
+                st.success("すべての学習履歴を削除しました。")
+                st.rerun()
+            else:
+                st.error("学習履歴の削除に失敗しました。")
+        
+        # 絞り込み条件
+        query = st.text_input(
+            "キーワードで検索", key="log_query", placeholder="問題文・回答・正解に含まれる語（空白で区切るとすべてを含むもの）"
+        ).strip()
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            genre_filter = st.selectbox("ジャンル", ["すべて"] + GENRES, key="log_genre")
+        with col2:
+            result_filter = st.selectbox("結果", ["すべて", "正解", "不正解"], key="log_result")
+        with col3:
+            page_size = st.selectbox("表示件数", [20, 50, 100], key="log_page_size")
+        date_range = st.date_input("期間", value=[], key="log_dates")
+        date_from = date_range[0] if len(date_range) > 0 else None
+        date_to = date_range[1] if len(date_range) > 1 else date_from
+        
+        # 条件が変わったら最初のページに戻る
+        filters = (genre_filter, result_filter, page_size, date_from, date_to, current_user_id(), query)
+        if st.session_state.get('log_filters') != filters:
+            st.session_state.log_filters = filters
+            st.session_state.log_cursors = []  # 表示中のページより前の各ページの開始位置
+            st.session_state.log_cursor = None
+            st.session_state.log_search_page = 0
+        genre = None if genre_filter == "すべて" else genre_filter
+        is_correct = None if result_filter == "すべて" else result_filter == "正解"
+        
+        if query:
+            show_search_results(query, page_size, genre, is_correct, date_from, date_to)
+            return
+        show_daily_summaries()
+        logs, has_next = fetch_learning_log_page(
+            page_size,
+            cursor=st.session_state.log_cursor,
+            genre=genre,
+            is_correct=is_correct,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        
+        if not logs:
+            if filters[:2] != ("すべて", "すべて") or date_from:
+                st.info("条件に一致する学習履歴はありません。")
+            else:
+                st.info("学習履歴はまだありません。")
+            return
+            
+        for log in logs:
+            show_log_entry(log)
+        
+        # ページ送り
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            if st.button("前のページ", disabled=not st.session_state.log_cursors):
+                st.session_state.log_cursor = st.session_state.log_cursors.pop()
+                st.rerun()
+        with page_col:
+            st.caption(f"{len(st.session_state.log_cursors) + 1}ページ目")
+        with next_col:
+            if st.button("次のページ", disabled=not has_next):
+                st.session_state.log_cursors.append(st.session_state.log_cursor)
+                st.session_state.log_cursor = (logs[-1][1], logs[-1][0])
+                st.rerun()
+                
+    except sqlite3.Error as e:
+        st.error(f"学習履歴の取得中にエラーが発生しました: {str(e)}")
@@ -0,0 +1,83 @@
+# 4択クイズの画面
+import streamlit as st
+
+from pp_app.answers import record_answer
+from pp_app.config import GENRES
+from pp_app.db import get_genre_stats
+from pp_app.generation import get_prefetch_pool
+from pp_app.pages.common import next_question, prepare_generation, show_practice_set_controls, show_prefetch_stats
+
+# 4択クイズ用の回答保存関数
+def save_quiz_answer(question, user_answer, correct_answer, is_correct, genre):
+    record_answer(question, user_answer, correct_answer, is_correct, genre, quiz_type="multiple_choice")
+
+def quiz_mode():
+    online = prepare_generation()
+    try:
+        # 統計情報の表示
+        st.sidebar.subheader("ジャンル別正答率")
+        stats = get_genre_stats()
+        if stats:
+            for genre, total, correct, accuracy in stats:
+                if total > 0:
+                    st.sidebar.text(f"{genre}: {accuracy}% ({correct}/{total})")
+
+        # 各ジャンルの問題をバックグラウンドで先読み（オフラインの場合は問題パックから出題するため行わない）
+        if online:
+            get_prefetch_pool().warm("multiple_choice", GENRES)
+        show_practice_set_controls("multiple_choice")
+        if st.session_state.get('debug_mode', False):
+            show_prefetch_stats()
+
+        if st.button("新しい問題を生成", key="quiz_generate"):
+            st.session_state.has_answered = False
+            quiz = next_question("multiple_choice")
+            if quiz:
+                st.session_state.quiz_question = quiz["question"]
+                st.session_state.quiz_correct = quiz["correct"]
+                st.session_state.quiz_options = quiz["options"]
+                st.session_state.quiz_genre = quiz["genre"]
+
+        if hasattr(st.session_state, 'quiz_question'):
+            st.write(st.session_state.quiz_question)
+            
+            if st.session_state.has_answered:
+                st.radio(
+                    "答えを選んでください：",
+                    st.session_state.quiz_options,
+                    key="answered_radio",
+                    disabled=True,
+                )
+                if st.session_state.is_correct:
+                    st.success("正解です！")
+                else:
+                    st.error(f"不正解です。正解は: {st.session_state.quiz_options[st.session_state.quiz_correct-1]}")
+                
+                st.info("「新しい問題を生成」ボタンをクリックして次の問題に進んでください。")
+            else:
+                user_answer = st.radio("答えを選んでください：", st.session_state.quiz_options)
+                
+                if st.button("回答する"):
+                    selected_index = st.session_state.quiz_options.index(user_answer) + 1
+                    is_correct = selected_index == st.session_state.quiz_correct
+                    
+                    st.session_state.has_answered = True
+                    st.session_state.is_correct = is_correct
+                    
+                    save_quiz_answer(
+                        st.session_state.quiz_question,
+                        user_answer,
+                        st.session_state.quiz_options[st.session_state.quiz_correct-1],
+                        is_correct,
+                        st.session_state.quiz_genre
+                    )
+                    
+                    if is_correct:
+                        st.success("正解です！")
+                    else:
+                        st.error(f"不正解です。正解は: {st.session_state.quiz_options[st.session_state.quiz_correct-1]}")
+                    
+                    st.info("「新しい問題を生成」ボタンをクリックして次の問題に進んでください。")
+    except Exception as e:
+        st.error(f"予期せぬエラーが発生しました: {str(e)}")
+        st.info("アプリケーションを再読み込みしてください。")
@@ -0,0 +1,135 @@
+# 記述式クイズの画面
+import json
+
+import streamlit as st
+
+from pp_app.answers import record_answer
+from pp_app.config import GENRES
+from pp_app.db import current_user_id, get_genre_stats
+from pp_app.generation import get_prefetch_pool
+from pp_app.pages.common import next_question, prepare_generation, show_practice_set_controls, show_prefetch_stats
+from pp_app.scoring import get_answer_reviewer, score_written_answer
+
+# 記述式問題用の回答保存関数（result は score_written_answer() の戻り値）
+# 合格点付近の回答はAIの再採点を待ってから記録する
+def save_written_answer(question, user_answer, model_answer, result, genre):
+    score_detail = json.dumps({"sections": result["sections"]}, ensure_ascii=False)
+    if result["borderline"]:
+        get_answer_reviewer().submit((
+            question, user_answer, model_answer, result["is_correct"], genre,
+            result["score"], score_detail, "written_answer", current_user_id(),
+        ))
+        return
+    record_answer(
+        question, user_answer, model_answer, result["is_correct"], genre,
+        result["score"], score_detail, "written_answer"
+    )
+
+# 記述式の採点結果を表示
+def show_written_result(result, user_answer, model_answer):
+    if result["is_correct"]:
+        st.success(f"🎉 正解です！（{result['score']:.0f}点）")
+    else:
+        st.error(f"不正解です（{result['score']:.0f}点）。以下の模範解答を参考に、理解を深めましょう。")
+    if result["borderline"]:
+        st.info("合格点に近いため、AIが再採点します。結果は学習ログと正答率に反映されます。")
+
+    # 観点ごとの得点
+    for section, section_score in result["sections"].items():
+        st.progress(section_score / 100, text=f"{section}: {section_score:.0f}点")
+
+    # 回答と模範解答を横に並べて表示
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write("💭 あなたの回答:")
+        st.info(user_answer)
+    with col2:
+        st.write("📚 模範解答:")
+        # 模範解答を行ごとに分割して表示
+        answer_lines = model_answer.split('\n')
+        for line in answer_lines:
+            if line.strip():
+                st.write(line.strip())
+
+def written_quiz_mode():
+    online = prepare_generation()
+    try:
+        # 統計情報の表示
+        st.sidebar.subheader("ジャンル別正答率")
+        stats = get_genre_stats()
+        if stats:
+            for genre, total, correct, accuracy in stats:
+                if total > 0:
+                    st.sidebar.text(f"{genre}: {accuracy}% ({correct}/{total})")
+
+        # 各ジャンルの問題をバックグラウンドで先読み（オフラインの場合は問題パックから出題するため行わない）
+        if online:
+            get_prefetch_pool().warm("written_answer", GENRES)
+        show_practice_set_controls("written_answer")
+        if st.session_state.get('debug_mode', False):
+            show_prefetch_stats()
+
+        # 新しい問題生成ボタンを最初に配置
+        if st.button("新しい問題を生成", key="written_generate"):
+            st.session_state.has_answered = False
+            quiz = next_question("written_answer")
+            if quiz:
+                st.session_state.written_question = quiz["question"]
+                st.session_state.written_answer = quiz["answer"]
+                st.session_state.written_genre = quiz["genre"]
+                st.rerun()
+
+        # 問題文を表示するコンテナを作成
+        question_container = st.empty()
+        
+        # 回答エリアのコンテナを作成
+        answer_container = st.container()
+
+        # 問題文の表示
+        if hasattr(st.session_state, 'written_question'):
+            question_container.write(st.session_state.written_question)
+            
+            with answer_container:
+                if st.session_state.has_answered:
+                    st.text_area(
+                        "あなたの回答：",
+                        value=st.session_state.user_written_answer,
+                        disabled=True
+                    )
+                    show_written_result(
+                        st.session_state.get('written_result') or score_written_answer(
+                            st.session_state.user_written_answer, st.session_state.written_answer
+                        ),
+                        st.session_state.user_written_answer,
+                        st.session_state.written_answer
+                    )
+                else:
+                    user_answer = st.text_area("答えを入力してください：")
+                    
+                    if st.button("回答する"):
+                        st.session_state.has_answered = True
+                        st.session_state.user_written_answer = user_answer
+                        
+                        # 回答の評価（模範解答の観点ごとに採点）
+                        result = score_written_answer(user_answer, st.session_state.written_answer)
+                        # オフラインの場合はAIの再採点を行わず、この採点結果をそのまま記録する
+                        if not online:
+                            result["borderline"] = False
+                        st.session_state.written_result = result
+                        
+                        save_written_answer(
+                            st.session_state.written_question,
+                            user_answer,
+                            st.session_state.written_answer,
+                            result,  # 採点結果を保存
+                            st.session_state.written_genre
+                        )
+                        show_written_result(result, user_answer, st.session_state.written_answer)
+
+        # 次の問題へのガイダンス（回答済みの場合のみ表示）
+        if hasattr(st.session_state, 'has_answered') and st.session_state.has_answered:
+            st.info("「新しい問題を生成」ボタンをクリックして次の問題に進んでください。")
+
+    except Exception as e:
+        st.error(f"予期せぬエラーが発生しました: {str(e)}")
+        st.info("アプリケーションを再読み込みしてください。")
@@ -0,0 +1,229 @@
+# 解析層（Geminiの応答から問題を取り出す処理と、まとめて生成する問題のJSONスキーマ）
+import json
+import re
+import unicodedata
+
+# 1行ずつの読み取りで使う見出し（「質問：」「選択肢1：」などのラベル）
+# 全角・半角の数字やコロン、行頭の記号（「・」「**」など）の違いは読み取る前に正規化する
+LABEL_PATTERN = re.compile(
+    r"^[\s・\-*#>]*"
+    r"(?P<label>質問|問題文?|問|選択肢\s*[(\[]?\s*(?P<number>[0-9]|[A-DＡ-Ｄa-dア-エ])\s*[)\]]?|正解|答え|解答|ジャンル|模範解答)"
+    r"\s*[*]*\s*[:：]\s*(?P<value>.*)$"
+)
+# 「選択肢」を付けずに番号だけで書かれた選択肢（「1. 」「(2) 」「③ 」など）
+NUMBERED_OPTION_PATTERN = re.compile(r"^[\s・\-*]*[(（]?(?P<number>[1-4１-４①-④])(?:[)）.．、:：]|\s)\s*(?P<value>.+)$")
+OPTION_LETTERS = {"A": 1, "B": 2, "C": 3, "D": 4, "ア": 1, "イ": 2, "ウ": 3, "エ": 4}
+
+# 1行分のテキストの表記ゆれをそろえる（全角数字・丸数字・全角英字は半角に、コロンは全角にそろえる）
+def normalize_label(text):
+    if not unicodedata.is_normalized("NFKC", text):
+        text = unicodedata.normalize("NFKC", text)
+    return text.replace(":", "：")
+
+# 選択肢の番号（数字・英字・ア〜エ）を1〜4の整数にする
+def option_number(text):
+    text = normalize_label(text).strip().upper()
+    if text in OPTION_LETTERS:
+        return OPTION_LETTERS[text]
+    return int(text) if text.isdigit() else None
+
+# 正解の欄（「3」「３番」「選択肢3」「③」「C」「3. 選択肢の本文」など）を1〜4の整数にする
+def read_correct_answer(value, options):
+    text = normalize_label(value).strip()
+    match = re.match(r"^(?:選択肢)?\s*[(（]?([1-4])(?![0-9])", text)
+    if match:
+        return int(match.group(1))
+    match = re.match(r"^(?:選択肢)?\s*[(（]?([A-Da-dア-エ])(?![A-Za-z])", text)
+    if match:
+        return option_number(match.group(1))
+    # 番号の代わりに選択肢の本文がそのまま書かれている場合
+    for number, option in enumerate(options, start=1):
+        if option and option in value:
+            return number
+    match = re.search(r"(?<![0-9])[1-4](?![0-9])", text)
+    return int(match.group()) if match else None
+
+# 応答のテキストを先頭から1回だけ走査し、見出しごとの値を取り出す（4択・記述式の共通処理）
+# 見出しとその値はそれぞれ最初のコロンで区切るため、選択肢の本文にコロンが含まれていても崩れない
+def scan_quiz_text(quiz_text):
+    fields = {"question": None, "options": {}, "correct": None, "genre": None, "answer": None}
+    answer_lines = None
+    for raw_line in (quiz_text or "").splitlines():
+        line = raw_line.strip()
+        match = LABEL_PATTERN.match(normalize_label(line)) if line else None
+        label = match.group("label") if match else None
+        # 模範解答の本文は次の見出し（ジャンル）までをそのまま残す
+        if answer_lines is not None and label != "ジャンル":
+            answer_lines.append(raw_line.rstrip())
+            continue
+        if label is None:
+            numbered = NUMBERED_OPTION_PATTERN.match(line)
+            if numbered and fields["question"] and fields["correct"] is None:
+                fields["options"].setdefault(option_number(numbered.group("number")), numbered.group("value").strip())
+            elif line and fields["question"] == "":
+                # 「質問：」の次の行に本文が書かれている場合
+                fields["question"] = line
+            continue
+        # 値は正規化前の行から取り出す（本文中の全角記号などはそのまま表示する）
+        value = re.split(r"[:：]", line, maxsplit=1)[1] if re.search(r"[:：]", line) else match.group("value")
+        value = value.strip().strip("*").strip()
+        if label.startswith("選択肢"):
+            number = option_number(match.group("number"))
+            if number:
+                fields["options"].setdefault(number, value)
+        elif label in ("正解", "答え", "解答"):
+            fields["correct"] = value
+        elif label == "ジャンル":
+            fields["genre"] = value
+            answer_lines = None
+        elif label == "模範解答":
+            answer_lines = ["模範解答："] + ([value] if value else [])
+            fields["answer"] = answer_lines
+        elif fields["question"] is None:
+            fields["question"] = value
+    if fields["answer"] is not None:
+        fields["answer"] = "\n".join(fields["answer"]).strip().rstrip("-").strip()
+    return fields
+
+# 1問ずつ生成した応答の形式（解析結果の検証に使う。まとめて生成する場合の QUIZ_JSON_SCHEMAS に対応）
+QUIZ_TEXT_SCHEMAS = {
+    "multiple_choice": {
+        "type": "object",
+        "required": ["question", "options", "correct"],
+        "properties": {
+            "question": {"type": "string", "minLength": 1},
+            "options": {
+                "type": "array",
+                "items": {"type": "string", "minLength": 1},
+                "minItems": 4,
+                "maxItems": 4,
+            },
+            "correct": {"type": "integer", "minimum": 1, "maximum": 4},
+        },
+    },
+    "written_answer": {
+        "type": "object",
+        "required": ["question", "answer"],
+        "properties": {
+            "question": {"type": "string", "minLength": 1},
+            "answer": {"type": "string", "minLength": len("模範解答：") + 1},
+        },
+    },
+}
+
+# 問題の形式が正しくない場合の例外（problems は形式の修正を依頼するときにそのまま伝える）
+class QuizFormatError(ValueError):
+    def __init__(self, problems):
+        super().__init__("、".join(problems))
+        self.problems = problems
+
+# 応答を解析して検証し、問題を返す（形式が正しくない場合は QuizFormatError）
+def read_quiz(quiz_type, quiz_text):
+    fields = scan_quiz_text(quiz_text)
+    problems = []
+    if not fields["question"]:
+        problems.append("「質問：」の行がありません")
+    if quiz_type == "multiple_choice":
+        options = [fields["options"].get(number) for number in range(1, 5)]
+        if not all(options) or len(fields["options"]) != 4:
+            problems.append(f"選択肢1〜4がそろっていません（{len(fields['options'])}個）")
+        correct = read_correct_answer(fields["correct"], options) if fields["correct"] else None
+        if correct is None:
+            problems.append("「正解：」の行に1〜4の番号がありません")
+        quiz = {"question": fields["question"], "options": options, "correct": correct}
+    else:
+        if not fields["answer"]:
+            problems.append("「模範解答：」の行がありません")
+        quiz = {"question": fields["question"], "answer": fields["answer"]}
+    if not problems and not matches_schema(quiz, QUIZ_TEXT_SCHEMAS[quiz_type]):
+        problems.append("問題・選択肢・模範解答のいずれかが空です")
+    if problems:
+        raise QuizFormatError(problems)
+    return quiz
+
+# 応答を解析して問題を返す（形式が正しくない場合は None）
+def parse_quiz(quiz_type, quiz_text):
+    try:
+        return read_quiz(quiz_type, quiz_text)
+    except QuizFormatError:
+        return None
+
+# 記述式問題の模範解答の観点
+WRITTEN_ANSWER_SECTIONS = ["歴史的事実の説明", "社会的背景", "影響と意義", "具体例"]
+
+# まとめて生成する問題のJSONスキーマ（プロンプトに埋め込み、応答の検証にも使う）
+QUIZ_JSON_SCHEMAS = {
+    "multiple_choice": {
+        "type": "object",
+        "required": ["genre", "question", "options", "correct"],
+        "properties": {
+            "genre": {"type": "string"},
+            "question": {"type": "string", "minLength": 1},
+            "options": {
+                "type": "array",
+                "items": {"type": "string", "minLength": 1},
+                "minItems": 4,
+                "maxItems": 4,
+            },
+            "correct": {"type": "integer", "minimum": 1, "maximum": 4},
+        },
+    },
+    "written_answer": {
+        "type": "object",
+        "required": ["genre", "question", "model_answer"],
+        "properties": {
+            "genre": {"type": "string"},
+            "question": {"type": "string", "minLength": 1},
+            "model_answer": {
+                "type": "object",
+                "required": WRITTEN_ANSWER_SECTIONS,
+                "properties": {
+                    section: {"type": "string", "minLength": 1} for section in WRITTEN_ANSWER_SECTIONS
+                },
+            },
+        },
+    },
+}
+
+# JSONスキーマの簡易検証（このアプリで使うキーワードのみ対応）
+def matches_schema(value, schema):
+    expected = schema.get("type")
+    if expected == "object":
+        if not isinstance(value, dict):
+            return False
+        if any(key not in value for key in schema.get("required", [])):
+            return False
+        return all(
+            matches_schema(value[key], sub_schema)
+            for key, sub_schema in schema.get("properties", {}).items()
+            if key in value
+        )
+    if expected == "array":
+        if not isinstance(value, list):
+            return False
+        if not schema.get("minItems", 0) <= len(value) <= schema.get("maxItems", len(value)):
+            return False
+        return all(matches_schema(item, schema.get("items", {})) for item in value)
+    if expected == "string":
+        return isinstance(value, str) and len(value.strip()) >= schema.get("minLength", 0)
+    if expected == "integer":
+        if isinstance(value, bool) or not isinstance(value, int):
+            return False
+        return schema.get("minimum", value) <= value <= schema.get("maximum", value)
+    return True
+
+# 観点ごとの模範解答を記述式クイズで表示する形式のテキストに変換
+def format_model_answer(model_answer):
+    sections = [f"・{section}：\n{model_answer[section].strip()}" for section in WRITTEN_ANSWER_SECTIONS]
+    return "模範解答：\n" + "\n\n".join(sections)
+
+# 応答からJSON配列を取り出す（コードブロックや前後の説明文が付いていても配列部分だけを読む）
+def parse_json_array(text):
+    text = text or ""
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end < start:
+        raise ValueError("JSON配列が見つかりませんでした")
+    items = json.loads(text[start:end + 1])
+    if not isinstance(items, list):
+        raise ValueError("JSON配列ではありません")
+    return items
@@ -0,0 +1,173 @@
+# 復習スケジュール（SM-2方式）による出題ジャンル・復習問題の選択
+import heapq
+import random
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from pp_app.config import EXAM_DUE_GENRE_WEIGHT, GENRES, SR_DEFER
+from pp_app.db import UserCacheRegistry, current_user_id, get_database, get_database_router, quiz_from_bank_row
+
+# 復習の期限をメモリ上の優先度付きキュー（ヒープ）で管理し、次に出題するジャンル・問題を O(log n) で取り出す
+# 期限が更新されたエントリはヒープに残したままにし、取り出すときに最新の期限と比べて読み飛ばす
+class ReviewScheduler:
+    def __init__(self, database, user_id, defer=SR_DEFER):
+        self.database = database
+        self.user_id = user_id
+        self.defer = defer
+        self._genre_due = None  # {genre: due_at}（None は未読み込み）
+        self._genre_heap = []  # [(due_at, 同着時の順番, genre)]
+        self._item_due = {}  # {(quiz_type, question): due_at}
+        self._item_heaps = {}  # {quiz_type: [(due_at, question)]}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self.database.connection() as conn:
+            genres = dict(conn.execute(
+                "SELECT genre, due_at FROM review_genres WHERE user_id = ?", (self.user_id,)
+            ).fetchall())
+            items = conn.execute(
+                "SELECT quiz_type, question, due_at FROM review_items WHERE user_id = ?", (self.user_id,)
+            ).fetchall()
+        self._genre_due = {}
+        self._genre_heap = []
+        self._item_due = {}
+        self._item_heaps = {}
+        # まだ回答していないジャンルは期限切れ（すぐに出題する）として扱う
+        for genre in GENRES:
+            self._set_genre(genre, genres.get(genre) or 0.0)
+        for quiz_type, question, due_at in items:
+            self._set_item((quiz_type, question), due_at)
+
+    def _set_genre(self, genre, due_at):
+        self._genre_due[genre] = due_at
+        heapq.heappush(self._genre_heap, (due_at, random.random(), genre))
+        # 読み飛ばすだけの古いエントリが溜まったら作り直す
+        if len(self._genre_heap) > 2 * len(self._genre_due) + 16:
+            self._genre_heap = [(due, random.random(), genre) for genre, due in self._genre_due.items()]
+            heapq.heapify(self._genre_heap)
+
+    def _set_item(self, key, due_at):
+        quiz_type, question = key
+        self._item_due[key] = due_at
+        heap = self._item_heaps.setdefault(quiz_type, [])
+        heapq.heappush(heap, (due_at, question))
+        if len(heap) > 2 * len(self._item_due) + 16:
+            heap[:] = [(due, q) for (t, q), due in self._item_due.items() if t == quiz_type]
+            heapq.heapify(heap)
+
+    # 期限が最も早いジャンルを返す（期限が来たジャンルがなければランダムに選ぶ）
+    def next_genre(self):
+        with self._lock:
+            if self._genre_due is None:
+                self._load()
+            heap = self._genre_heap
+            while heap[0][0] != self._genre_due.get(heap[0][2]):
+                heapq.heappop(heap)
+            due_at, _, genre = heap[0]
+            now = time.time()
+            if due_at > now:
+                return random.choice(GENRES)
+            # 回答が記録されるまで同じジャンルばかり選ばないよう、少し後回しにする
+            self._set_genre(genre, now + self.defer)
+            return genre
+
+    # count 個のジャンルを重み付きで選ぶ（期限が来た・horizon 秒以内に来るジャンルは due_weight 倍選ばれやすい）
+    # next_genre() と違って期限を後回しにしないため、通常の出題の順番には影響しない
+    def sample_genres(self, count, horizon=0.0, due_weight=EXAM_DUE_GENRE_WEIGHT, rng=random):
+        with self._lock:
+            if self._genre_due is None:
+                self._load()
+            cutoff = time.time() + horizon
+            weights = [due_weight if self._genre_due[genre] <= cutoff else 1.0 for genre in GENRES]
+        return rng.choices(GENRES, weights=weights, k=count)
+
+    # 復習の期限が来ている問題を1つ返す（なければNone）
+    def next_item(self, quiz_type):
+        with self._lock:
+            if self._genre_due is None:
+                self._load()
+            heap = self._item_heaps.get(quiz_type, [])
+            now = time.time()
+            while heap:
+                due_at, question = heap[0]
+                if self._item_due.get((quiz_type, question)) != due_at:
+                    heapq.heappop(heap)
+                    continue
+                if due_at > now:
+                    return None
+                self._set_item((quiz_type, question), now + self.defer)
+                return question
+            return None
+
+    # コミット済みのスケジュールの更新を反映する（update_review_schedule() の戻り値）
+    def apply(self, updates):
+        with self._lock:
+            if self._genre_due is None:
+                return
+            for kind, key, due_at in updates:
+                if kind == "genre":
+                    if key in self._genre_due:
+                        self._set_genre(key, due_at)
+                else:
+                    self._set_item(key, due_at)
+
+    # 出題できなくなった問題（問題バンクにない問題など）をキューから外す
+    def discard(self, quiz_type, question):
+        with self._lock:
+            self._item_due.pop((quiz_type, question), None)
+
+    def invalidate(self):
+        with self._lock:
+            self._genre_due = None
+
+    def stats(self):
+        with self._lock:
+            if self._genre_due is None:
+                return {"due_items": 0, "scheduled_items": 0, "next_genre": None}
+            now = time.time()
+            next_genre = min(self._genre_due, key=self._genre_due.get)
+            return {
+                "due_items": sum(1 for due_at in self._item_due.values() if due_at <= now),
+                "scheduled_items": len(self._item_due),
+                "next_genre": next_genre,
+            }
+
+@st.cache_resource
+def get_review_schedulers():
+    router = get_database_router()
+    return UserCacheRegistry(lambda user_id: ReviewScheduler(router.for_user(user_id), user_id))
+
+def get_review_scheduler():
+    return get_review_schedulers().get(current_user_id())
+
+# 復習の期限が来た問題を問題バンクから取得（なければNone）
+def pick_due_review(quiz_type):
+    scheduler = get_review_scheduler()
+    while True:
+        question = scheduler.next_item(quiz_type)
+        if question is None:
+            return None
+        try:
+            with get_database().connection() as conn:
+                row = conn.execute('''
+                    SELECT id, genre, question, options, correct_index, model_answer
+                    FROM question_bank
+                    WHERE quiz_type = ? AND question = ?
+                ''', (quiz_type, question)).fetchone()
+        except sqlite3.Error as e:
+            st.error(f"問題バンクの取得中にエラーが発生しました: {str(e)}")
+            return None
+        if row:
+            return quiz_from_bank_row(quiz_type, row)
+        scheduler.discard(quiz_type, question)
+
+# 問題生成時のジャンル選択（未回答・間違えたジャンル・復習の期限が近いジャンルを優先）
+def select_genre():
+    return get_review_scheduler().next_genre()
+
+# 模擬試験のジャンル選択（まとめて count 個。horizon は試験の制限時間の秒数）
+def sample_genres(count, horizon=0.0):
+    return get_review_scheduler().sample_genres(count, horizon)
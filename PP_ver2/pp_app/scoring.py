@@ -0,0 +1,242 @@
+# 記述式の回答の採点（ローカルの採点と、合格点付近の回答のAIによる再採点）
+import atexit
+import json
+import math
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+import streamlit as st
+
+from pp_app.answers import get_answer_writer, take_batch
+from pp_app.config import (
+    REVIEW_BATCH, REVIEW_INTERVAL, SCORING_CORPUS_TTL, WRITE_BEHIND_FLUSH_TIMEOUT, WRITTEN_BORDERLINE_MARGIN,
+    WRITTEN_FULL_CREDIT_COVERAGE, WRITTEN_PASS_SCORE,
+)
+from pp_app.db import get_database
+from pp_app.generation import estimate_tokens, get_generation_executor, get_model_registry
+from pp_app.parsing import WRITTEN_ANSWER_SECTIONS, parse_json_array
+
+# --- 記述式の採点 ---
+# 回答と模範解答を文字n-gram（2〜3文字）に分解し、観点ごとに「模範解答の重要な語句をどれだけ含むか」を
+# TF-IDFの重み付きで測る。分かち書きが不要なため日本語でもそのまま使え、ネットワークも使わない。
+
+SCORING_NGRAM_SIZES = (2, 3)
+
+# 採点用の正規化（全角・半角と大文字・小文字の統一、空白・記号・改行の除去）
+def normalize_for_scoring(text):
+    text = unicodedata.normalize('NFKC', text or "").lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PZSC")
+
+def char_ngrams(text):
+    grams = Counter()
+    for n in SCORING_NGRAM_SIZES:
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+# 模範解答のテキストを観点ごとに分割（見出しが見つからない場合は全体を1つの観点として扱う）
+SECTION_HEADING = re.compile("・?(" + "|".join(map(re.escape, WRITTEN_ANSWER_SECTIONS)) + ")[：:]")
+
+def split_model_answer(model_answer):
+    model_answer = model_answer or ""
+    matches = list(SECTION_HEADING.finditer(model_answer))
+    sections = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(model_answer)
+        # 末尾の区切り線やジャンル行は本文に含めない
+        body = re.split(r"\n\s*(?:---|ジャンル[：:])", model_answer[match.end():end])[0].strip()
+        if body and match.group(1) not in sections:
+            sections[match.group(1)] = body
+    if not sections:
+        body = model_answer.replace('模範解答：', '').strip()
+        if body:
+            sections["模範解答"] = body
+    return sections
+
+# 語句の出現文書数（問題バンクの記述式の模範解答を、観点ごとに1文書として数える）
+class DocumentFrequencies:
+    def __init__(self, documents):
+        self.size = 0
+        self.counts = Counter()
+        for document in documents:
+            self.size += 1
+            self.counts.update(char_ngrams(document).keys())
+
+    # よく使われる語句（「した」「である」など）ほど小さくなる重み
+    def idf(self, gram):
+        return math.log((1 + self.size) / (1 + self.counts.get(gram, 0))) + 1
+
+@st.cache_resource(ttl=SCORING_CORPUS_TTL)
+def get_document_frequencies():
+    try:
+        with get_database().connection() as conn:
+            rows = conn.execute('''
+                SELECT model_answer FROM question_bank
+                WHERE quiz_type = 'written_answer' AND model_answer IS NOT NULL
+            ''').fetchall()
+    except sqlite3.Error:
+        rows = []
+    return DocumentFrequencies(
+        normalize_for_scoring(section)
+        for (model_answer,) in rows
+        for section in split_model_answer(model_answer).values()
+    )
+
+# 観点の語句のうち、回答に含まれている割合（TF-IDFの重み付き、0〜1）
+def section_coverage(answer_grams, section_grams, frequencies):
+    total = 0.0
+    matched = 0.0
+    for gram, count in section_grams.items():
+        weight = frequencies.idf(gram)
+        total += count * weight
+        matched += min(count, answer_grams.get(gram, 0)) * weight
+    return matched / total if total else 0.0
+
+# 記述式の回答を採点する
+# 戻り値: {"score": 0〜100, "sections": {観点: 0〜100}, "is_correct": 合格点以上か, "borderline": AIで再採点するか}
+def score_written_answer(user_answer, model_answer, frequencies=None):
+    frequencies = frequencies or get_document_frequencies()
+    answer_grams = char_ngrams(normalize_for_scoring(user_answer))
+    sections = {}
+    for name, body in split_model_answer(model_answer).items():
+        coverage = section_coverage(answer_grams, char_ngrams(normalize_for_scoring(body)), frequencies)
+        sections[name] = round(min(1.0, coverage / WRITTEN_FULL_CREDIT_COVERAGE) * 100, 1)
+    score = round(sum(sections.values()) / len(sections), 1) if sections else 0.0
+    return {
+        "score": score,
+        "sections": sections,
+        "is_correct": score >= WRITTEN_PASS_SCORE,
+        "borderline": bool(answer_grams) and abs(score - WRITTEN_PASS_SCORE) < WRITTEN_BORDERLINE_MARGIN,
+    }
+
+# 再採点のプロンプトを作成（items: (問題, 回答, 模範解答) のリスト）
+def build_review_prompt(items):
+    answers = [
+        {"id": i, "question": question, "model_answer": model_answer, "user_answer": user_answer}
+        for i, (question, user_answer, model_answer) in enumerate(items)
+    ]
+    return f"""
+        日本の歴史の記述式問題に対する生徒の回答を、模範解答の4つの観点（{"・".join(WRITTEN_ANSWER_SECTIONS)}）に
+        照らして0〜100点で採点してください。表現の違いは減点せず、内容が合っているかで判断してください。
+        
+        出力は [{{"id": 0, "score": 75}}] の形式のJSON配列のみとし、説明文やコードブロックは含めないでください。
+        
+        {json.dumps(answers, ensure_ascii=False)}
+        """
+
+# Gemini APIでまとめて再採点し、{番号: 得点} を返す（形式が正しい項目のみ）
+def request_answer_review(items, model, executor, session_id="review"):
+    prompt = build_review_prompt(items)
+    generation_config = {"temperature": 0.0, "max_output_tokens": 32 * len(items) + 64}
+    response = executor.run(
+        lambda: model.generate_content(prompt, generation_config=generation_config),
+        session_id,
+        estimate_tokens(prompt, generation_config["max_output_tokens"]),
+    )
+    scores = {}
+    for item in parse_json_array(response.text):
+        if not isinstance(item, dict):
+            continue
+        index, score = item.get("id"), item.get("score")
+        if isinstance(index, int) and 0 <= index < len(items) and isinstance(score, (int, float)) and 0 <= score <= 100:
+            scores[index] = float(score)
+    return scores
+
+# 合格点付近の記述式の回答を溜めておき、まとめてAIで再採点してから書き込みキューに渡す
+# （再採点に失敗した場合はローカルの採点結果のまま記録する）
+class AnswerReviewer:
+    def __init__(self, model_registry, executor, writer, interval=REVIEW_INTERVAL, batch_size=REVIEW_BATCH):
+        self.model_registry = model_registry
+        self.executor = executor
+        self.writer = writer
+        self.interval = interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._wake = threading.Event()  # drain() で、まとめている途中の回答をすぐに再採点させる
+        self._stats = {"reviewed": 0, "changed": 0, "failures": 0}
+        self._thread = threading.Thread(target=self._run, name="pp-answer-reviewer", daemon=True)
+        self._thread.start()
+        # 書き込みキューの flush() で、再採点を待っている回答も先に書き込みキューに渡す
+        writer.add_source(self)
+        # プロセス終了時は再採点を待たずにローカルの採点結果で記録する
+        atexit.register(self.flush)
+
+    # answer は record_answers() と同じ形式のタプル
+    def submit(self, answer):
+        self._queue.put(answer)
+
+    def _run(self):
+        while True:
+            batch = take_batch(self._queue, self.interval, self.batch_size, wake=self._wake)
+            self._wake.clear()
+            self._review(batch)
+
+    def _review(self, batch):
+        try:
+            try:
+                scores = request_answer_review(
+                    [(question, user_answer, correct_answer) for question, user_answer, correct_answer, *_ in batch],
+                    self.model_registry.model(),
+                    self.executor,
+                )
+            except Exception:
+                scores = {}
+                self._stats["failures"] += len(batch)
+            for i, answer in enumerate(batch):
+                if i in scores:
+                    question, user_answer, correct_answer, is_correct, genre, local_score, score_detail, quiz_type, user_id = answer
+                    detail = json.loads(score_detail) if score_detail else {}
+                    detail.update({"local_score": local_score, "reviewed": True})
+                    reviewed_correct = scores[i] >= WRITTEN_PASS_SCORE
+                    self._stats["reviewed"] += 1
+                    self._stats["changed"] += 1 if reviewed_correct != is_correct else 0
+                    answer = (
+                        question, user_answer, correct_answer, reviewed_correct, genre,
+                        scores[i], json.dumps(detail, ensure_ascii=False), quiz_type, user_id,
+                    )
+                self.writer.submit(answer)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    # 溜まっている回答を REVIEW_INTERVAL を待たずに再採点して書き込みキューに渡す（review=False の場合は再採点しない）
+    # 再採点中の回答は deadline まで待ち、すべて渡せたかを返す
+    def drain(self, deadline, review=True):
+        self._wake.set()
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch and review:
+            # 再採点は別のスレッドで行い、deadline を過ぎても終わった時点で書き込みキューに渡す
+            threading.Thread(target=self._review, args=(batch,), name="pp-answer-reviewer-flush", daemon=True).start()
+        else:
+            for answer in batch:
+                self.writer.submit(answer)
+                self._queue.task_done()
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def flush(self):
+        self.drain(time.time() + WRITE_BEHIND_FLUSH_TIMEOUT, review=False)
+        self.writer.flush()
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+@st.cache_resource
+def get_answer_reviewer():
+    return AnswerReviewer(get_model_registry(), get_generation_executor(), get_answer_writer())
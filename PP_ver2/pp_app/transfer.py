@@ -0,0 +1,296 @@
+# 学習履歴のエクスポート・インポート（学習ログの画面とコマンドラインの両方から使う）
+# 行はカーソルから TRANSFER_BATCH_SIZE 件ずつ読み書きするため、件数が増えてもメモリ使用量は一定
+#
+#   python -m pp_app.transfer export history.csv --user 学習者ID
+#   python -m pp_app.transfer import history.parquet
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+from itertools import islice
+from pathlib import Path
+
+from pp_app.config import TRANSFER_BATCH_SIZE
+from pp_app.db import (
+    SQL_BUMP_STATS_VERSION, SQL_UPDATE_GENRE_STATS, DatabaseRouter, ensure_schema, get_db_path,
+    normalize_user_id, stats_version_name,
+)
+
+# 書き出す列（id はデータベースごとに異なるため含めない）
+EXPORT_COLUMNS = (
+    "timestamp", "user_id", "quiz_type", "genre", "question", "user_answer", "correct_answer",
+    "is_correct", "score", "score_detail",
+)
+# 形式と拡張子（parquet は列ごとに圧縮して保存する）
+EXPORT_FORMATS = {"csv": ".csv", "jsonl": ".jsonl", "parquet": ".parquet"}
+
+# 学習ログをキーセット方式で少しずつ読む（読み取りの間だけ接続を借りる）
+SQL_SELECT_EXPORT_ALL = f'''
+    SELECT id, {', '.join(EXPORT_COLUMNS)}
+    FROM learning_log
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+'''
+SQL_SELECT_EXPORT_USER = f'''
+    SELECT id, {', '.join(EXPORT_COLUMNS)}
+    FROM learning_log
+    WHERE user_id = ? AND (timestamp, id) > (?, ?)
+    ORDER BY timestamp, id
+    LIMIT ?
+'''
+# 取り込み済みの回答（学習者・問題・回答日時が同じ行）は追加しないため、同じファイルを2回取り込んでも重複しない
+# （回答日時がない行はこの照合ができないため、import_row() で不正な行として除く）
+SQL_IMPORT_LEARNING_LOG = '''
+    INSERT INTO learning_log
+    (timestamp, question, user_answer, correct_answer, is_correct, genre, score, score_detail, quiz_type, user_id)
+    SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10
+    WHERE NOT EXISTS (
+        SELECT 1 FROM learning_log WHERE user_id = ?10 AND question = ?2 AND timestamp = ?1
+    )
+'''
+# このトランザクションで追加した行（id がトランザクション開始時の最大値より大きい行）だけを集計する
+SQL_SELECT_IMPORTED_STATS = '''
+    SELECT user_id, genre, COUNT(*), COALESCE(SUM(is_correct), 0)
+    FROM learning_log
+    WHERE id > ?
+    GROUP BY user_id, genre
+'''
+
+# --- エクスポート ---
+
+# 1つのデータベースの学習ログを古い順に返す（user_id=None の場合は全学習者）
+def iter_learning_log(database, user_id=None, batch_size=TRANSFER_BATCH_SIZE):
+    last = ("", 0) if user_id else (0,)
+    while True:
+        with database.connection() as conn:
+            if user_id:
+                rows = conn.execute(SQL_SELECT_EXPORT_USER, (user_id, *last, batch_size)).fetchall()
+            else:
+                rows = conn.execute(SQL_SELECT_EXPORT_ALL, (*last, batch_size)).fetchall()
+        for row in rows:
+            yield row[1:]
+        if len(rows) < batch_size:
+            return
+        last = (rows[-1][1], rows[-1][0]) if user_id else (rows[-1][0],)
+
+# 学習者のデータベース（シャードを使う場合はすべてのシャード）から書き出す行を返す
+def iter_export_rows(router, user_id=None, batch_size=TRANSFER_BATCH_SIZE):
+    databases = [router.for_user(user_id)] if user_id else router.user_databases()
+    for database in databases:
+        yield from iter_learning_log(database, user_id, batch_size)
+
+def batched(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+# 各形式の書き出し（out はバイナリのファイル。戻り値は書き出した件数）
+def write_csv(rows, out, batch_size):
+    # Excelで開いても文字化けしないようにBOMを付ける
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    try:
+        writer = csv.writer(text)
+        writer.writerow(EXPORT_COLUMNS)
+        count = 0
+        for batch in batched(rows, batch_size):
+            writer.writerows(batch)
+            count += len(batch)
+        return count
+    finally:
+        text.flush()
+        text.detach()
+
+def write_jsonl(rows, out, batch_size):
+    # ensure_ascii=False の json.dumps() は呼び出しごとにエンコーダーを作るため、1つを使い回す
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    count = 0
+    for batch in batched(rows, batch_size):
+        out.write("".join(encode(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in batch).encode("utf-8"))
+        count += len(batch)
+    return count
+
+# parquet の列の型（それ以外の列は文字列）
+PARQUET_TYPES = {"is_correct": "bool_", "score": "float64"}
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([(column, getattr(pa, PARQUET_TYPES.get(column, "string"))()) for column in EXPORT_COLUMNS])
+
+def write_parquet(rows, out, batch_size):
+    # pyarrow はStreamlitの依存パッケージとしてインストールされている（parquet を使うときだけ読み込む）
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = parquet_schema()
+    is_correct = EXPORT_COLUMNS.index("is_correct")
+    count = 0
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        # 1回に書き出す行をそのまま1つの行グループにする
+        for batch in batched(rows, batch_size):
+            columns = [list(column) for column in zip(*batch)]
+            columns[is_correct] = [None if value is None else bool(value) for value in columns[is_correct]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+            ))
+            count += len(batch)
+    return count
+
+EXPORT_WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}
+
+# 学習履歴を書き出し、件数を返す（user_id=None の場合は全学習者）
+def export_learning_log(router, out, fmt, user_id=None, batch_size=TRANSFER_BATCH_SIZE):
+    with router.metrics.span(f"transfer.export.{fmt}"):
+        count = EXPORT_WRITERS[fmt](iter_export_rows(router, user_id, batch_size), out, batch_size)
+    router.metrics.increment("transfer.exported_rows", count)
+    return count
+
+# --- インポート ---
+
+# 各形式の読み込み（f はバイナリのファイル。1行ずつ {列名: 値} を返す）
+def read_csv(f, batch_size):
+    yield from csv.DictReader(io.TextIOWrapper(f, encoding="utf-8-sig", newline=""))
+
+def read_jsonl(f, batch_size):
+    for line in io.TextIOWrapper(f, encoding="utf-8"):
+        if line.strip():
+            yield json.loads(line)
+
+def read_parquet(f, batch_size):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(f).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+IMPORT_READERS = {"csv": read_csv, "jsonl": read_jsonl, "parquet": read_parquet}
+
+def read_learning_log(f, fmt, batch_size=TRANSFER_BATCH_SIZE):
+    return IMPORT_READERS[fmt](f, batch_size)
+
+# ファイル名の拡張子から形式を決める
+def format_for_path(path):
+    suffix = Path(path).suffix.lower()
+    if suffix == ".ndjson":
+        return "jsonl"
+    for fmt, extension in EXPORT_FORMATS.items():
+        if suffix == extension:
+            return fmt
+    raise ValueError(f"形式を判断できません（{', '.join(EXPORT_FORMATS.values())} のいずれかの拡張子にしてください）: {path}")
+
+def parse_is_correct(value):
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ("1", "true", "yes", "正解") else 0
+    return 1 if value else 0
+
+# 読み込んだ1行を learning_log の行にする（問題・ジャンル・回答日時がない行や得点が数値でない行は None）
+# user_id を指定した場合は、すべての行をその学習者の履歴として取り込む
+def import_row(record, user_id=None):
+    question = str(record.get("question") or "").strip()
+    genre = str(record.get("genre") or "").strip()
+    if not question or not genre:
+        return None
+    score = record.get("score")
+    try:
+        score = None if score in (None, "") else float(score)
+    except (TypeError, ValueError):
+        return None
+    timestamp = str(record.get("timestamp") or "").strip().replace("T", " ")[:19]
+    if not timestamp:
+        return None
+    return (
+        timestamp,
+        question,
+        record.get("user_answer"),
+        record.get("correct_answer"),
+        parse_is_correct(record.get("is_correct")),
+        genre,
+        score,
+        record.get("score_detail") or None,
+        record.get("quiz_type") or None,
+        normalize_user_id(user_id or record.get("user_id")),
+    )
+
+# 学習履歴を取り込む
+# 保存先のデータベースごとに batch_size 件ずつ1つのトランザクションで executemany してコミットし、
+# そのトランザクションで追加した行だけを集計してジャンル統計に加算する（既存の統計は読み直さない）。
+# 書き込みロックは batch_size 件ごとに手放すため、取り込み中も回答を記録できる
+# （途中で失敗しても、取り込み済みの行は重複として読み飛ばされるため、同じファイルを取り込み直せばよい）
+# 戻り値は {"read", "imported", "duplicates", "invalid", "users"}
+def import_learning_log(router, records, user_id=None, batch_size=TRANSFER_BATCH_SIZE):
+    summary = {"read": 0, "imported": 0, "duplicates": 0, "invalid": 0, "users": set()}
+    with router.metrics.span("transfer.import"):
+        pending = {}  # データベース → 未書き込みの行
+
+        def flush(database):
+            with database.transaction() as conn:
+                started = conn.execute("SELECT COALESCE(MAX(id), 0) FROM learning_log").fetchone()[0]
+                conn.executemany(SQL_IMPORT_LEARNING_LOG, pending.pop(database))
+                totals = conn.execute(SQL_SELECT_IMPORTED_STATS, (started,)).fetchall()
+                conn.executemany(SQL_UPDATE_GENRE_STATS, totals)
+                for imported_user in {row[0] for row in totals}:
+                    conn.execute(SQL_BUMP_STATS_VERSION, (stats_version_name(imported_user),))
+            summary["users"].update(row[0] for row in totals)
+            summary["imported"] += sum(row[2] for row in totals)
+
+        for record in records:
+            summary["read"] += 1
+            row = import_row(record, user_id)
+            if row is None:
+                summary["invalid"] += 1
+                continue
+            database = router.for_user(row[-1])
+            pending.setdefault(database, []).append(row)
+            if len(pending[database]) >= batch_size:
+                flush(database)
+        for database in list(pending):
+            flush(database)
+        summary["duplicates"] = summary["read"] - summary["invalid"] - summary["imported"]
+    router.metrics.increment("transfer.imported_rows", summary["imported"])
+    return summary
+
+# --- コマンドライン ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="学習履歴のエクスポート・インポート")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="学習履歴をファイルに書き出す")
+    export_parser.add_argument("path", help="書き出すファイル")
+    export_parser.add_argument("--user", help="この学習者の履歴だけを書き出す（省略時は全学習者）")
+    import_parser = commands.add_parser("import", help="書き出したファイルから学習履歴を取り込む")
+    import_parser.add_argument("path", help="取り込むファイル")
+    import_parser.add_argument("--user", help="すべての行をこの学習者の履歴として取り込む（省略時はファイルの user_id）")
+    for command_parser in (export_parser, import_parser):
+        command_parser.add_argument("--format", choices=EXPORT_FORMATS, help="省略時は拡張子から判断する")
+        command_parser.add_argument("--db", help="データベースファイル（省略時はアプリと同じ learning_log.db）")
+        command_parser.add_argument("--batch-size", type=int, default=TRANSFER_BATCH_SIZE, help="1回に読み書きする行数")
+    args = parser.parse_args(argv)
+
+    try:
+        fmt = args.format or format_for_path(args.path)
+        router = DatabaseRouter(args.db or get_db_path())
+        ensure_schema(router.shared)
+        user_id = normalize_user_id(args.user) if args.user else None
+        if args.command == "export":
+            with open(args.path, "wb") as out:
+                count = export_learning_log(router, out, fmt, user_id, args.batch_size)
+            print(f"{count}件の学習履歴を書き出しました: {args.path}")
+        else:
+            with open(args.path, "rb") as f:
+                summary = import_learning_log(router, read_learning_log(f, fmt, args.batch_size), user_id, args.batch_size)
+            print(
+                f"{summary['imported']}件の学習履歴を取り込みました"
+                f"（読み込み {summary['read']}件 / 取り込み済み {summary['duplicates']}件 / 不正な行 {summary['invalid']}件）"
+            )
+    except (OSError, ValueError, csv.Error, sqlite3.Error) as e:
+        print(f"エラー: {str(e)}", file=sys.stderr)
+        return 1
+    except ImportError as e:
+        print(f"parquet 形式には pyarrow が必要です: {str(e)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
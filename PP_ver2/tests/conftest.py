@@ -0,0 +1,19 @@
+# テスト用の共通設定（一時ディレクトリのデータベースを使い、学習者を切り替えられるようにする）
+import pytest
+
+from pp_app import db
+
+# 一時ディレクトリのデータベースを、アプリ全体のデータベースとして使う
+@pytest.fixture
+def router(tmp_path, monkeypatch):
+    router = db.DatabaseRouter(tmp_path / "learning_log.db")
+    db.ensure_schema(router.shared)
+    monkeypatch.setattr(db, "get_database_router", lambda: router)
+    return router
+
+# 現在の学習者を切り替える（as_user("alice") のように呼ぶ）
+@pytest.fixture
+def as_user(monkeypatch):
+    def switch(user_id):
+        monkeypatch.setattr(db, "current_user_id", lambda: user_id)
+    return switch
@@ -0,0 +1,11 @@
+# テストで使う学習ログの記録
+from pp_app import db
+
+# 学習ログに記録する回答（record_answers() の形式）
+def make_answer(user_id, question, is_correct=True, genre=db.GENRES[0], quiz_type="multiple_choice"):
+    return (question, "回答", "正解", is_correct, genre, None, None, quiz_type, user_id)
+
+def record(router, answers):
+    for user_id in {answer[8] for answer in answers}:
+        with router.for_user(user_id).transaction() as conn:
+            db.record_answers(conn, [answer for answer in answers if answer[8] == user_id])
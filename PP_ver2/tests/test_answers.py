@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import time
+import types
+
+from pp_app import answers, db, scoring, transfer
+from tests.helpers import make_answer
+
+def new_writer(router, **kwargs):
+    registry = db.UserCacheRegistry(lambda user_id: None)
+    return answers.AnswerWriter(router, registry, registry, interval=0.01, **kwargs)
+
+def count_rows(router):
+    with router.shared.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM learning_log").fetchone()[0]
+
+def test_writer_commits_queued_answers(router):
+    writer = new_writer(router)
+    for i in range(5):
+        writer.submit(make_answer("alice", f"問題 {i}"))
+    writer.flush()
+    assert count_rows(router) == 5
+    assert writer.stats()["commits"] >= 1
+
+class BrokenRouter(db.DatabaseRouter):
+    def for_user(self, user_id):
+        raise sqlite3.OperationalError("disk I/O error")
+
+def test_writer_moves_unwritable_answers_to_dead_letter_file(router, tmp_path, monkeypatch):
+    monkeypatch.setattr(answers, "WRITE_BEHIND_BACKOFF_BASE", 0)
+    writer = new_writer(BrokenRouter(tmp_path / "broken.db"), max_attempts=3)
+    writer.submit(make_answer("alice", "鎌倉幕府を開いた人物は？", is_correct=False))
+    writer.submit(make_answer("bob", "室町幕府を開いた人物は？"))
+    writer.flush()
+
+    stats = writer.stats()
+    assert stats["failures"] == 6
+    assert stats["dead_letters"] == 2
+    assert stats["pending"] == 0
+    assert writer.dead_letter_path == tmp_path / "broken_unwritten.jsonl"
+
+    # 退避したファイルはそのまま取り込める
+    with open(writer.dead_letter_path, "rb") as f:
+        summary = transfer.import_learning_log(router, transfer.read_learning_log(f, "jsonl"))
+    assert summary["imported"] == 2
+    assert summary["users"] == {"alice", "bob"}
+
+class StalledRouter(db.DatabaseRouter):
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.release = threading.Event()
+
+    def for_user(self, user_id):
+        self.release.wait()
+        return super().for_user(user_id)
+
+def test_flush_gives_up_after_timeout(tmp_path):
+    router = StalledRouter(tmp_path / "stalled.db")
+    db.ensure_schema(router.shared)
+    writer = new_writer(router)
+    writer.submit(make_answer("alice", "鎌倉幕府を開いた人物は？"))
+    while writer.stats()["pending"]:
+        time.sleep(0.01)
+
+    start = time.time()
+    assert not writer.flush(timeout=0.2)
+    assert time.time() - start < 1
+
+    router.release.set()
+    assert writer.flush(timeout=5)
+    assert writer.stats()["written"] == 1
+
+class FakeModel:
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    def model(self):
+        return self
+
+    def generate_content(self, prompt, generation_config=None):
+        self.calls += 1
+        return types.SimpleNamespace(text=self.text)
+
+class FakeExecutor:
+    def run(self, job, session_id, tokens):
+        return job()
+
+def test_flush_reviews_pending_borderline_answers(router):
+    model = FakeModel('[{"id": 0, "score": 90}]')
+    writer = new_writer(router)
+    reviewer = scoring.AnswerReviewer(model, FakeExecutor(), writer, interval=60)
+    answer = make_answer("alice", "鎌倉幕府を開いた人物は？", is_correct=False, quiz_type="written")
+    reviewer.submit(answer[:5] + (55.0, None) + answer[7:])
+
+    start = time.time()
+    assert writer.flush(timeout=5)
+    assert time.time() - start < 1
+    assert model.calls == 1
+    with router.shared.connection() as conn:
+        assert conn.execute("SELECT is_correct, score FROM learning_log").fetchall() == [(1, 90.0)]
+
+def test_flush_without_review_writes_local_scores(router):
+    model = FakeModel('[{"id": 0, "score": 90}]')
+    writer = new_writer(router)
+    reviewer = scoring.AnswerReviewer(model, FakeExecutor(), writer, interval=60)
+    answer = make_answer("alice", "鎌倉幕府を開いた人物は？", is_correct=False, quiz_type="written")
+    reviewer.submit(answer[:5] + (55.0, None) + answer[7:])
+
+    assert writer.flush(timeout=5, review=False)
+    assert model.calls == 0
+    with router.shared.connection() as conn:
+        assert conn.execute("SELECT is_correct, score FROM learning_log").fetchall() == [(0, 55.0)]
@@ -0,0 +1,55 @@
+import random
+import time
+
+from pp_app.config import GENRES
+from pp_app.exam import UNANSWERED, MockExam
+from pp_app.scheduler import ReviewScheduler
+
+def make_quiz(i, genre="鎌倉時代"):
+    return {"question": f"問題 {i}", "options": ["A", "B", "C", "D"], "correct": 2, "genre": genre}
+
+def test_grade_uses_choices_made_before_deadline():
+    exam = MockExam(3, time_limit=60)
+    exam.add([make_quiz(i) for i in range(3)])
+    assert exam.choose(0, "B", at=exam.started_at + 10)
+    assert exam.choose(1, "A", at=exam.started_at + 20)
+    # 時間切れの後の変更・新しい回答は記録しない
+    assert not exam.choose(1, "B", at=exam.deadline)
+    assert not exam.choose(2, "B", at=exam.deadline + 5)
+
+    answers = exam.grade(exam.choices(), "alice")
+    assert [(answer[1], answer[3]) for answer in answers] == [("B", True), ("A", False), (UNANSWERED, False)]
+
+def test_choices_without_time_limit():
+    exam = MockExam(2)
+    exam.add([make_quiz(i) for i in range(2)])
+    assert exam.deadline is None and exam.remaining() is None
+    assert exam.choose(0, "B", at=exam.started_at + 10 ** 6)
+    exam.choose(1, "C")
+    exam.choose(1, None)
+    assert exam.choices() == {0: "B"}
+
+def test_time_limit_starts_with_first_question():
+    exam = MockExam(2, time_limit=60)
+    assert exam.deadline is None and exam.remaining() == 60
+    time.sleep(0.05)
+    exam.add([make_quiz(0)])
+    assert exam.started_at >= exam.created_at + 0.05
+    assert exam.deadline == exam.started_at + 60
+    exam.add([make_quiz(1)])
+    assert exam.deadline == exam.started_at + 60
+
+def test_sample_genres_weights_due_genres_without_deferring_them(router):
+    scheduler = ReviewScheduler(router.shared, "alice")
+    due = GENRES[0]
+    scheduler.sample_genres(0)  # 読み込み（未回答のジャンルはすべて期限切れ）
+    scheduler.apply([("genre", genre, time.time() + 86400) for genre in GENRES if genre != due])
+    schedule = dict(scheduler._genre_due)
+
+    genres = scheduler.sample_genres(3000, due_weight=4.0, rng=random.Random(0))
+    share = genres.count(due) / len(genres)
+    assert 4 / 14 - 0.05 < share < 4 / 14 + 0.05
+    assert scheduler._genre_due == schedule
+    # 試験中に期限が来るジャンルも選ばれやすくする（すべてのジャンルが同じ重みになる）
+    genres = scheduler.sample_genres(3000, horizon=2 * 86400, due_weight=4.0, rng=random.Random(0))
+    assert 0.05 < genres.count(due) / len(genres) < 0.15
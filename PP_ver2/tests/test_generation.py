@@ -0,0 +1,79 @@
+import threading
+import types
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from pp_app.generation import GenerationExecutor, GenerationGuard, GenerationTimeoutError, stream_quiz_text
+
+def new_executor(concurrency=1, **guard_options):
+    return GenerationExecutor(GenerationGuard(**guard_options), concurrency=concurrency)
+
+def test_timed_out_request_is_cancelled_before_calling_the_api():
+    executor = new_executor()
+    release = threading.Event()
+    calls = []
+    blocker = executor.submit(lambda: release.wait(5), "session-a", 1)
+
+    with pytest.raises(GenerationTimeoutError):
+        executor.run(lambda: calls.append("late"), "session-b", 1, deadline=0.1)
+    release.set()
+    blocker.result(timeout=5)
+    # 次の依頼が処理されるまで待つ
+    assert executor.run(lambda: "next", "session-c", 1) == "next"
+    assert calls == []
+    assert executor.stats()["cancelled"] == 1
+
+def test_coalesced_request_is_kept_while_another_caller_waits():
+    executor = new_executor()
+    release = threading.Event()
+    executor.submit(lambda: release.wait(5), "session-a", 1)
+    shared = executor.submit(lambda: "shared", "session-b", 1, key="k")
+
+    with pytest.raises(GenerationTimeoutError):
+        executor.run(lambda: "other", "session-c", 1, key="k", deadline=0.1)
+    release.set()
+    assert shared.result(timeout=5) == "shared"
+
+def test_abandoned_request_is_not_retried():
+    executor = new_executor(deadline=30, max_attempts=5)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        raise google_exceptions.ServiceUnavailable("unavailable")
+
+    with pytest.raises(GenerationTimeoutError):
+        executor.run(flaky, "session-a", 1, deadline=0.01)
+    future = executor.submit(lambda: "done", "session-b", 1)
+    assert future.result(timeout=30) == "done"
+    assert len(attempts) <= 2
+
+class StreamingModel:
+    def __init__(self, *streams):
+        self.streams = list(streams)  # 呼び出しごとの応答（テキストのリスト。例外は途中で送出する）
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        for item in self.streams.pop(0):
+            if isinstance(item, Exception):
+                raise item
+            yield types.SimpleNamespace(text=item)
+
+def test_stream_retries_when_nothing_was_received():
+    executor = new_executor(deadline=30, max_attempts=3)
+    model = StreamingModel([google_exceptions.ServiceUnavailable("unavailable")], ["質問：", "鎌倉幕府\n"])
+    chunks = list(stream_quiz_text("multiple_choice", "鎌倉時代", model=model, executor=executor, session_id="s"))
+    assert chunks == ["質問：", "鎌倉幕府\n"]
+    assert executor.guard.stats()["retries"] == 1
+
+def test_stream_interrupted_after_text_counts_as_failure_without_retry():
+    executor = new_executor(deadline=30, max_attempts=3)
+    model = StreamingModel(["質問：", google_exceptions.ServiceUnavailable("unavailable")], ["使われない"])
+    received = []
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        for chunk in stream_quiz_text("multiple_choice", "鎌倉時代", model=model, executor=executor, session_id="s"):
+            received.append(chunk)
+    assert received == ["質問："]
+    stats = executor.guard.stats()
+    assert stats["failures"] == 1 and stats["retries"] == 0
+    assert len(model.streams) == 1
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+
+# 画面のモジュールを読み込むだけでは、Gemini APIのSDKを読み込まない
+def test_pages_do_not_import_the_gemini_sdk():
+    code = (
+        "import sys, pp_app.pages.quiz, pp_app.pages.written, pp_app.pages.exam, pp_app.pages.learning_log\n"
+        "print([name for name in ('google.generativeai', 'google.api_core') if name in sys.modules])"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+def test_circuit_open_error_is_retryable():
+    from pp_app.generation import CircuitOpenError, is_retryable_error
+    assert is_retryable_error(CircuitOpenError("停止中"))
+    assert is_retryable_error(TimeoutError())
+    assert not is_retryable_error(ValueError())
@@ -0,0 +1,57 @@
+import sqlite3
+import time
+
+from pp_app import db, maintenance
+
+def create_legacy_database(path, rows=2000):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE notes (body TEXT)")
+    conn.executemany("INSERT INTO notes VALUES (?)", [("x" * 200,)] * rows)
+    conn.commit()
+    conn.close()
+
+def auto_vacuum(database):
+    with database.connection() as conn:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+def test_new_database_frees_pages_incrementally(router):
+    assert auto_vacuum(router.shared) == 2
+    with router.shared.transaction() as conn:
+        conn.execute("CREATE TABLE notes (body TEXT)")
+        conn.executemany("INSERT INTO notes VALUES (?)", [("x" * 200,)] * 2000)
+    with router.shared.transaction() as conn:
+        conn.execute("DELETE FROM notes")
+    assert maintenance.incremental_vacuum(router.shared, max_pages=10) == 10
+    assert maintenance.incremental_vacuum(router.shared) > 0
+
+def test_large_legacy_database_is_only_converted_without_limit(tmp_path):
+    path = tmp_path / "legacy.db"
+    create_legacy_database(path)
+    database = db.Database(path)
+    assert auto_vacuum(database) == 0
+
+    assert maintenance.incremental_vacuum(database, convert_max_bytes=64 * 1024) == 0
+    assert auto_vacuum(database) == 0
+    assert database.metrics.snapshot()["counters"]["maintenance.vacuum_skipped"] == 1
+
+    maintenance.incremental_vacuum(database)
+    assert auto_vacuum(database) == 2
+
+def test_job_keeps_running_after_unexpected_errors(router, monkeypatch):
+    calls = []
+
+    def run_maintenance(router, retention_days, convert_max_bytes=None):
+        calls.append(convert_max_bytes)
+        if len(calls) == 1:
+            raise ValueError("不正なデータ")
+        return {"stats_fixed": set(), "rows_compacted": 0, "pages_vacuumed": 0}
+
+    monkeypatch.setattr(maintenance, "run_maintenance", run_maintenance)
+    job = maintenance.MaintenanceJob(router, None, interval=0.01)
+    deadline = time.time() + 5
+    while job.stats()["runs"] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    job.interval = 3600  # 以降はテスト中に実行させない
+    assert job.stats()["failures"] == 1 and job.stats()["runs"] >= 1
+    assert calls[0] == maintenance.APP_CONVERT_MAX_BYTES
+    assert router.metrics.snapshot()["counters"]["maintenance.failures"] == 1
@@ -0,0 +1,85 @@
+import sqlite3
+
+from pp_app import db
+from pp_app.config import DEFAULT_USER_ID
+
+# 最初のバージョン（スキーマのバージョン管理を入れる前）の pp.py の init_db() が作るデータベース
+def create_baseline_database(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS learning_log
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+         question TEXT,
+         user_answer TEXT,
+         correct_answer TEXT,
+         is_correct BOOLEAN,
+         genre TEXT)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS genre_stats
+        (genre TEXT PRIMARY KEY,
+         total_questions INTEGER DEFAULT 0,
+         correct_answers INTEGER DEFAULT 0,
+         last_updated DATETIME DEFAULT CURRENT_TIMESTAMP)
+    ''')
+    for genre in db.GENRES:
+        conn.execute(
+            "INSERT OR IGNORE INTO genre_stats (genre, total_questions, correct_answers) VALUES (?, 0, 0)",
+            (genre,)
+        )
+    rows = [
+        ("2024-01-01 10:00:00", "鎌倉幕府を開いた人物は？", "源頼朝", "源頼朝", 1, "鎌倉時代"),
+        ("2024-01-02 10:00:00", "承久の乱が起きた年は？", "1192年", "1221年", 0, "鎌倉時代"),
+        ("2024-01-03 10:00:00", "大化の改新の中心人物は？", "中大兄皇子", "中大兄皇子", 1, "飛鳥・奈良時代"),
+    ]
+    conn.executemany('''
+        INSERT INTO learning_log (timestamp, question, user_answer, correct_answer, is_correct, genre)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.execute("UPDATE genre_stats SET total_questions = 2, correct_answers = 1 WHERE genre = '鎌倉時代'")
+    conn.execute("UPDATE genre_stats SET total_questions = 1, correct_answers = 1 WHERE genre = '飛鳥・奈良時代'")
+    conn.commit()
+    conn.close()
+
+def test_migrates_baseline_database(tmp_path, monkeypatch, as_user):
+    path = tmp_path / "learning_log.db"
+    create_baseline_database(path)
+    router = db.DatabaseRouter(path)
+    monkeypatch.setattr(db, "get_database_router", lambda: router)
+    db.ensure_schema(router.shared)
+
+    with router.shared.connection() as conn:
+        assert db.get_schema_version(conn) == db.MIGRATIONS[-1][0]
+        assert conn.execute("SELECT DISTINCT user_id FROM learning_log").fetchall() == [(DEFAULT_USER_ID,)]
+        stats = dict(
+            (genre, (total, correct))
+            for genre, total, correct in conn.execute(db.SQL_SELECT_GENRE_STATS, (DEFAULT_USER_ID,))
+        )
+        versions = [name for (name,) in conn.execute("SELECT name FROM cache_versions")]
+        review_genres = {
+            genre: repetitions
+            for genre, repetitions in conn.execute("SELECT genre, repetitions FROM review_genres WHERE user_id = ?", (DEFAULT_USER_ID,))
+        }
+    assert stats["鎌倉時代"] == (2, 1)
+    assert versions == [f"genre_stats:{DEFAULT_USER_ID}"]
+    assert stats["飛鳥・奈良時代"] == (1, 1)
+    # 復習スケジュールは学習ログから作り直す（鎌倉時代は最後の回答が不正解なので学び直し）
+    assert review_genres == {"鎌倉時代": 0, "飛鳥・奈良時代": 1}
+
+    # 以前の学習ログも全文検索できる
+    as_user(DEFAULT_USER_ID)
+    logs, _ = db.search_learning_log("承久の乱", 20)
+    assert [log[2] for log in logs] == ["承久の乱が起きた年は？"]
+
+def test_migration_is_idempotent(tmp_path):
+    path = tmp_path / "learning_log.db"
+    create_baseline_database(path)
+    db.migrate_database(db.Database(path))
+    db.migrate_database(db.Database(path))
+
+    database = db.Database(path)
+    with database.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(db.MIGRATIONS)
+        assert conn.execute("SELECT COUNT(*) FROM learning_log").fetchone()[0] == 3
+        assert conn.execute("SELECT COUNT(*) FROM review_genres").fetchone()[0] == 2
@@ -0,0 +1,26 @@
+from pp_app.novelty import NoveltyIndex, question_signature, signature_similarity
+
+def test_signature_ignores_width_and_punctuation():
+    a = question_signature("鎌倉幕府を開いた人物は誰ですか？")
+    b = question_signature("鎌倉幕府を開いた人物は誰ですか ?")
+    c = question_signature("室町幕府を滅ぼした戦国大名は誰ですか？")
+    assert signature_similarity(a, b) == 1.0
+    assert signature_similarity(a, c) < 0.5
+
+def test_finds_recent_duplicates_per_user(router):
+    alice = NoveltyIndex(router.for_user("alice"), "alice", window=2)
+    alice.add("鎌倉幕府を開いた人物は誰ですか？")
+    match = alice.find_duplicate("鎌倉幕府を開いた人物は誰でしょうか？")
+    assert match is not None and match[1] == "鎌倉幕府を開いた人物は誰ですか？"
+    assert alice.find_duplicate("大化の改新の中心となった人物は誰ですか？") is None
+
+    bob = NoveltyIndex(router.for_user("bob"), "bob", window=2)
+    assert bob.find_duplicate("鎌倉幕府を開いた人物は誰ですか？") is None
+
+    # 保存した署名は読み込み直しても使え、window 件より古い問題は照合しない
+    alice.add("大化の改新の中心となった人物は誰ですか？")
+    alice.add("応仁の乱が始まった年はいつですか？")
+    reloaded = NoveltyIndex(router.for_user("alice"), "alice", window=2)
+    assert reloaded.find_duplicate("鎌倉幕府を開いた人物は誰ですか？") is None
+    assert reloaded.find_duplicate("応仁の乱が始まった年はいつですか？")[0] == 1.0
+    assert reloaded.stats() == {"checks": 2, "duplicates": 1, "history": 2}
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from pp_app.packs import QuestionPack, remove_near_duplicates, write_pack
+from pp_app.pages import common
+
+def multiple_choice(question, genre="鎌倉時代"):
+    return {"type": "multiple_choice", "genre": genre, "question": question, "options": ["A", "B", "C", "D"], "correct": 1}
+
+def test_write_and_sample_pack(tmp_path):
+    path = tmp_path / "question_pack.ppq"
+    counts = write_pack(path, [
+        multiple_choice("鎌倉幕府を開いた人物は誰ですか？"),
+        multiple_choice("鎌倉幕府を開いた人物は誰ですか?"),  # ほぼ同じ問題は除く
+        multiple_choice("承久の乱が起きた年はいつですか？"),
+        multiple_choice("大化の改新の中心人物は誰ですか？", genre="飛鳥・奈良時代"),
+        multiple_choice("ジャンルが出題ジャンルにない問題", genre="未来"),
+        {"type": "written_answer", "genre": "鎌倉時代", "question": "鎌倉幕府が成立した背景を説明しなさい。", "answer": "模範解答：武士の台頭"},
+    ])
+    assert counts == {
+        "multiple_choice": {"鎌倉時代": 2, "飛鳥・奈良時代": 1},
+        "written_answer": {"鎌倉時代": 1},
+    }
+
+    pack = QuestionPack(path)
+    try:
+        assert pack.total == 4
+        assert pack.count("multiple_choice") == 3
+        assert pack.count("multiple_choice", "飛鳥・奈良時代") == 1
+        assert pack.count("written_answer", "平安時代") == 0
+        quiz = pack.sample("multiple_choice", "飛鳥・奈良時代", rng=random.Random(0))
+        assert quiz == multiple_choice("大化の改新の中心人物は誰ですか？", genre="飛鳥・奈良時代")
+        # 問題がないジャンルは、同じ問題形式のすべての問題から選ぶ
+        assert pack.sample("written_answer", "平安時代")["genre"] == "鎌倉時代"
+    finally:
+        pack.close()
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "question_pack.ppq"
+    path.write_bytes(b"not a pack")
+    with pytest.raises(ValueError):
+        QuestionPack(path)
+
+def test_remove_near_duplicates_across_calls():
+    seen = {}
+    assert len(remove_near_duplicates([multiple_choice("鎌倉幕府を開いた人物は誰ですか？")], seen=seen)) == 1
+    kept = remove_near_duplicates([
+        multiple_choice("鎌倉幕府を開いた人物は誰ですか？"),
+        multiple_choice("鎌倉幕府を開いた人物は誰ですか？", genre="平安時代"),
+    ], seen=seen)
+    assert [quiz["genre"] for quiz in kept] == ["平安時代"]
+
+def test_pick_from_pack_does_not_write_to_the_bank(router, tmp_path, monkeypatch):
+    path = tmp_path / "question_pack.ppq"
+    write_pack(path, [multiple_choice("鎌倉幕府を開いた人物は誰ですか？")])
+    pack = QuestionPack(path)
+    monkeypatch.setattr(common, "get_question_pack", lambda: pack)
+    monkeypatch.setattr(common, "find_recent_duplicate", lambda quiz: None)
+    try:
+        quiz = common.pick_from_pack("multiple_choice", "鎌倉時代")
+    finally:
+        pack.close()
+    assert quiz["question"] == "鎌倉幕府を開いた人物は誰ですか？" and "id" not in quiz
+    with router.shared.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM question_bank").fetchone()[0] == 0
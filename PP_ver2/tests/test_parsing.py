@@ -0,0 +1,77 @@
+import pytest
+
+from pp_app.parsing import QuizFormatError, read_quiz, scan_quiz_text
+
+def test_full_width_labels_and_answer():
+    quiz = read_quiz("multiple_choice", "\n".join([
+        "質問：鎌倉幕府を開いた人物は？",
+        "選択肢１：源頼朝",
+        "選択肢２：足利尊氏",
+        "選択肢３：北条時宗",
+        "選択肢４：徳川家康",
+        "正解：１",
+    ]))
+    assert quiz == {"question": "鎌倉幕府を開いた人物は？", "options": ["源頼朝", "足利尊氏", "北条時宗", "徳川家康"], "correct": 1}
+
+def test_markdown_labels_and_numbered_options():
+    fields = scan_quiz_text("\n".join([
+        "**質問：** 承久の乱で朝廷側の中心となった人物は？",
+        "1. 後鳥羽上皇",
+        "(2) 後醍醐天皇",
+        "③ 北条義時",
+        "4：源実朝",
+        "**正解：** 1番",
+        "ジャンル：鎌倉時代",
+    ]))
+    assert fields["question"] == "承久の乱で朝廷側の中心となった人物は？"
+    assert fields["options"] == {1: "後鳥羽上皇", 2: "後醍醐天皇", 3: "北条義時", 4: "源実朝"}
+    assert fields["genre"] == "鎌倉時代"
+    assert read_quiz("multiple_choice", "\n".join([
+        "**質問：** 承久の乱で朝廷側の中心となった人物は？",
+        "1. 後鳥羽上皇", "(2) 後醍醐天皇", "③ 北条義時", "4：源実朝",
+        "**正解：** ３番",
+    ]))["correct"] == 3
+
+def test_option_text_with_colon_and_question_on_next_line():
+    quiz = read_quiz("multiple_choice", "\n".join([
+        "質問：",
+        "次のうち正しいものは？",
+        "選択肢A：年号：1192年",
+        "選択肢B：年号：1185年",
+        "選択肢C：年号：1221年",
+        "選択肢D：年号：1274年",
+        "正解：年号：1185年",
+    ]))
+    assert quiz["question"] == "次のうち正しいものは？"
+    assert quiz["options"][0] == "年号：1192年"
+    assert quiz["correct"] == 2
+
+def test_missing_correct_answer_and_options():
+    with pytest.raises(QuizFormatError) as error:
+        read_quiz("multiple_choice", "質問：鎌倉幕府を開いた人物は？\n選択肢1：源頼朝\n選択肢2：足利尊氏")
+    assert error.value.problems == [
+        "選択肢1〜4がそろっていません（2個）",
+        "「正解：」の行に1〜4の番号がありません",
+    ]
+
+def test_written_answer_keeps_sections_until_genre():
+    quiz = read_quiz("written_answer", "\n".join([
+        "質問：鎌倉幕府が成立した背景を説明しなさい。",
+        "模範解答：",
+        "・歴史的事実の説明：源頼朝が守護・地頭を設置した。",
+        "・社会的背景：武士の台頭。",
+        "---",
+        "ジャンル：鎌倉時代",
+    ]))
+    assert quiz["answer"] == "模範解答：\n・歴史的事実の説明：源頼朝が守護・地頭を設置した。\n・社会的背景：武士の台頭。"
+
+def test_written_answer_requires_model_answer():
+    with pytest.raises(QuizFormatError) as error:
+        read_quiz("written_answer", "質問：鎌倉幕府が成立した背景を説明しなさい。")
+    assert error.value.problems == ["「模範解答：」の行がありません"]
+
+def test_partial_text():
+    fields = scan_quiz_text("質問：鎌倉幕府を開いた人物は？\n選択肢1：源頼朝\n選択肢2：足")
+    assert fields["question"] == "鎌倉幕府を開いた人物は？"
+    assert fields["correct"] is None
+    assert scan_quiz_text("")["question"] is None
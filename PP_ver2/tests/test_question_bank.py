@@ -0,0 +1,33 @@
+import json
+import random
+
+from pp_app import db
+from tests.helpers import make_answer, record
+
+def fill_bank(router, count):
+    with router.shared.transaction() as conn:
+        conn.executemany(db.SQL_INSERT_QUESTION_BANK, [
+            ("multiple_choice", db.GENRES[i % 2], f"問題 {i}", json.dumps(["A", "B", "C", "D"]), 1, None)
+            for i in range(count)
+        ])
+
+def test_picks_unanswered_questions_of_the_genre(router, as_user):
+    as_user("alice")
+    fill_bank(router, 40)
+    record(router, [make_answer("alice", f"問題 {i}") for i in range(0, 40, 2) if i != 10])
+
+    random.seed(0)
+    for _ in range(20):
+        quiz = db.pick_from_question_bank("multiple_choice", db.GENRES[0])
+        assert quiz["question"] == "問題 10"
+    assert db.pick_from_question_bank("multiple_choice", db.GENRES[0], exclude_ids=(quiz["id"],)) is None
+    assert db.pick_from_question_bank("written_answer", None) is None
+
+def test_picks_from_every_part_of_the_bank(router, as_user):
+    as_user("alice")
+    fill_bank(router, 200)
+    random.seed(0)
+    picked = {db.pick_from_question_bank("multiple_choice", None)["id"] for _ in range(50)}
+    assert min(picked) < 50 and max(picked) > 150
+    quiz = db.pick_from_question_bank("multiple_choice", db.GENRES[1], include_answered=True)
+    assert quiz["genre"] == db.GENRES[1] and quiz["options"] == ["A", "B", "C", "D"]
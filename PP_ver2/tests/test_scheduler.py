@@ -0,0 +1,35 @@
+from pp_app import db
+from pp_app.config import SR_INITIAL_EASE, SR_MIN_EASE, SR_RELEARN_DELAY
+
+DAY = 86400
+
+def test_sm2_intervals_grow_with_correct_answers():
+    now = 1_000_000.0
+    state = db.sm2_next(None, 4, now)
+    assert state[:3] == (1, 1.0, SR_INITIAL_EASE) and state[3] == now + DAY
+    state = db.sm2_next(state[:3], 4, now)
+    assert state[:2] == (2, 6.0)
+    state = db.sm2_next(state[:3], 5, now)
+    assert state[0] == 3 and state[1] == 6.0 * SR_INITIAL_EASE
+    assert state[2] > SR_INITIAL_EASE
+
+def test_sm2_wrong_answer_relearns_and_ease_has_floor():
+    now = 1_000_000.0
+    state = (3, 15.0, 1.4)
+    for _ in range(5):
+        state = db.sm2_next(state[:3], db.review_quality(False, None), now)
+        assert state[:2] == (0, 0.0) and state[3] == now + SR_RELEARN_DELAY
+    assert state[2] == SR_MIN_EASE
+
+def test_update_review_schedule(router):
+    now = 1_000_000.0
+    answers = [
+        ("問題1", "回答", "正解", True, "鎌倉時代", None, None, "multiple_choice", "alice"),
+        ("問題2", "回答", "模範解答", False, "鎌倉時代", 30.0, None, "written_answer", "alice"),
+    ]
+    with router.shared.transaction() as conn:
+        updates = db.update_review_schedule(conn, answers, now)
+        genre = conn.execute(db.SQL_SELECT_REVIEW_GENRE, ("alice", "鎌倉時代")).fetchone()
+    # 同じジャンルの2回目（記述式の30点）で学び直しになる
+    assert genre[0] == 0
+    assert updates["alice"][-1] == ("item", ("written_answer", "問題2"), now + SR_RELEARN_DELAY)
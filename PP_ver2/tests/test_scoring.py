@@ -0,0 +1,32 @@
+from pp_app.config import WRITTEN_PASS_SCORE
+from pp_app.scoring import DocumentFrequencies, score_written_answer, split_model_answer
+
+MODEL_ANSWER = "\n".join([
+    "模範解答：",
+    "・歴史的事実の説明：源頼朝が守護と地頭を設置し、鎌倉に幕府を開いた。",
+    "・社会的背景：平氏の滅亡後、武士が各地で力を強めていた。",
+    "・影響と意義：武士による政治が約700年続く始まりとなった。",
+    "・具体例：御恩と奉公による主従関係が結ばれた。",
+    "---",
+    "ジャンル：鎌倉時代",
+])
+
+def test_split_model_answer():
+    sections = split_model_answer(MODEL_ANSWER)
+    assert list(sections) == ["歴史的事実の説明", "社会的背景", "影響と意義", "具体例"]
+    assert sections["具体例"] == "御恩と奉公による主従関係が結ばれた。"
+    assert split_model_answer("模範解答：武士の政権が成立した。") == {"模範解答": "武士の政権が成立した。"}
+
+def test_score_written_answer():
+    frequencies = DocumentFrequencies([])
+    full = score_written_answer(MODEL_ANSWER.replace("・", ""), MODEL_ANSWER, frequencies)
+    assert full["score"] == 100.0 and full["is_correct"] and not full["borderline"]
+
+    partial = score_written_answer("源頼朝が守護と地頭を設置し、鎌倉に幕府を開いた。", MODEL_ANSWER, frequencies)
+    assert partial["sections"]["歴史的事実の説明"] == 100.0
+    assert partial["sections"]["具体例"] < 50
+    assert 0 < partial["score"] < full["score"]
+
+    empty = score_written_answer("", MODEL_ANSWER, frequencies)
+    assert empty["score"] == 0.0 and not empty["is_correct"] and not empty["borderline"]
+    assert empty["score"] < WRITTEN_PASS_SCORE
@@ -0,0 +1,59 @@
+import time
+from datetime import date
+
+from pp_app import db
+from tests.helpers import make_answer, record
+
+def test_search_keeps_own_matches_when_others_have_newer_ones(router, as_user, monkeypatch):
+    monkeypatch.setattr(db, "SEARCH_RANK_WINDOW", 10)
+    record(router, [make_answer("alice", f"鎌倉幕府を開いた人物は？ {i}") for i in range(5)])
+    record(router, [make_answer("bob", f"鎌倉幕府が滅びた年は？ {i}") for i in range(20)])
+
+    as_user("alice")
+    logs, has_next = db.search_learning_log("鎌倉幕府", 20)
+    assert len(logs) == 5
+    assert not has_next
+    assert all("開いた人物" in log[2] for log in logs)
+
+    as_user("bob")
+    logs, _ = db.search_learning_log("鎌倉幕府", 20)
+    assert len(logs) == 10
+
+def test_search_window_counts_only_filtered_matches(router, as_user, monkeypatch):
+    monkeypatch.setattr(db, "SEARCH_RANK_WINDOW", 10)
+    as_user("alice")
+    record(router, [make_answer("alice", f"鎌倉幕府の執権 {i}", is_correct=False) for i in range(3)])
+    record(router, [make_answer("alice", f"鎌倉幕府の将軍 {i}", is_correct=True) for i in range(20)])
+
+    logs, _ = db.search_learning_log("鎌倉幕府", 20, is_correct=False)
+    assert len(logs) == 3
+
+def test_search_short_terms_and_highlight(router, as_user):
+    as_user("alice")
+    record(router, [make_answer("alice", "鎌倉幕府の成立"), make_answer("alice", "室町幕府の成立")])
+
+    logs, _ = db.search_learning_log("幕府 鎌倉", 20)
+    assert [log[2] for log in logs] == ["鎌倉幕府の成立"]
+    logs, _ = db.search_learning_log("室町幕府", 20)
+    assert logs[0][-1] == "**室町幕府**の成立"
+
+def test_date_filter_uses_local_dates(router, as_user, monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    as_user("alice")
+    record(router, [make_answer("alice", "元日の夜の問題"), make_answer("alice", "二日の朝の問題")])
+    with router.for_user("alice").transaction() as conn:
+        # 日本時間の 2024-01-01 23:00 と 2024-01-02 01:00
+        conn.execute("UPDATE learning_log SET timestamp = '2024-01-01 14:00:00' WHERE question = '元日の夜の問題'")
+        conn.execute("UPDATE learning_log SET timestamp = '2024-01-01 16:00:00' WHERE question = '二日の朝の問題'")
+
+    try:
+        logs, _ = db.fetch_learning_log_page(20, date_from=date(2024, 1, 2), date_to=date(2024, 1, 2))
+        assert [log[2] for log in logs] == ["二日の朝の問題"]
+        logs, _ = db.fetch_learning_log_page(20, date_from=date(2024, 1, 1), date_to=date(2024, 1, 1))
+        assert [log[2] for log in logs] == ["元日の夜の問題"]
+        logs, _ = db.search_learning_log("問題", 20, date_from=date(2024, 1, 2), date_to=date(2024, 1, 2))
+        assert [log[2] for log in logs] == ["二日の朝の問題"]
+    finally:
+        monkeypatch.undo()
+        time.tzset()
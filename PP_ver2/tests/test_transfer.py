@@ -0,0 +1,69 @@
+import io
+
+import pytest
+
+from pp_app import db
+from pp_app.transfer import export_learning_log, import_learning_log, iter_learning_log, read_learning_log
+from tests.helpers import make_answer, record
+
+def seed(router):
+    record(router, [
+        make_answer("alice", "鎌倉幕府を開いた人物は？"),
+        make_answer("alice", "承久の乱が起きた年は？", is_correct=False),
+        ("元寇の影響を説明しなさい。", "御家人が困窮した", "模範解答：…", False, "鎌倉時代", 55.0, '{"具体例": 40.0}', "written_answer", "alice"),
+        make_answer("bob", "大化の改新の中心人物は？", genre="飛鳥・奈良時代"),
+    ])
+
+def genre_stats(router, user_id):
+    with router.for_user(user_id).connection() as conn:
+        return sorted(conn.execute(db.SQL_SELECT_GENRE_STATS, (user_id,)).fetchall())
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl", "parquet"])
+def test_export_import_round_trip(router, tmp_path, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow.parquet", exc_type=ImportError)
+    seed(router)
+    out = io.BytesIO()
+    assert export_learning_log(router, out, fmt) == 4
+
+    target = db.DatabaseRouter(tmp_path / "imported.db")
+    db.ensure_schema(target.shared)
+    summary = import_learning_log(target, read_learning_log(io.BytesIO(out.getvalue()), fmt))
+    assert summary == {"read": 4, "imported": 4, "duplicates": 0, "invalid": 0, "users": {"alice", "bob"}}
+    assert list(iter_learning_log(target.shared)) == list(iter_learning_log(router.shared))
+    for user_id in ("alice", "bob"):
+        assert genre_stats(target, user_id) == genre_stats(router, user_id)
+
+    # 同じファイルをもう一度取り込んでも重複しない
+    summary = import_learning_log(target, read_learning_log(io.BytesIO(out.getvalue()), fmt))
+    assert (summary["imported"], summary["duplicates"]) == (0, 4)
+    assert genre_stats(target, "alice") == genre_stats(router, "alice")
+
+def test_export_one_user_and_import_as_another(router, tmp_path):
+    seed(router)
+    out = io.BytesIO()
+    assert export_learning_log(router, out, "jsonl", user_id="bob") == 1
+
+    records = list(read_learning_log(io.BytesIO(out.getvalue()), "jsonl"))
+    records.append({"question": "", "genre": "鎌倉時代"})
+    records.append({"question": "問題", "genre": "鎌倉時代", "score": "高い"})
+    summary = import_learning_log(router, records, user_id="carol")
+    assert summary == {"read": 3, "imported": 1, "duplicates": 0, "invalid": 2, "users": {"carol"}}
+    assert genre_stats(router, "carol") == [("飛鳥・奈良時代", 1, 1)]
+
+def test_import_commits_in_batches_and_rejects_rows_without_timestamp(router, tmp_path):
+    seed(router)
+    out = io.BytesIO()
+    export_learning_log(router, out, "jsonl")
+    records = list(read_learning_log(io.BytesIO(out.getvalue()), "jsonl"))
+    records.append({**records[0], "question": "回答日時のない行", "timestamp": None})
+
+    target = db.DatabaseRouter(tmp_path / "imported.db")
+    db.ensure_schema(target.shared)
+    writes = target.metrics.snapshot()["spans"]["db.write"]["count"]
+    summary = import_learning_log(target, records, batch_size=1)
+    assert (summary["imported"], summary["invalid"]) == (4, 1)
+    assert target.metrics.snapshot()["spans"]["db.write"]["count"] == writes + 4
+    summary = import_learning_log(target, records, batch_size=1)
+    assert (summary["imported"], summary["duplicates"], summary["invalid"]) == (0, 4, 1)
+    assert genre_stats(target, "alice") == genre_stats(router, "alice")